@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mymath.middleware.MetricsMiddleware', # セッションの書き込みまで計測するので先頭に置く
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,6 +58,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'mymath.middleware.ProfilerMiddleware', # request.user を使うので認証より後に置く
 ]
 
 ROOT_URLCONF = 'djangomath.urls'
@@ -92,10 +94,61 @@ DATABASES = {
         'PASSWORD': env("DB_PASSWORD", default=""),
         'HOST': env("DB_HOST", default=""),
         "PORT": env("DB_PORT", default=""),
-
+        # 接続をリクエストごとに閉じずに使い回す秒数(ASGIで動かすときは0のままにして接続プールを使う)
+        "CONN_MAX_AGE": env.int("DB_CONN_MAX_AGE", default=0),
+        "CONN_HEALTH_CHECKS": env.bool("DB_CONN_HEALTH_CHECKS", default=False),
     }
 }
 
+# SQLite を本番で使うときは SQLITE_PROFILE=production にする(WAL、BEGIN IMMEDIATE など。djangomath/sqlite.py)
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3" and env("SQLITE_PROFILE", default="") == "production":
+    from djangomath.sqlite import production_options
+
+    DATABASES["default"]["OPTIONS"] = production_options(
+        timeout=env.int("SQLITE_TIMEOUT", default=20),
+        mmap_size=env.int("SQLITE_MMAP_SIZE", default=256 * 1024 * 1024),
+        cache_size_kib=env.int("SQLITE_CACHE_SIZE_KIB", default=64 * 1024),
+    )
+
+# PostgreSQL の接続プール(psycopg[pool] が必要)。プールを使うときは CONN_MAX_AGE を 0 にする
+if DATABASES["default"]["ENGINE"] == "django.db.backends.postgresql" and env.bool("DB_POOL", default=False):
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": env.int("DB_POOL_MIN_SIZE", default=2),
+            "max_size": env.int("DB_POOL_MAX_SIZE", default=10),
+            "timeout": env.int("DB_POOL_TIMEOUT", default=10),
+        },
+    }
+
+# 読み込み専用のレプリカ。DB_REPLICA_HOST か DB_REPLICA_NAME を指定すると、読み込みをレプリカに送る
+# (mymath/routers.py)。指定しない項目はプライマリーと同じ。SQLite で試すときは DB_REPLICA_NAME に同じファイルを指定する
+MYMATH_REPLICA_STICKY_SECONDS = env.int("MYMATH_REPLICA_STICKY_SECONDS", default=10)
+if env("DB_REPLICA_HOST", default="") or env("DB_REPLICA_NAME", default=""):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": env("DB_REPLICA_NAME", default=DATABASES["default"]["NAME"]),
+        "USER": env("DB_REPLICA_USER", default=DATABASES["default"]["USER"]),
+        "PASSWORD": env("DB_REPLICA_PASSWORD", default=DATABASES["default"]["PASSWORD"]),
+        "HOST": env("DB_REPLICA_HOST", default=DATABASES["default"]["HOST"]),
+        "PORT": env("DB_REPLICA_PORT", default=DATABASES["default"]["PORT"]),
+        "OPTIONS": dict(DATABASES["default"].get("OPTIONS", {})),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_ROUTERS = ["mymath.routers.PrimaryReplicaRouter"]
+    # 書き込み直後の読み込みをプライマリーに固定する。ログイン直後のユーザーもプライマリーから読むよう認証より前に置く
+    MIDDLEWARE.insert(MIDDLEWARE.index("django.contrib.sessions.middleware.SessionMiddleware"),
+                      "mymath.middleware.ReplicaStickinessMiddleware")
+
+
+# Cache
+# スナップショットのバージョン番号とランキングを置く(mymath/cache.py, mymath/ranking.py)。
+# 既定はプロセスごとの LocMemCache なので、複数プロセスで動かすときは redis:// や dbcache:// を指定する
+CACHES = {"default": env.cache_url("CACHE_URL", default="locmemcache://")}
+
+# 動かすプロセス(ワーカー)の数。2以上のときはプロセスごとのキャッシュをシステムチェックでエラーにする(mymath/checks.py)
+MYMATH_WORKERS = env.int("MYMATH_WORKERS", default=1)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -141,3 +194,19 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
+# 未ログインユーザーの受験状況の保存先 "session" または "cookie"(署名付きCookie、DBに書き込まない)
+MYMATH_ANONYMOUS_STATE = env("MYMATH_ANONYMOUS_STATE", default="session")
+
+# True のときは index / exam / answer / result に非同期版(mymath/async_views.py)を使う。ASGIで動かすとき向け
+MYMATH_ASYNC_VIEWS = env.bool("MYMATH_ASYNC_VIEWS", default=False)
+
+# ログインユーザーの解答を後からまとめて保存する(mymath/answer_buffer.py)。"" で使わない、"local" でプロセス内にためる
+# INTERVAL ミリ秒ごとか SIZE 件たまったときに保存する。INTERVAL が 0 のときは別スレッドを使わない
+MYMATH_ANSWER_BUFFER = env("MYMATH_ANSWER_BUFFER", default="")
+MYMATH_ANSWER_BUFFER_INTERVAL = env.int("MYMATH_ANSWER_BUFFER_INTERVAL", default=200)
+MYMATH_ANSWER_BUFFER_SIZE = env.int("MYMATH_ANSWER_BUFFER_SIZE", default=200)
+
+
+# スタッフ用プロファイラー(?_profile=1)の保存先と、残しておく件数
+MYMATH_PROFILE_DIR = env("MYMATH_PROFILE_DIR", default=str(BASE_DIR / "profiles"))
+MYMATH_PROFILE_KEEP = env.int("MYMATH_PROFILE_KEEP", default=50)
@@ -0,0 +1,27 @@
+"""SQLite を本番で使うときの接続設定
+
+settings.py で SQLITE_PROFILE=production のときに DATABASES["default"]["OPTIONS"] に使う。
+bench_sqlite コマンドでも、既定の設定と比べるために使う。
+
+- journal_mode=WAL       読み込みが書き込みを待たなくなる
+- synchronous=NORMAL     WALではコミットのたびにfsyncしない(電源断で直前のコミットが失われることはあるが壊れない)
+- mmap_size, cache_size  読み込みをメモリで済ませる
+- timeout                ロックを待つ秒数(busy_timeout)
+- transaction_mode       BEGIN IMMEDIATE で最初に書き込みロックを取る。
+                         読み込みから書き込みに切り替えるときのロックの取り合いで
+                         待たずに "database is locked" になるのを防ぐ
+"""
+
+
+def production_options(timeout=20, mmap_size=256 * 1024 * 1024, cache_size_kib=64 * 1024):
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA mmap_size={mmap_size}",
+        f"PRAGMA cache_size=-{cache_size_kib}",  # 負の値はKiB単位
+    ]
+    return {
+        "init_command": ";".join(pragmas),
+        "timeout": timeout,
+        "transaction_mode": "IMMEDIATE",
+    }
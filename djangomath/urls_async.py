@@ -0,0 +1,15 @@
+"""MYMATH_ASYNC_VIEWS の設定にかかわらず、非同期版のページを使う URLconf
+
+テストと loadtest --async で使う。
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+from mymath.urls import build_urlpatterns
+
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path("", include((build_urlpatterns(use_async=True), "mymath"))),
+    path("accounts/", include("accounts.urls")),
+]
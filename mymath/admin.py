@@ -1,10 +1,120 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
+
+from .models import (
+    Category, Exam, ExamVersion, Question, QuestionStats, RequestProfile, UserTestResult, UserQuestionSelect,
+)
+from .signals import invalidate_exam_content
+
+
+@admin.register(Exam)
+class ExamAdmin(admin.ModelAdmin):
+    list_display = ("title", "category", "question_count", "published_version", "created_at")
+    actions = ["publish", "renumber_questions"]
+    # F() で更新する列は表示だけにする(Exam.save() でも書き戻さない)
+    readonly_fields = Exam.MANAGED_FIELDS
+
+    @admin.action(description="今の問題で公開する")
+    def publish(self, request, queryset):
+        # 今の問題を ExamVersion に保存し、これから始める受験はその版で出題する(versions.py)
+        for exam in queryset:
+            ExamVersion.objects.publish(exam)
+        self.message_user(request, f"{len(queryset)}件のテストを公開しました。", messages.SUCCESS)
+
+    @admin.action(description="問題番号を詰めて振り直す")
+    def renumber_questions(self, request, queryset):
+        # 削除などで飛んだ問題番号を 1 から連番に振り直す。
+        # bulk_update の1つの UPDATE では行の順番が決まらず、PostgreSQL はユニーク制約を行ごとに確かめるので、
+        # 変わる問題をいったん今の最大の番号より大きい番号に移してから、新しい番号にする
+        renumbered = 0
+        for exam in queryset:
+            changed = []
+            numbers = {} # {古い番号: 新しい番号}
+            questions = list(Question.objects.filter(exam=exam).order_by("number"))
+            offset = questions[-1].number if questions else 0 # 振り直す前の最大の番号
+            for new_number, question in enumerate(questions, start=1):
+                numbers[question.number] = new_number
+                if question.number != new_number:
+                    question.number = new_number
+                    changed.append(question)
+            if changed:
+                with transaction.atomic():
+                    temporary = [Question(id=question.id, number=offset + question.number)
+                                 for question in changed]
+                    Question.objects.bulk_update(temporary, ["number"])
+                    Question.objects.bulk_update(changed, ["number"])
+                # アーカイブした解答は問題番号で保存しているので、あわせて並べ直す
+                UserTestResult.objects.renumber_archived(exam.id, numbers)
+                renumbered += len(changed)
+            # 問題数と次の問題番号もあわせて実際の数に直しておく
+            Exam.objects.filter(id=exam.id).update(
+                question_count=len(questions),
+                next_question_number=len(questions) + 1)
+            invalidate_exam_content(exam.id) # bulk_updateはシグナルを送らないのでキャッシュを無効にする
+        self.message_user(request, f"{renumbered}問の問題番号を振り直しました。", messages.SUCCESS)
+
+
+@admin.register(Question)
+class QuestionAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "exam", "answered", "correct_rate", "select_rates")
+    list_filter = ("exam",)
+    list_select_related = ("exam", "stats") # 集計は1つのクエリでまとめて取得する
+
+    def _stats(self, obj):
+        try:
+            return obj.stats
+        except QuestionStats.DoesNotExist:
+            return None
+
+    @admin.display(description="解答数")
+    def answered(self, obj):
+        stats = self._stats(obj)
+        return stats.answered if stats else 0
+
+    @admin.display(description="正答率")
+    def correct_rate(self, obj):
+        stats = self._stats(obj)
+        if stats is None or stats.correct_rate is None:
+            return "-"
+        return f"{stats.correct_rate}%"
+
+    @admin.display(description="選択率(1/2/3/4)")
+    def select_rates(self, obj):
+        stats = self._stats(obj)
+        if stats is None or not stats.answered:
+            return "-"
+        return " / ".join(f"{rate}%" for rate in stats.select_rates())
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    # プロファイルはリクエストから作るだけなので、管理サイトでは見るだけにする
+    list_display = ("created", "method", "path", "view_name", "mode", "status",
+                    "duration_ms", "query_count", "query_ms", "user", "directory")
+    list_filter = ("mode", "view_name")
+    list_select_related = ("user",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ExamVersion)
+class ExamVersionAdmin(admin.ModelAdmin):
+    # 公開した版は変更しない。ExamAdmin の「公開する」から作る
+    list_display = ("digest", "exam", "created_at")
+    list_filter = ("exam",)
+    list_select_related = ("exam",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
-from .models import Category, Exam, Question, UserTestResult, UserQuestionSelect
 
 admin.site.register(Category)
-admin.site.register(Exam)
-admin.site.register(Question)
 admin.site.register(UserTestResult)
 admin.site.register(UserQuestionSelect)
-
@@ -0,0 +1,109 @@
+"""未ログインユーザーの受験状況の保存
+
+受験状況は以下の形の辞書で扱う(キーは問題番号の文字列)。
+
+    {"exam_id": 1,
+     "question_select": {"1": 1, "2": 4, ...},
+     "answer_correct": {"1": True, "2": False, ...}}
+
+settings.MYMATH_ANONYMOUS_STATE で保存先を選ぶ。
+
+- "session"(既定): request.session["exam"] に保存する。解答のたびに django_session の行を書き換える。
+- "cookie": 署名付きの小さなCookieに詰めて保存する。データベースには書き込まない。
+  Cookieには "テストID:解答の並び" を入れる。解答の並びは解答した問題ごとに
+  問題番号と選択の文字(1〜4を不正解は "abcd"、正解は "ABCD")を続けたもの。
+  例: "3:1b2A4D" は問題1に2(不正解)、問題2に1(正解)、問題4に4(正解)。
+  解答した問題だけを入れるので、問題番号が大きくてもCookieの大きさは解答数で決まる。
+"""
+import re
+
+from django.conf import settings
+from django.core import signing
+
+
+SESSION_KEY = "exam"
+COOKIE_NAME = "mymath_exam"
+COOKIE_SALT = "mymath.anonymous.exam"
+COOKIE_MAX_AGE = 60 * 60 * 24 # 1日
+
+
+def use_cookie():
+    return getattr(settings, "MYMATH_ANONYMOUS_STATE", "session") == "cookie"
+
+
+def new_state(exam_id):
+    return {"exam_id": exam_id, "question_select": {}, "answer_correct": {}}
+
+
+SELECT_LETTERS = "abcd" # 不正解。正解は大文字
+ANSWER_RE = re.compile(r"(\d+)([a-dA-D])")
+
+
+def pack_state(state):
+    """受験状況を "テストID:解答の並び" の文字列にする。選択が1〜4でない解答は入れない"""
+    answers = []
+    for number in sorted(state["question_select"], key=int):
+        select = state["question_select"][number]
+        if select not in (1, 2, 3, 4):
+            continue
+        letter = SELECT_LETTERS[select - 1]
+        answers.append(number + (letter.upper() if state["answer_correct"].get(number) else letter))
+    return f"{state['exam_id']}:{''.join(answers)}"
+
+
+def unpack_state(value):
+    """pack_state() の逆。形式が正しくないときは None"""
+    try:
+        exam_id, answers = value.split(":")
+        state = new_state(int(exam_id))
+    except ValueError:
+        return None
+    if ANSWER_RE.sub("", answers):
+        return None
+    for number, letter in ANSWER_RE.findall(answers):
+        number = str(int(number))
+        state["question_select"][number] = SELECT_LETTERS.index(letter.lower()) + 1
+        state["answer_correct"][number] = letter.isupper()
+    return state
+
+
+def load_exam_state(request):
+    """保存されている受験状況を返す。ないときは None"""
+    if use_cookie():
+        value = request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT)
+        return unpack_state(value) if value else None
+    return request.session.get(SESSION_KEY)
+
+
+def save_exam_state(request, response, state):
+    """受験状況を保存する。Cookieのときはresponseに設定する"""
+    if use_cookie():
+        response.set_signed_cookie(
+            COOKIE_NAME, pack_state(state), salt=COOKIE_SALT,
+            max_age=COOKIE_MAX_AGE, httponly=True, samesite="Lax",
+            secure=settings.SESSION_COOKIE_SECURE)
+    else:
+        # DjangoのセッションはJSONでシリアライズ化されて保存されるので、
+        # キーのnumber が 1 のとき "1"として保存される。
+        request.session[SESSION_KEY] = state
+    return response
+
+
+async def aload_exam_state(request):
+    """load_exam_state() の非同期版"""
+    if use_cookie():
+        return load_exam_state(request)
+    return await request.session.aget(SESSION_KEY)
+
+
+async def asave_exam_state(request, response, state):
+    """save_exam_state() の非同期版"""
+    if use_cookie():
+        return save_exam_state(request, response, state)
+    await request.session.aset(SESSION_KEY, state)
+    return response
+
+
+def signed_cookie_value(state):
+    """Cookieに入る値(署名つき)を返す。サイズの比較用"""
+    return signing.get_cookie_signer(salt=COOKIE_NAME + COOKIE_SALT).sign(pack_state(state))
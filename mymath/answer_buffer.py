@@ -0,0 +1,228 @@
+"""ログインユーザーの解答を後からまとめて保存するバッファ(write-behind)
+
+settings.MYMATH_ANSWER_BUFFER で選ぶ。
+
+- ""(既定): 使わない。exam() の POST のたびに UserQuestionSelect を get_or_create する
+- "local": プロセス内のバッファにためて、MYMATH_ANSWER_BUFFER_INTERVAL ミリ秒ごとか
+  MYMATH_ANSWER_BUFFER_SIZE 件たまったときに、別スレッドで bulk_create する。
+  点数・正解数・解答数と問題ごとの集計もそのときにまとめて加算する
+
+一斉に受験が始まったときに、解答の POST がトランザクションと行ロックを待たずに返るようになる。
+
+読み込み
+    answer() は先にバッファを見るので、保存される前でも自分の解答がすぐに表示される。
+    result() は点数と順位を読むので、先にその受験結果の解答だけを保存する。
+    ほかの受験者の解答はまとめて保存するまで待つので、結果のページが全員分の保存を待たない。
+
+保存の保証
+    バッファはプロセスのメモリにある。保存される前にプロセスが強制終了(kill -9、メモリ不足など)
+    すると、最大で INTERVAL ミリ秒または SIZE 件の解答が失われる。
+    正常に終了するとき(SIGTERM で gunicorn / uvicorn が終了するときなど)は atexit で残りを保存する。
+    データベースにつながらないなどで保存できなかったときは、バッファに戻して次の保存でやり直す。
+    まとめて保存するときにデータベースのエラー(一意制約や外部キーなど)になったときは1件ずつ保存しなおし、
+    それでも保存できない解答だけをログに残して捨てる。1件の不正な解答で、ほかの受験者の解答が
+    保存されなくなることはない。選択が1〜4でない解答は record() で受け付けない。
+    データベースのエラー以外(プログラムの誤り)は隠さずにそのまま送出する。
+
+    "local" はプロセスごとのバッファなので、解答を送ったプロセスと答え合わせを表示するプロセスが
+    違うと、保存されるまでの間は答え合わせが404になる。1プロセス(ASGIの1ワーカーなど)で動かすか、
+    プロセスをまたいで読めるバックエンドを BACKENDS に加えて使う。
+
+同じ解答を2回送ったときは、get_or_create と同じく最初の解答だけを保存する。
+ただし保存済みの問題に解答しなおしたときは、保存されるまでの間だけバッファの解答が表示される。
+"""
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, InterfaceError, OperationalError, close_old_connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_answers(answers):
+    """UserQuestionSelect(未保存)のリストをまとめて保存し、点数と集計に加算する
+
+    すでに保存されている (受験結果, 問題) の解答は捨てる。保存した件数を返す。
+    """
+    from .models import QuestionStats, UserQuestionSelect, UserTestResult
+
+    try:
+        with transaction.atomic():
+            existing = set(UserQuestionSelect.objects.filter(
+                test_result_id__in={answer.test_result_id for answer in answers},
+            ).values_list("test_result_id", "question_id"))
+            new = [answer for answer in answers
+                   if (answer.test_result_id, answer.question_id) not in existing]
+            UserQuestionSelect.objects.bulk_create(new)
+            by_result = defaultdict(list)
+            for answer in new:
+                by_result[answer.test_result_id].append(answer)
+            for test_result_id, group in by_result.items():
+                UserTestResult.objects.add_answers(test_result_id, group, stats=False)
+            # 問題ごとの集計はバッチ全体で1問1回だけ更新する
+            QuestionStats.objects.add_answers(new)
+        return len(new)
+    except DatabaseError:
+        # 別のプロセスが同じ解答を先に保存したときや、受験結果が削除されたときなど。
+        # 1件ずつ保存しなおし、それでも保存できない解答は捨てる(ほかの解答を止めないため)
+        logger.warning("解答をまとめて保存できなかったので、1件ずつ保存します。", exc_info=True)
+        saved = 0
+        for answer in answers:
+            try:
+                with transaction.atomic():
+                    saved_answer, created = UserQuestionSelect.objects.get_or_create(
+                        test_result_id=answer.test_result_id,
+                        question_id=answer.question_id,
+                        defaults={"select": answer.select, "correct": answer.correct})
+                    if created:
+                        UserTestResult.objects.add_answers(answer.test_result_id, [saved_answer])
+                saved += created
+            except (OperationalError, InterfaceError):
+                raise # データベースにつながらないときは、バッファに戻してやり直す
+            except DatabaseError:
+                logger.exception("解答を保存できませんでした: test_result=%s question=%s select=%s",
+                                 answer.test_result_id, answer.question_id, answer.select)
+        return saved
+
+
+class LocalAnswerBuffer:
+    """プロセス内のバッファ。{(受験結果のid, 問題のid): UserQuestionSelect}"""
+
+    def __init__(self, interval, size):
+        self.interval = interval / 1000 # 秒
+        self.size = size
+        self._pending = {}
+        self._flushing = {} # 保存中のもの。コミットされるまでは読めるように残す
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def record(self, test_result, question, select):
+        """解答をバッファに入れて (UserQuestionSelect, 新しく入れたか) を返す
+
+        選択が1〜4でないときは ValueError。保存するときに集計でエラーになり、まとめて保存できなくなるため。
+        """
+        from .models import UserQuestionSelect
+
+        if select not in (1, 2, 3, 4):
+            raise ValueError(f"選択 {select} は記録できません。")
+        key = (test_result.id, question.id)
+        with self._lock:
+            answer = self._pending.get(key) or self._flushing.get(key)
+            if answer is not None:
+                return answer, False
+            answer = UserQuestionSelect(test_result=test_result, question=question,
+                                        select=select, correct=select == question.answer)
+            self._pending[key] = answer
+            full = len(self._pending) >= self.size
+        if not self.interval: # 別スレッドを使わないとき(テストなど)
+            if full:
+                self.flush()
+        else:
+            self._start()
+            if full:
+                self._wake.set()
+        return answer, True
+
+    def get(self, test_result_id, question_id):
+        """保存されていない解答。ないときは None"""
+        key = (test_result_id, question_id)
+        with self._lock:
+            return self._pending.get(key) or self._flushing.get(key)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending) + len(self._flushing)
+
+    def flush(self, test_result_id=None):
+        """たまっている解答を保存する。保存した件数を返す
+
+        test_result_id を指定したときは、その受験結果の解答だけを保存する。
+        """
+        with self._flush_lock:
+            with self._lock:
+                if test_result_id is None:
+                    self._flushing, self._pending = self._pending, {}
+                else:
+                    self._flushing = {key: answer for key, answer in self._pending.items()
+                                      if key[0] == test_result_id}
+                    for key in self._flushing:
+                        del self._pending[key]
+                answers = list(self._flushing.values())
+            if not answers:
+                return 0
+            try:
+                return write_answers(answers)
+            except Exception:
+                # 保存できなかった解答はバッファに戻す(その間に届いた解答を優先する)
+                with self._lock:
+                    self._pending = {**self._flushing, **self._pending}
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mymath-answer-buffer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("解答のバッファを保存できませんでした。")
+            finally:
+                # リクエストの外で動くので、接続の後始末は自分で行う
+                close_old_connections()
+
+
+BACKENDS = {
+    "local": LocalAnswerBuffer,
+}
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_answer_buffer():
+    """settings.MYMATH_ANSWER_BUFFER のバッファ。使わないときは None"""
+    name = settings.MYMATH_ANSWER_BUFFER
+    if not name:
+        return None
+    key = (name, settings.MYMATH_ANSWER_BUFFER_INTERVAL, settings.MYMATH_ANSWER_BUFFER_SIZE)
+    buffer = _buffers.get(key)
+    if buffer is None:
+        if name not in BACKENDS:
+            raise ImproperlyConfigured(f"MYMATH_ANSWER_BUFFER に {name} は指定できません。")
+        with _buffers_lock:
+            if key not in _buffers:
+                _buffers[key] = BACKENDS[name](*key[1:])
+            buffer = _buffers[key]
+    return buffer
+
+
+def buffered_answer(test_result_id, question_id):
+    """保存されていない解答(answer() で使う)。バッファを使わないときやないときは None"""
+    buffer = get_answer_buffer()
+    return buffer.get(test_result_id, question_id) if buffer is not None else None
+
+
+def flush_answers(test_result_id):
+    """バッファを使うときは、test_result_id の受験結果のたまっている解答を保存する(result() で使う)"""
+    buffer = get_answer_buffer()
+    if buffer is not None and test_result_id is not None: # None のときに全員分を保存しない
+        buffer.flush(test_result_id)
@@ -0,0 +1,179 @@
+"""1ページで試験を行うための JSON API
+
+    GET  /api/exam/<exam_id>/         問題をすべて返す(正解は含めない)
+    POST /api/exam/<exam_id>/submit/  {"selections": {"1": 2, "2": 4, ...}} をまとめて採点する
+    GET  /api/version/<digest>/          公開した版の問題(正解は含めない)
+    GET  /api/version/<digest>/answers/  公開した版の正解と解説(スタッフか、その版の受験を終えたユーザーだけ)
+
+1問ごとに exam → answer を往復する代わりに、取得と提出を1回ずつで済ませる。
+採点結果は通常の流れと同じ形で保存するので、result() でそのまま表示できる。
+
+公開した版(versions.py)の内容は digest ごとに変わらないので、/api/version/ は
+Cache-Control: immutable と1年の max-age をつけて返す。問題はブラウザやCDNにずっと置いておける。
+正解はユーザーによって見られるかどうかが変わるので、private にしてブラウザにだけ置く。
+exam_detail の "version" に公開中の版の digest を入れる(公開していないときは null)。
+"""
+import json
+
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .anonymous import new_state, save_exam_state
+from .cache import get_attempt_snapshot_or_404, get_version_snapshot_by_digest
+from .models import POINTS_PER_QUESTION, Question, UserQuestionSelect, UserTestResult
+
+
+def _error(message, status=400):
+    return JsonResponse({"error": message}, status=status, json_dumps_params={"ensure_ascii": False})
+
+
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365 # 1年
+
+
+def _questions(snapshot):
+    return [
+        {
+            "number": question.number,
+            "text": question.text,
+            "selects": [question.select_1, question.select_2, question.select_3, question.select_4],
+        }
+        for question in snapshot.questions
+    ]
+
+
+@require_GET
+def exam_detail(request, exam_id):
+    snapshot = get_attempt_snapshot_or_404(exam_id) # 公開中の版
+    return JsonResponse(
+        {"id": snapshot.exam.id, "title": snapshot.exam.title, "version": snapshot.digest,
+         "questions": _questions(snapshot)},
+        json_dumps_params={"ensure_ascii": False})
+
+
+def _version_or_404(digest):
+    snapshot = get_version_snapshot_by_digest(digest)
+    if snapshot is None:
+        raise Http404("版が見つかりません。")
+    return snapshot
+
+
+def _version_etag(request, digest):
+    return f'"{digest}"'
+
+
+@require_GET
+@condition(etag_func=_version_etag)
+def version_detail(request, digest):
+    snapshot = _version_or_404(digest)
+    response = JsonResponse(
+        {"id": snapshot.exam.id, "title": snapshot.exam.title, "version": snapshot.digest,
+         "questions": _questions(snapshot)},
+        json_dumps_params={"ensure_ascii": False})
+    patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
+
+
+def _can_see_answers(user, snapshot):
+    """スタッフか、この版の受験を終えたユーザーなら True"""
+    if user.is_staff:
+        return True
+    return user.is_authenticated and UserTestResult.objects.filter(
+        user=user, exam_version_id=snapshot.exam_version_id, finished__isnull=False).exists()
+
+
+@require_GET
+def version_answers(request, digest):
+    snapshot = _version_or_404(digest)
+    # 受験する前に正解を取得できないように、権限を確かめてから返す(304も返さない)
+    if not _can_see_answers(request.user, snapshot):
+        return _error("正解は受験を終えてから見られます。", status=403)
+    answers = [
+        {"number": question.number, "answer": question.answer, "answer_text": question.answer_text}
+        for question in snapshot.questions
+    ]
+    response = JsonResponse({"version": snapshot.digest, "answers": answers},
+                            json_dumps_params={"ensure_ascii": False})
+    patch_cache_control(response, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
+
+
+def _parse_selections(request, snapshot):
+    """リクエストの本文から {問題番号(int): 選択(int)} を取り出す。不正なときは ValueError"""
+    try:
+        data = json.loads(request.body)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("JSONが正しくありません。")
+    selections = data.get("selections") if isinstance(data, dict) else None
+    if not isinstance(selections, dict):
+        raise ValueError("selections を {問題番号: 選択} の形で指定してください。")
+    parsed = {}
+    for key, value in selections.items():
+        try:
+            number = int(key)
+        except ValueError:
+            raise ValueError(f"問題番号 {key} が正しくありません。")
+        if snapshot.question(number) is None:
+            raise ValueError(f"問題番号 {number} はありません。")
+        # 1.0 や True も 1 と等しいので、int かどうかを型で確かめる
+        if type(value) is not int or not 1 <= value <= 4:
+            raise ValueError(f"問題番号 {number} の選択は1〜4で指定してください。")
+        parsed[number] = value
+    return parsed
+
+
+@require_POST
+def exam_submit(request, exam_id):
+    snapshot = get_attempt_snapshot_or_404(exam_id)
+    try:
+        selections = _parse_selections(request, snapshot)
+    except ValueError as e:
+        return _error(str(e))
+
+    questions = [question for question in snapshot.questions if question.number in selections]
+    if request.user.is_authenticated:
+        # 版やキャッシュのスナップショットには削除された問題が残っていることがある。
+        # 行のない問題の解答は保存できないので、record_answer() と同じく採点にも含めない
+        existing = set(Question.objects.filter(id__in=[q.id for q in questions]).values_list("id", flat=True))
+        questions = [question for question in questions if question.id in existing]
+
+    # キャッシュしている正解で採点する
+    results = []
+    for question in questions:
+        select = selections[question.number]
+        results.append({
+            "number": question.number,
+            "select": select,
+            "answer": question.answer,
+            "correct": select == question.answer,
+        })
+    correct_num = sum(result["correct"] for result in results)
+    score = correct_num * POINTS_PER_QUESTION
+
+    response = JsonResponse(
+        {"exam_id": exam_id, "score": score, "correct_count": correct_num, "results": results},
+        json_dumps_params={"ensure_ascii": False})
+    if not request.user.is_authenticated:
+        # 未ログインのときは exam() と同じ形で保存する
+        exam_state = new_state(exam_id)
+        for r in results:
+            exam_state["question_select"][str(r["number"])] = r["select"]
+            exam_state["answer_correct"][str(r["number"])] = r["correct"]
+        save_exam_state(request, response, exam_state)
+    else:
+        # 受験結果と全問の解答を1つのトランザクションでまとめて保存する
+        with transaction.atomic():
+            usertestresult = UserTestResult.objects.start_attempt(
+                request.user, snapshot.exam, snapshot.exam_version_id)
+            answers = UserQuestionSelect.objects.bulk_create([
+                UserQuestionSelect(
+                    test_result=usertestresult,
+                    question=snapshot.question(r["number"]),
+                    select=r["select"],
+                    correct=r["correct"])
+                for r in results
+            ])
+            UserTestResult.objects.add_answers(usertestresult.id, answers)
+        request.session["current_usertestresult_id"] = usertestresult.id
+    return response
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class MymathConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mymath'
+
+    def ready(self):
+        # シグナルの登録
+        from django.db.backends.signals import connection_created
+
+        from . import checks, signals  # noqa: F401
+        from .querylog import install
+
+        # SQLの計測用のラッパーを接続ごとに付ける(querylog.py)
+        connection_created.connect(install, dispatch_uid="mymath.querylog")
@@ -0,0 +1,100 @@
+"""終了した受験の解答を UserTestResult にまとめて保存する形式(アーカイブ)
+
+解答は1問ごとに UserQuestionSelect の行になるので、受験が増えるといちばん大きなテーブルと
+インデックスになる。古い受験の解答はほとんど読まれないので、archive_attempts コマンドで
+次の3つのバイト列にまとめて UserTestResult に保存し、UserQuestionSelect の行は削除する。
+
+- archived_selects   選んだ番号 - 1 を問題ごとに2ビット(1バイトに4問)
+- archived_answered  解答した問題のビットマスク
+- archived_correct   正解した問題のビットマスク
+
+問題番号 n は先頭のバイトの下位ビットから数えて n - 1 番目で表す。
+10問のテストなら 3 + 2 + 2 = 7バイトで、10行とそのインデックスの代わりになる。
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ArchivedAnswer:
+    """アーカイブから読んだ解答。テンプレートでは UserQuestionSelect と同じように使える"""
+    question: object
+    select: int
+    correct: bool
+
+    @property
+    def question_id(self):
+        return self.question.id
+
+
+def pack(answers):
+    """{問題番号: (選択, 正解)} を (selects, answered, correct) のバイト列にする
+
+    選択が1〜4でないときや問題番号が1より小さいときは ValueError
+    """
+    size = max(answers, default=0)
+    selects = bytearray((size + 3) // 4)
+    answered = bytearray((size + 7) // 8)
+    correct = bytearray((size + 7) // 8)
+    for number, (select, is_correct) in answers.items():
+        if number < 1 or select not in (1, 2, 3, 4):
+            raise ValueError(f"問題番号 {number} の選択 {select} はアーカイブできません。")
+        i = number - 1
+        selects[i // 4] |= (select - 1) << (i % 4 * 2)
+        answered[i // 8] |= 1 << (i % 8)
+        if is_correct:
+            correct[i // 8] |= 1 << (i % 8)
+    return bytes(selects), bytes(answered), bytes(correct)
+
+
+def unpack_one(selects, answered, correct, number):
+    """問題番号 number の (選択, 正解) を返す。解答していないときは None"""
+    i = number - 1
+    if i < 0 or i // 8 >= len(answered) or not answered[i // 8] >> (i % 8) & 1:
+        return None
+    return (selects[i // 4] >> (i % 4 * 2) & 3) + 1, bool(correct[i // 8] >> (i % 8) & 1)
+
+
+def unpack(selects, answered, correct):
+    """pack() の逆。{問題番号: (選択, 正解)} を返す"""
+    answers = {}
+    for number in range(1, len(answered) * 8 + 1):
+        value = unpack_one(selects, answered, correct, number)
+        if value is not None:
+            answers[number] = value
+    return answers
+
+
+def renumber(selects, answered, correct, numbers):
+    """numbers({古い問題番号: 新しい問題番号})にあわせて並べ直す
+
+    numbers にない問題番号(削除された問題)の解答は捨てる。新しい番号と重ならないようにするため。
+    """
+    answers = unpack(selects, answered, correct)
+    return pack({numbers[number]: value for number, value in answers.items() if number in numbers})
+
+
+def iter_archived(attempts, chunk_size=2000):
+    """アーカイブした受験結果の解答を (受験結果, question_id, 問題番号, 選択, 正解) で1つずつ返す
+
+    問題番号から question_id へはテスト(版で受験したものは版)ごとに1回のクエリで変える。
+    削除された問題の解答は返さない。
+    """
+    from .models import ExamVersion, Question
+
+    question_ids = {} # {(exam_id, 版のid): {問題番号: question_id}}
+    for attempt in attempts.filter(archived_answered__isnull=False).iterator(chunk_size=chunk_size):
+        key = (attempt.exam_id, attempt.exam_version_id)
+        if key not in question_ids:
+            current = dict(Question.objects.filter(exam_id=attempt.exam_id).values_list("number", "id"))
+            if attempt.exam_version_id is None:
+                question_ids[key] = current
+            else:
+                # 版の問題番号でまとめてあるので、版の内容で変える
+                existing = set(current.values())
+                version = ExamVersion.objects.get(id=attempt.exam_version_id)
+                question_ids[key] = {number: question_id for question_id, number
+                                     in version.question_numbers().items() if question_id in existing}
+        numbers = question_ids[key]
+        for number, (select, correct) in sorted(unpack(*attempt.archived).items()):
+            if number in numbers:
+                yield attempt, numbers[number], number, select, correct
@@ -0,0 +1,219 @@
+"""index / exam / answer / result の非同期版
+
+settings.MYMATH_ASYNC_VIEWS が True のときに urls.py が views.py の代わりに使う。
+ASGIサーバー(uvicorn など)で動かすと、DBの応答を待っている間もワーカーのスレッドを占有しないので、
+1ワーカーあたりの同時受験者数を増やせる。処理の内容は views.py と同じ。
+
+- 読み込みは非同期ORM(aget, afirst, async for)とセッションの aget / aset を使う
+- トランザクションが必要な書き込み(受験の開始と解答の記録)は sync_to_async で呼ぶ
+- テンプレートは同期で描画するので、request.user とセッションは描画の前に非同期で読み込んでおく
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.db.models import Case, Value, When
+from django.http import Http404
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .anonymous import SESSION_KEY, aload_exam_state, asave_exam_state, new_state
+from .answer_buffer import buffered_answer, flush_answers
+from .cache import aget_attempt_snapshot_or_404, get_index_version
+from .models import POINTS_PER_QUESTION, Category, Exam, Question, QuestionStats, UserQuestionSelect, UserTestResult
+from .ranking import get_leaderboard, get_ranking
+from .routers import use_primary
+from .versions import answers_for
+from .views import parse_select
+
+
+async def _prepare(request):
+    """ユーザーとセッションを非同期で読み込んでおき、テンプレートなどの同期の処理がDBにアクセスしないようにする"""
+    request.user = await request.auser()
+    await request.session.aget(SESSION_KEY)
+    return request.user
+
+
+async def aindex(request):
+    user = await _prepare(request)
+    # 未ログインでメッセージもないときは、views.index と同じように ETag / Last-Modified で304を返す
+    conditional = not user.is_authenticated and not len(messages.get_messages(request))
+    index_version, last_modified = get_index_version()
+    etag = f'"index-{index_version}"'
+    if conditional:
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if response is not None:
+            return response
+
+    grade_order = Case(
+        *[When(category__grade=grade, then=Value(i))
+          for i, (grade, _) in enumerate(Category.GRADE_CHOICES)],
+        default=Value(len(Category.GRADE_CHOICES)))
+    exams = Exam.objects.select_related("category").order_by(
+        grade_order, "category__name", "category_id", "id")
+    # クエリは断片キャッシュがないときだけテンプレートの中で実行されるので、描画はスレッドで行う。
+    # 断片キャッシュを作るときはプライマリーから読む(cache.py)
+    with use_primary():
+        response = await sync_to_async(render)(
+            request, "mymath/index.html", {"exams": exams, "index_version": index_version})
+    if conditional:
+        response.headers.setdefault("ETag", etag)
+        response.headers.setdefault("Last-Modified", http_date(last_modified.timestamp()))
+    return response
+
+
+async def aexam(request, exam_id, number=1):
+    user = await _prepare(request)
+    usertestresult = None
+    snapshot = await aget_attempt_snapshot_or_404(exam_id)
+    if number == 1 and snapshot.question(1) is None and snapshot.first_number is not None:
+        return redirect("mymath:exam", exam_id=exam_id, number=snapshot.first_number)
+    if user.is_authenticated and number != snapshot.first_number:
+        usertestresult = await aget_object_or_404(
+            UserTestResult, id=await request.session.aget("current_usertestresult_id"))
+        snapshot = await aget_attempt_snapshot_or_404(exam_id, usertestresult)
+    exam = snapshot.exam
+    question = snapshot.question(number)
+    if question is None:
+        raise Http404("問題番号が正しくありません。")
+
+    if not user.is_authenticated:
+        if request.method == "POST":
+            user_select = parse_select(request.POST.get(f"question_{question.number}"))
+            if user_select is None:
+                messages.warning(request, "番号をえらんでから次へを押してください")
+                return redirect("mymath:exam", exam_id=exam_id, number=number)
+            exam_state = await aload_exam_state(request)
+            if number == snapshot.first_number or not exam_state or exam_state["exam_id"] != exam_id:
+                exam_state = new_state(exam_id)
+            exam_state["question_select"][str(number)] = user_select
+            exam_state["answer_correct"][str(number)] = user_select == question.answer
+            response = redirect("mymath:answer", exam_id=exam_id, number=number)
+            return await asave_exam_state(request, response, exam_state)
+
+    else:
+        if request.method == "POST":
+            user_select = parse_select(request.POST.get(f"question_{question.number}"))
+            if user_select is None:
+                messages.warning(request, "番号をえらんでから次へを押してください")
+                return redirect("mymath:exam", exam_id=exam_id, number=number)
+            # 受験の開始と解答の記録はトランザクションを使うので同期で呼ぶ
+            if number == snapshot.first_number:
+                usertestresult = await sync_to_async(UserTestResult.objects.resume_or_start)(
+                    user, exam, question, await request.session.aget("current_usertestresult_id"),
+                    snapshot.exam_version_id)
+                await request.session.aset("current_usertestresult_id", usertestresult.id)
+            try:
+                await sync_to_async(usertestresult.record_answer)(question, user_select)
+            except Question.DoesNotExist: # 受験中に削除された問題
+                raise Http404("問題が見つかりません。")
+            return redirect("mymath:answer", exam_id=exam_id, number=number)
+
+    return render(request, "mymath/exam.html",
+                  {"question": question,
+                   "exam": exam})
+
+
+async def aanswer(request, exam_id, number):
+    user = await _prepare(request)
+    user_result = None
+    if user.is_authenticated:
+        user_result = await aget_object_or_404(
+            UserTestResult, id=await request.session.aget("current_usertestresult_id"))
+    snapshot = await aget_attempt_snapshot_or_404(exam_id, user_result)
+    total = snapshot.exam.question_count
+    question = snapshot.question(number)
+    if question is None:
+        raise Http404("問題番号がただしくありません。")
+    next_number = snapshot.next_number(number)
+
+    if not user.is_authenticated:
+        exam_state = await aload_exam_state(request)
+        if (not exam_state
+            or exam_state["exam_id"] != exam_id
+            or str(number) not in exam_state["question_select"]
+            or str(number) not in exam_state["answer_correct"]
+            ):
+            return redirect("mymath:exam", exam_id=exam_id, number=number)
+        useranswer = {
+            "select": exam_state["question_select"][str(number)],
+            "correct": exam_state["answer_correct"][str(number)],
+        }
+    else:
+        if user_result.is_archived:
+            useranswer = user_result.archived_answer(question)
+            if useranswer is None:
+                raise Http404("解答が見つかりません。")
+        else:
+            useranswer = buffered_answer(user_result.id, question.id) or await aget_object_or_404(
+                UserQuestionSelect, test_result=user_result, question=question)
+
+    if request.method == "POST":
+        if next_number is not None:
+            return redirect("mymath:exam", exam_id=exam_id, number=next_number)
+        return redirect("mymath:result", exam_id=exam_id)
+
+    stats = await QuestionStats.objects.filter(question_id=question.id).afirst()
+    return render(request, "mymath/answer.html",
+            {"question": question,
+            "useranswer": useranswer,
+            "total": total,
+            "is_last": next_number is None,
+            "stats": stats})
+
+
+async def aresult(request, exam_id):
+    snapshot = await aget_attempt_snapshot_or_404(exam_id)
+    exam = snapshot.exam
+    questions = snapshot.questions
+    user = await _prepare(request)
+
+    if not user.is_authenticated:
+        exam_state = await aload_exam_state(request)
+        if not exam_state or exam_state["exam_id"] != exam_id:
+            return redirect("mymath:exam", exam_id=exam_id, number=1)
+        score = sum(map(int, exam_state["answer_correct"].values())) * POINTS_PER_QUESTION
+        user_result = {
+            "count": "*",
+            "score": score,
+            "exam": {
+                "id": exam_id,
+                "title": exam.title}}
+        useranswers = [
+            {"correct": exam_state["answer_correct"][str(question.number)],
+             "question": {"number": question.number}}
+            for question in questions if str(question.number) in exam_state["answer_correct"]
+        ]
+        ranking = None
+        if len(useranswers) == len(questions):
+            ranking = await sync_to_async(get_ranking)(exam_id, score, first_attempt=True)
+        first_attempt = True
+
+    else:
+        result_id = await request.session.aget("current_usertestresult_id")
+        await sync_to_async(flush_answers)(result_id)
+        user_result = await aget_object_or_404(UserTestResult.objects.select_related("exam"), id=result_id)
+        questions = (await aget_attempt_snapshot_or_404(exam_id, user_result)).questions
+        if user_result.is_archived:
+            useranswers = user_result.archived_answers(questions)
+        elif user_result.exam_version_id:
+            useranswers = answers_for(
+                [useranswer async for useranswer in UserQuestionSelect.objects.filter(test_result=user_result)],
+                questions)
+        else:
+            useranswers = [
+                useranswer async for useranswer in UserQuestionSelect.objects.filter(
+                    test_result=user_result).select_related("question").order_by("question__number")
+            ]
+        first_attempt = user_result.count == 1
+        ranking = None
+        if user_result.finished:
+            ranking = await sync_to_async(get_ranking)(
+                exam_id, user_result.score, first_attempt=first_attempt)
+
+    return render(request, "mymath/result.html",
+            {"user_result": user_result,
+             "useranswers": useranswers,
+             "ranking": ranking,
+             "first_attempt": first_attempt,
+             "leaderboard": await sync_to_async(get_leaderboard)(exam_id)})
@@ -0,0 +1,276 @@
+"""試験内容(Exam と Question)のキャッシュ
+
+exam(), answer(), result() は毎回同じ問題セットを読むので、
+Exam と並び順どおりの Question をまとめた変更不可のスナップショットを
+プロセス内に保持して使い回す。
+
+スナップショットは exam_id とバージョン番号の組で管理する。
+バージョン番号は Django のキャッシュフレームワークに置き、
+Question / Exam の保存・削除時にシグナル(signals.py)で更新する。
+キャッシュバックエンドを共有していれば、別プロセスで保存された変更も反映される。
+
+トップページ(index)も同じようにバージョン番号と更新日時を持ち、
+テンプレートの断片キャッシュと ETag / Last-Modified に使う。
+
+公開した版(ExamVersion, versions.py)のスナップショットは内容が変わらないので、
+版のidごとに一度だけ作り、無効にせずに持ち続ける。
+
+レプリカを使うとき(routers.py)も、キャッシュを作り直すときはプライマリーから読む。
+バージョンを進めた直後にレプリカから古い内容を読むと、次に変更するまで古いままになるため。
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.core.cache import cache
+from django.http import Http404
+from django.utils import timezone
+
+from .models import Exam, ExamVersion, Question
+from .routers import use_primary
+
+
+VERSION_KEY = "mymath:exam-version:{exam_id}"
+INDEX_VERSION_KEY = "mymath:index-version"
+
+_snapshots = {}  # {exam_id: ExamSnapshot} 各examの最新バージョンだけを保持する
+_versions = {}  # {版のid: ExamSnapshot} 内容が変わらないので無効にしない
+_version_ids = {}  # {digest: 版のid}
+_stats = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ExamSnapshot:
+    """Exam と問題番号順の Question をまとめた変更不可のスナップショット"""
+    exam: Exam
+    questions: tuple
+    version: int
+    exam_version_id: int = None # 公開した版のスナップショットのとき
+    digest: str = None
+    _by_number: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # frozen なので object.__setattr__ で問題番号からの索引を作る
+        object.__setattr__(self, "_by_number", {q.number: q for q in self.questions})
+
+    @property
+    def total(self):
+        return len(self.questions)
+
+    @property
+    def first_number(self):
+        """最初の問題の番号。1問目が削除されていれば2以上になる。問題がないときは None"""
+        return self.questions[0].number if self.questions else None
+
+    def question(self, number):
+        """問題番号から Question を返す。ないときは None"""
+        return self._by_number.get(number)
+
+    def next_number(self, number):
+        """number の次の問題番号を返す。最後の問題のときは None
+
+        問題が削除されて番号が飛んでいても次の問題をたどれるようにする。
+        """
+        for question in self.questions:
+            if question.number > number:
+                return question.number
+        return None
+
+
+def get_exam_version(exam_id):
+    version = cache.get(VERSION_KEY.format(exam_id=exam_id))
+    if version is None:
+        # キャッシュが消えても以前の番号に戻らないよう、現在時刻から始める
+        version = time.time_ns()
+        if not cache.add(VERSION_KEY.format(exam_id=exam_id), version, None):
+            version = cache.get(VERSION_KEY.format(exam_id=exam_id), version)
+    return version
+
+
+def bump_exam_version(exam_id):
+    """exam_id のバージョンを進めて、保持しているスナップショットを無効にする"""
+    key = VERSION_KEY.format(exam_id=exam_id)
+    try:
+        cache.incr(key)
+    except ValueError:  # キーがないとき
+        cache.set(key, time.time_ns(), None)
+    _snapshots.pop(exam_id, None)
+
+
+def get_index_version():
+    """トップページの (バージョン番号, 更新日時) を返す"""
+    value = cache.get(INDEX_VERSION_KEY)
+    if value is None:
+        value = (time.time_ns(), timezone.now().replace(microsecond=0))
+        if not cache.add(INDEX_VERSION_KEY, value, None):
+            value = cache.get(INDEX_VERSION_KEY, value)
+    return value
+
+
+def bump_index_version():
+    """トップページのバージョンを進める。更新日時はHTTPヘッダーにあわせて秒単位にする"""
+    cache.set(INDEX_VERSION_KEY, (time.time_ns(), timezone.now().replace(microsecond=0)), None)
+
+
+def _cached_snapshot(exam_id, version):
+    """保持しているスナップショットが最新ならヒットとして返す。古いかないときは None"""
+    snapshot = _snapshots.get(exam_id)
+    with _lock:
+        if snapshot is not None and snapshot.version == version:
+            _stats["hits"] += 1
+            return snapshot
+        _stats["misses"] += 1
+    return None
+
+
+def _remember(exam, questions, version):
+    snapshot = ExamSnapshot(exam=exam, questions=tuple(questions), version=version)
+    _snapshots[exam.id] = snapshot
+    return snapshot
+
+
+def get_exam_snapshot(exam_id):
+    """exam_id のスナップショットを返す。Exam が存在しないときは None"""
+    version = get_exam_version(exam_id)
+    snapshot = _cached_snapshot(exam_id, version)
+    if snapshot is not None:
+        return snapshot
+    with use_primary():
+        exam = Exam.objects.filter(id=exam_id).first()
+        if exam is None:
+            return None
+        return _remember(exam, Question.objects.filter(exam=exam).order_by("number"), version)
+
+
+def get_exam_snapshot_or_404(exam_id):
+    snapshot = get_exam_snapshot(exam_id)
+    if snapshot is None:
+        raise Http404("テストが見つかりません。")
+    return snapshot
+
+
+async def aget_exam_version(exam_id):
+    key = VERSION_KEY.format(exam_id=exam_id)
+    version = await cache.aget(key)
+    if version is None:
+        version = time.time_ns()
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key, version)
+    return version
+
+
+async def aget_exam_snapshot(exam_id):
+    """get_exam_snapshot() の非同期版(async_views.py で使う)"""
+    version = await aget_exam_version(exam_id)
+    snapshot = _cached_snapshot(exam_id, version)
+    if snapshot is not None:
+        return snapshot
+    with use_primary():
+        exam = await Exam.objects.filter(id=exam_id).afirst()
+        if exam is None:
+            return None
+        questions = [question async for question in Question.objects.filter(exam=exam).order_by("number")]
+    return _remember(exam, questions, version)
+
+
+async def aget_exam_snapshot_or_404(exam_id):
+    snapshot = await aget_exam_snapshot(exam_id)
+    if snapshot is None:
+        raise Http404("テストが見つかりません。")
+    return snapshot
+
+
+def _remember_version(version):
+    """版の内容から Exam と Question(保存はしない)を作ってスナップショットにする"""
+    content = version.content
+    exam = Exam(published_version_id=version.id, question_count=len(content["questions"]),
+                **content["exam"])
+    questions = [Question(exam_id=exam.id, **question) for question in content["questions"]]
+    # 版のスナップショットは無効にしないので、バージョン番号は使わない
+    snapshot = ExamSnapshot(exam=exam, questions=tuple(questions), version=None,
+                            exam_version_id=version.id, digest=version.digest)
+    _versions[version.id] = snapshot
+    _version_ids[version.digest] = version.id
+    return snapshot
+
+
+def get_version_snapshot(version_id):
+    """版のスナップショットを返す。版が存在しないときは None"""
+    snapshot = _versions.get(version_id)
+    if snapshot is not None:
+        return snapshot
+    with use_primary(): # 公開した直後でも読めるように
+        version = ExamVersion.objects.filter(id=version_id).first()
+    return _remember_version(version) if version is not None else None
+
+
+def get_version_snapshot_by_digest(digest):
+    """digest の版のスナップショットを返す。版が存在しないときは None"""
+    version_id = _version_ids.get(digest)
+    if version_id is not None:
+        return _versions[version_id]
+    with use_primary():
+        version = ExamVersion.objects.filter(digest=digest).first()
+    return _remember_version(version) if version is not None else None
+
+
+def get_attempt_snapshot(exam_id, user_result=None):
+    """受験で出題するスナップショットを返す。Exam が存在しないときは None
+
+    user_result が版で受験したものならその版、そうでなければ公開中の版、
+    公開していないときは今の問題のスナップショットを返す。
+    """
+    if user_result is not None and user_result.exam_id == exam_id and user_result.exam_version_id:
+        snapshot = get_version_snapshot(user_result.exam_version_id)
+        if snapshot is not None:
+            return snapshot
+    snapshot = get_exam_snapshot(exam_id)
+    if snapshot is None or snapshot.exam.published_version_id is None:
+        return snapshot
+    return get_version_snapshot(snapshot.exam.published_version_id) or snapshot
+
+
+def get_attempt_snapshot_or_404(exam_id, user_result=None):
+    snapshot = get_attempt_snapshot(exam_id, user_result)
+    if snapshot is None:
+        raise Http404("テストが見つかりません。")
+    return snapshot
+
+
+async def aget_version_snapshot(version_id):
+    """get_version_snapshot() の非同期版"""
+    snapshot = _versions.get(version_id)
+    if snapshot is not None:
+        return snapshot
+    with use_primary():
+        version = await ExamVersion.objects.filter(id=version_id).afirst()
+    return _remember_version(version) if version is not None else None
+
+
+async def aget_attempt_snapshot_or_404(exam_id, user_result=None):
+    """get_attempt_snapshot_or_404() の非同期版"""
+    snapshot = None
+    if user_result is not None and user_result.exam_id == exam_id and user_result.exam_version_id:
+        snapshot = await aget_version_snapshot(user_result.exam_version_id)
+    if snapshot is None:
+        snapshot = await aget_exam_snapshot_or_404(exam_id)
+        if snapshot.exam.published_version_id is not None:
+            snapshot = await aget_version_snapshot(snapshot.exam.published_version_id) or snapshot
+    return snapshot
+
+
+def cache_stats():
+    """ヒット数とミス数を {"hits": int, "misses": int} で返す"""
+    with _lock:
+        return dict(_stats)
+
+
+def clear_exam_cache():
+    """保持しているスナップショットと統計をすべて消す(テスト用)"""
+    with _lock:
+        _snapshots.clear()
+        _versions.clear()
+        _version_ids.clear()
+        _stats["hits"] = 0
+        _stats["misses"] = 0
@@ -0,0 +1,27 @@
+"""システムチェック(python manage.py check や runserver のときに実行される)
+
+スナップショットのバージョン番号(cache.py)とランキング(ranking.py)は Django のキャッシュに置き、
+保存や解答のたびにシグナルで無効にする。プロセスごとのキャッシュ(LocMemCache など)では
+無効にしたことが別のプロセスに伝わらず、古い問題や正解、ランキングを表示し続ける。
+MYMATH_WORKERS で2つ以上のプロセスで動かすと指定したときは、共有できるキャッシュを必須にする。
+"""
+from django.conf import settings
+from django.core.checks import Error, register
+
+# プロセスの間で共有されないキャッシュバックエンド
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES["default"]["BACKEND"]
+    if settings.MYMATH_WORKERS > 1 and backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f"MYMATH_WORKERS={settings.MYMATH_WORKERS} ですが、キャッシュ({backend})がプロセスごとです。",
+            hint="CACHE_URL に redis:// や dbcache:// など、プロセスの間で共有できるキャッシュを指定してください。",
+            id="mymath.E001",
+        )]
+    return []
@@ -0,0 +1,128 @@
+"""受験結果(UserTestResult)と解答(UserQuestionSelect)のエクスポート
+
+行は .iterator(chunk_size=...) で少しずつ読み、1行ずつ文字列にして返すので、
+件数が増えてもメモリ使用量は変わらない。
+管理者用のビュー(views.export)と export_attempts コマンドで使う。
+解答には archive_attempts でまとめた古い受験の解答(archive.py)も含める。
+"""
+import csv
+import json
+
+from .archive import iter_archived
+from .models import UserQuestionSelect, UserTestResult
+
+
+CHUNK_SIZE = 2000
+
+ATTEMPT_COLUMNS = ["attempt_id", "user_id", "username", "exam_id", "exam_title",
+                   "category", "count", "score", "submitted"]
+ANSWER_COLUMNS = ["attempt_id", "user_id", "username", "exam_id", "exam_title",
+                  "question_id", "question_number", "select", "correct", "submitted"]
+
+
+def filter_attempts(queryset, exam=None, category=None, since=None, until=None,
+                    prefix=""):
+    """UserTestResult の条件で絞り込む。prefixは UserQuestionSelect から絞るときに使う"""
+    filters = {}
+    if exam:
+        filters[f"{prefix}exam_id"] = exam
+    if category:
+        filters[f"{prefix}exam__category_id"] = category
+    if since:
+        filters[f"{prefix}submitted__date__gte"] = since
+    if until:
+        filters[f"{prefix}submitted__date__lte"] = until
+    return queryset.filter(**filters)
+
+
+def iter_attempts(**filters):
+    attempts = filter_attempts(
+        UserTestResult.objects.select_related("user", "exam__category"), **filters
+    ).order_by("id")
+    for attempt in attempts.iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            "attempt_id": attempt.id,
+            "user_id": attempt.user_id,
+            "username": attempt.user.username,
+            "exam_id": attempt.exam_id,
+            "exam_title": attempt.exam.title,
+            "category": attempt.exam.category.name,
+            "count": attempt.count,
+            "score": attempt.score,
+            "submitted": attempt.submitted.isoformat(),
+        }
+
+
+def iter_archived_answers(**filters):
+    attempts = filter_attempts(
+        UserTestResult.objects.select_related("user", "exam"), **filters).order_by("id")
+    for attempt, question_id, number, select, correct in iter_archived(attempts, CHUNK_SIZE):
+        yield {
+            "attempt_id": attempt.id,
+            "user_id": attempt.user_id,
+            "username": attempt.user.username,
+            "exam_id": attempt.exam_id,
+            "exam_title": attempt.exam.title,
+            "question_id": question_id,
+            "question_number": number,
+            "select": select,
+            "correct": correct,
+            "submitted": attempt.submitted.isoformat(),
+        }
+
+
+def iter_answers(**filters):
+    # アーカイブした古い受験の解答を先に返す
+    yield from iter_archived_answers(**filters)
+    answers = filter_attempts(
+        UserQuestionSelect.objects.select_related(
+            "test_result__user", "test_result__exam", "question"),
+        prefix="test_result__", **filters
+    ).order_by("id")
+    for answer in answers.iterator(chunk_size=CHUNK_SIZE):
+        attempt = answer.test_result
+        yield {
+            "attempt_id": attempt.id,
+            "user_id": attempt.user_id,
+            "username": attempt.user.username,
+            "exam_id": attempt.exam_id,
+            "exam_title": attempt.exam.title,
+            "question_id": answer.question_id,
+            "question_number": answer.question.number,
+            "select": answer.select,
+            "correct": answer.correct,
+            "submitted": attempt.submitted.isoformat(),
+        }
+
+
+EXPORTS = {
+    "attempts": (iter_attempts, ATTEMPT_COLUMNS),
+    "answers": (iter_answers, ANSWER_COLUMNS),
+}
+
+
+class _Echo:
+    # csv.writer の書き込み先。書き込んだ文字列をそのまま返す
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, columns):
+    writer = csv.DictWriter(_Echo(), fieldnames=columns)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def iter_export(kind, fmt, **filters):
+    """kind("attempts" / "answers")の行を fmt("csv" / "jsonl")の文字列で1行ずつ返す"""
+    iter_rows, columns = EXPORTS[kind]
+    rows = iter_rows(**filters)
+    if fmt == "jsonl":
+        return iter_jsonl(rows)
+    return iter_csv(rows, columns)
@@ -0,0 +1,15 @@
+from django import forms
+
+
+class ExportFilterForm(forms.Form):
+    # エクスポートの絞り込み条件。ビューとexport_attemptsコマンドの両方で使う
+    FORMAT_CHOICES = [("csv", "CSV"), ("jsonl", "JSONL")]
+
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
+    exam = forms.IntegerField(label="テストID", required=False)
+    category = forms.IntegerField(label="カテゴリーID", required=False)
+    since = forms.DateField(label="開始日", required=False)
+    until = forms.DateField(label="終了日", required=False)
+
+    def clean_format(self):
+        return self.cleaned_data["format"] or "csv"
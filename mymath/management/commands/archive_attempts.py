@@ -0,0 +1,60 @@
+"""終了してから日数がたった受験の解答を UserTestResult にまとめるコマンド(mymath/archive.py)
+
+    python manage.py archive_attempts --older-than-days 30 --chunk-size 500
+
+chunk-size 件ずつ別のトランザクションで、解答を archived_* に詰めて UserQuestionSelect の行を削除する。
+答え合わせと結果のページ、エクスポート、rebuild_question_stats はどちらの形でも読める。
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from mymath.models import UserTestResult
+
+
+def archivable_attempts(cutoff):
+    """cutoffより前に終了し、まだまとめていない受験結果"""
+    return UserTestResult.objects.filter(finished__lt=cutoff, archived_answered__isnull=True)
+
+
+class Command(BaseCommand):
+    help = "終了してから日数がたった受験の解答を、受験結果ごとに小さくまとめます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, default=30,
+                            help="この日数より前に終了したものを対象にする")
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="1トランザクションでまとめる受験結果の件数")
+        parser.add_argument("--sleep", type=float, default=0,
+                            help="チャンクごとに待つ秒数")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="まとめずに件数だけ表示する")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size は1以上を指定してください。")
+        cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+        if options["dry_run"]:
+            self.stdout.write(f"{archivable_attempts(cutoff).count()}件がまとめる対象です。")
+            return
+
+        archived = skipped = 0
+        last_id = 0
+        while True:
+            # まとめられないものが残っても先に進めるよう、idの順にたどる
+            ids = list(archivable_attempts(cutoff).filter(id__gt=last_id).order_by("id").values_list(
+                "id", flat=True)[:options["chunk_size"]])
+            if not ids:
+                break
+            last_id = ids[-1]
+            done = UserTestResult.objects.archive_answers(ids)
+            archived += done
+            skipped += len(ids) - done
+            self.stdout.write(f"{archived}件まとめました。")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"選択が1〜4でない解答がある{skipped}件はそのままにしました。"))
+        self.stdout.write(self.style.SUCCESS(f"合計{archived}件の受験結果の解答をまとめました。"))
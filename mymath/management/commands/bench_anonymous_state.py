@@ -0,0 +1,71 @@
+"""未ログインの受験状況の保存方法(セッション / Cookie)を比べるベンチマーク
+
+    python manage.py bench_anonymous_state --questions 10 --iterations 2000
+
+10問の試験を最後まで解いたときの保存サイズと、1回の解答で行う
+「読み込み → 1問追加 → 保存」の処理速度を比べる。
+セッションは settings.SESSION_ENGINE(既定はデータベース)を使い、実際に保存する。
+"""
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core import signing
+from django.core.management.base import BaseCommand
+
+from mymath.anonymous import new_state, pack_state, signed_cookie_value, unpack_state
+
+
+class Command(BaseCommand):
+    help = "未ログインの受験状況をセッションとCookieに保存したときのサイズと速度を比べます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--questions", type=int, default=10)
+        parser.add_argument("--iterations", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        questions = options["questions"]
+        iterations = options["iterations"]
+        state = new_state(1)
+        for number in range(1, questions + 1):
+            state["question_select"][str(number)] = number % 4 + 1
+            state["answer_correct"][str(number)] = number % 3 != 0
+
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        session = session_store()
+        session["exam"] = state
+        session.save()
+        session_size = len(session.encode(dict(session.items())))
+        session_rate = self._bench_session(session_store, session.session_key, questions, iterations)
+        session.delete()
+
+        cookie_size = len(signed_cookie_value(state))
+        cookie_rate = self._bench_cookie(state, questions, iterations)
+
+        self.stdout.write(f"{questions}問, {iterations}回")
+        self.stdout.write(f"{'保存先':<10}{'サイズ(byte)':>14}{'解答/秒':>12}")
+        self.stdout.write(f"{'session':<10}{session_size:>14}{session_rate:>12.0f}")
+        self.stdout.write(f"{'cookie':<10}{cookie_size:>14}{cookie_rate:>12.0f}")
+
+    def _bench_session(self, session_store, session_key, questions, iterations):
+        # exam() と同じく、リクエストごとにセッションを読み込み、1問書き換えて保存する
+        started = time.perf_counter()
+        for i in range(iterations):
+            session = session_store(session_key)
+            state = session["exam"]
+            number = str(i % questions + 1)
+            state["question_select"][number] = i % 4 + 1
+            session["exam"] = state
+            session.save()
+        return iterations / (time.perf_counter() - started)
+
+    def _bench_cookie(self, state, questions, iterations):
+        signer = signing.get_cookie_signer(salt="bench")
+        value = signer.sign(pack_state(state))
+        started = time.perf_counter()
+        for i in range(iterations):
+            state = unpack_state(signer.unsign(value))
+            number = str(i % questions + 1)
+            state["question_select"][number] = i % 4 + 1
+            value = signer.sign(pack_state(state))
+        return iterations / (time.perf_counter() - started)
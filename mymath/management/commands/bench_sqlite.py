@@ -0,0 +1,170 @@
+"""SQLite の既定の設定と本番用の設定(djangomath/sqlite.py)で書き込みの速さを比べるコマンド
+
+    python manage.py bench_sqlite --threads 8 --transactions 200
+
+一時ディレクトリに SQLite のファイルを作り、解答の記録と同じ形のトランザクション
+(受験結果を読む → 解答を INSERT → 解答数を UPDATE)を複数のスレッドから同時に実行する。
+読み込みだけのスレッドも同時に動かす。設定ごとに1秒あたりのコミット数、エラー数、
+p50 / p95 の時間と読み込みの回数を表示する。settings の DATABASES は使わない。
+"""
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+from django.db.utils import load_backend
+
+from djangomath.sqlite import production_options
+
+from .loadtest import percentile
+
+
+PROFILES = {
+    "default": {},
+    "production": production_options(),
+}
+
+SCHEMA = [
+    "CREATE TABLE bench_attempt (id INTEGER PRIMARY KEY, answered INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE bench_answer (id INTEGER PRIMARY KEY, attempt_id INTEGER NOT NULL,"
+    " question INTEGER NOT NULL, sel INTEGER NOT NULL)",
+]
+
+
+def open_connection(alias, settings_dict):
+    """このスレッドだけで使う接続を alias で登録する(settings の DATABASES には加えない)"""
+    backend = load_backend(settings_dict["ENGINE"])
+    connections[alias] = backend.DatabaseWrapper(settings_dict, alias)
+    return connections[alias]
+
+
+def close_connection(alias):
+    connections[alias].close()
+    del connections[alias]
+
+
+class Command(BaseCommand):
+    help = "SQLite の既定の設定と本番用の設定で、同時に書き込んだときの速さを比べます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="書き込むスレッド数")
+        parser.add_argument("--readers", type=int, default=2, help="読み込むだけのスレッド数")
+        parser.add_argument("--transactions", type=int, default=200,
+                            help="1スレッドあたりのトランザクション数")
+        parser.add_argument("--profile", choices=list(PROFILES), action="append",
+                            help="測る設定(省略時はすべて)")
+
+    def handle(self, *args, **options):
+        if options["threads"] < 1 or options["transactions"] < 1:
+            raise CommandError("--threads と --transactions は1以上を指定してください。")
+        tmp = Path(tempfile.mkdtemp(prefix="bench_sqlite-"))
+        try:
+            results = {}
+            for profile in options["profile"] or list(PROFILES):
+                results[profile] = self.bench(profile, tmp / f"{profile}.sqlite3", options)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.stdout.write(f"{'設定':12} {'journal':>8} {'コミット/秒':>12} {'エラー':>8} "
+                          f"{'p50':>8} {'p95':>8} {'読み込み':>10}")
+        for profile, result in results.items():
+            self.stdout.write(
+                f"{profile:12} {result['journal_mode']:>8} {result['rate']:>12.0f} {result['errors']:>8} "
+                f"{result['p50'] * 1000:>6.1f}ms {result['p95'] * 1000:>6.1f}ms {result['reads']:>10}")
+        if "default" in results and "production" in results and results["default"]["rate"]:
+            self.stdout.write(self.style.SUCCESS(
+                f"production は default の {results['production']['rate'] / results['default']['rate']:.1f}倍"))
+
+    def bench(self, profile, path, options):
+        # 足りない項目を既定値で埋める。接続はスレッドごとに open_connection() で作る
+        settings_dict = connections.configure_settings({"default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": str(path),
+            "OPTIONS": PROFILES[profile],
+        }})["default"]
+        alias = f"bench_sqlite_{profile}"
+        with open_connection(alias, settings_dict).cursor() as cursor:
+            for sql in SCHEMA:
+                cursor.execute(sql)
+            cursor.executemany("INSERT INTO bench_attempt (id) VALUES (%s)",
+                               [(i,) for i in range(options["threads"])])
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+        close_connection(alias)
+        return {"journal_mode": journal_mode, **self.run(alias, settings_dict, options)}
+
+    def run(self, alias, settings_dict, options):
+        timings = []
+        errors = [0]
+        reads = [0]
+        lock = threading.Lock()
+        writing = threading.Event()
+        writing.set()
+
+        def writer(attempt_id):
+            # 解答の記録と同じように、読んでから書き込む
+            local = []
+            failed = 0
+            open_connection(alias, settings_dict)
+            try:
+                for question in range(options["transactions"]):
+                    started = time.perf_counter()
+                    try:
+                        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                            cursor.execute("SELECT answered FROM bench_attempt WHERE id = %s", [attempt_id])
+                            cursor.fetchone()
+                            cursor.execute(
+                                "INSERT INTO bench_answer (attempt_id, question, sel) VALUES (%s, %s, %s)",
+                                [attempt_id, question, question % 4 + 1])
+                            cursor.execute(
+                                "UPDATE bench_attempt SET answered = answered + 1 WHERE id = %s", [attempt_id])
+                    except DatabaseError:
+                        failed += 1
+                        continue
+                    local.append(time.perf_counter() - started)
+            finally:
+                close_connection(alias)
+            with lock:
+                timings.extend(local)
+                errors[0] += failed
+
+        def reader():
+            count = 0
+            open_connection(alias, settings_dict)
+            try:
+                while writing.is_set():
+                    try:
+                        with connections[alias].cursor() as cursor:
+                            cursor.execute("SELECT COUNT(*), SUM(answered) FROM bench_attempt")
+                            cursor.fetchone()
+                        count += 1
+                    except DatabaseError:
+                        pass
+            finally:
+                close_connection(alias)
+            with lock:
+                reads[0] += count
+
+        writers = [threading.Thread(target=writer, args=(i,)) for i in range(options["threads"])]
+        readers = [threading.Thread(target=reader) for _ in range(options["readers"])]
+        started = time.perf_counter()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        writing.clear()
+        for thread in readers:
+            thread.join()
+
+        timings.sort()
+        return {
+            "rate": len(timings) / elapsed,
+            "errors": errors[0],
+            "p50": percentile(timings, 50),
+            "p95": percentile(timings, 95),
+            "reads": reads[0],
+        }
@@ -0,0 +1,60 @@
+"""解答が1つもない古い受験結果(UserTestResult)を削除するコマンド
+
+    python manage.py compact_attempts --older-than-days 7 --chunk-size 500
+
+chunk-size 件ずつ別のトランザクションで削除するので、ロックを長く持たない。
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from mymath.models import UserQuestionSelect, UserTestResult
+
+
+def empty_attempts(cutoff):
+    """cutoffより前に作成され、解答が1つもない受験結果"""
+    return UserTestResult.objects.filter(
+        submitted__lt=cutoff, answered_count=0,
+    ).exclude(
+        Exists(UserQuestionSelect.objects.filter(test_result=OuterRef("pk"))),
+    )
+
+
+class Command(BaseCommand):
+    help = "解答が1つもない古い受験結果を少しずつ削除します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, default=1,
+                            help="この日数より前に作成されたものを対象にする")
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="1トランザクションで削除する件数")
+        parser.add_argument("--sleep", type=float, default=0,
+                            help="チャンクごとに待つ秒数")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="削除せずに件数だけ表示する")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size は1以上を指定してください。")
+        cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+        if options["dry_run"]:
+            self.stdout.write(f"{empty_attempts(cutoff).count()}件が削除の対象です。")
+            return
+
+        reclaimed = 0
+        while True:
+            ids = list(empty_attempts(cutoff).order_by("id").values_list("id", flat=True)[:options["chunk_size"]])
+            if not ids:
+                break
+            with transaction.atomic():
+                # 選んでから削除するまでに解答が記録されたものは削除しないよう、条件をつけなおす
+                deleted, _ = empty_attempts(cutoff).filter(id__in=ids).delete()
+            reclaimed += deleted
+            self.stdout.write(f"{reclaimed}件削除しました。")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"合計{reclaimed}件の受験結果を削除しました。"))
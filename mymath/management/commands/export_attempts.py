@@ -0,0 +1,39 @@
+"""受験結果と解答を CSV / JSONL で書き出すコマンド
+
+    python manage.py export_attempts attempts --format csv --output attempts.csv
+    python manage.py export_attempts answers --format jsonl --exam 3 --since 2025-04-01
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from mymath.exports import EXPORTS, iter_export
+from mymath.forms import ExportFilterForm
+
+
+class Command(BaseCommand):
+    help = "受験結果(attempts)または解答(answers)を CSV / JSONL で書き出します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(EXPORTS))
+        parser.add_argument("--format", default="csv", choices=["csv", "jsonl"])
+        parser.add_argument("--exam", help="テストIDで絞り込む")
+        parser.add_argument("--category", help="カテゴリーIDで絞り込む")
+        parser.add_argument("--since", help="この日(YYYY-MM-DD)以降に受験したもの")
+        parser.add_argument("--until", help="この日(YYYY-MM-DD)までに受験したもの")
+        parser.add_argument("--output", help="出力先ファイル(省略時は標準出力)")
+
+    def handle(self, *args, **options):
+        # 絞り込み条件の検証はビューと同じフォームで行う
+        form = ExportFilterForm({key: options[key] for key in
+                                 ("format", "exam", "category", "since", "until")
+                                 if options[key]})
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        filters = dict(form.cleaned_data)
+        fmt = filters.pop("format")
+        lines = iter_export(options["kind"], fmt, **filters)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,166 @@
+"""CSV / JSONL から試験と問題をまとめて登録するコマンド
+
+    python manage.py import_exams questions.csv
+    python manage.py import_exams questions.jsonl --batch-size 5000 --resume
+
+1行が1問で、列(キー)は以下のとおり。grade と answer_text は省略できる。
+
+    category, grade, exam, text, select_1, select_2, select_3, select_4, answer, answer_text
+
+ファイルは1行ずつ読み込むので、大きなファイルでもメモリ使用量は増えない。
+バッチごとにコミットし、どこまで登録したかをチェックポイントファイルに書き込む。
+途中で失敗したときは --resume をつけて再実行すると続きから登録する。
+"""
+import csv
+import json
+import os
+import time
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from mymath.models import Category, Exam, Question
+
+
+QUESTION_FIELDS = ("text", "select_1", "select_2", "select_3", "select_4", "answer", "answer_text")
+
+
+def iter_rows(path, fmt):
+    """(行番号, 辞書) を1行ずつ返すジェネレーター"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            for row_no, row in enumerate(csv.DictReader(f), start=1):
+                yield row_no, row
+        else:
+            for row_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield row_no, json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise CommandError(f"{row_no}行目のJSONが読み込めません: {e}")
+
+
+def row_name(row, key):
+    """行のカテゴリー名やテスト名。JSONLでは数値のこともあるので文字列にする"""
+    return str(row.get(key) or "").strip()
+
+
+def build_question(row):
+    """行から Question を作ってフィールドの制約で検証する。examと番号は後で設定する"""
+    if not isinstance(row, dict): # JSONLの行が [1, 2] や "x" のとき
+        raise ValidationError("行がJSONのオブジェクトではありません。")
+    # 長すぎる名前はバッチの途中でDBのエラーになるので、ここで行ごとのエラーにする
+    for key, field in (("category", Category._meta.get_field("name")),
+                       ("exam", Exam._meta.get_field("title"))):
+        name = row_name(row, key)
+        if not name:
+            raise ValidationError({key: "この項目は必須です。"})
+        if len(name) > field.max_length:
+            raise ValidationError({key: f"{field.max_length}文字以内で指定してください。"})
+    grade = str(row.get("grade") or "elementary")
+    if grade not in dict(Category.GRADE_CHOICES):
+        raise ValidationError({"grade": f"{grade} は選択できません。"})
+    try:
+        answer = int(row.get("answer"))
+    except (TypeError, ValueError):
+        raise ValidationError({"answer": "正解番号は1〜4の数字で指定してください。"})
+    question = Question(**{name: row.get(name) or "" for name in QUESTION_FIELDS if name != "answer"},
+                        answer=answer)
+    question.clean_fields(exclude=["number", "exam"])
+    return question
+
+
+def read_checkpoint(path):
+    if not path.exists():
+        return 0
+    return json.loads(path.read_text())["rows"]
+
+
+def write_checkpoint(path, rows):
+    # 書き込み途中で止まっても壊れないように一時ファイルから置き換える
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({"rows": rows}))
+    os.replace(tmp, path)
+
+
+class Command(BaseCommand):
+    help = "CSV / JSONL ファイルから試験と問題をまとめて登録します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV または JSONL ファイル")
+        parser.add_argument("--format", choices=["csv", "jsonl"],
+                            help="ファイル形式(省略時は拡張子から判定)")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="1トランザクションで登録する行数")
+        parser.add_argument("--checkpoint",
+                            help="チェックポイントファイル(省略時は <path>.checkpoint)")
+        parser.add_argument("--resume", action="store_true",
+                            help="チェックポイントの続きから登録する")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"{path} が見つかりません。")
+        fmt = options["format"] or ("jsonl" if path.suffix in (".jsonl", ".json") else "csv")
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size は1以上を指定してください。")
+        checkpoint = Path(options["checkpoint"] or f"{path}.checkpoint")
+        done = read_checkpoint(checkpoint) if options["resume"] else 0
+        if done:
+            self.stdout.write(f"{done}行目まで登録済みなので、続きから登録します。")
+
+        self.exam_ids = {}  # {(category, grade, exam): exam_id}
+        imported = skipped = 0
+        started = time.perf_counter()
+        batch = []
+        last_row = done
+        for row_no, row in iter_rows(path, fmt):
+            if row_no <= done:
+                continue
+            last_row = row_no
+            try:
+                batch.append((row, build_question(row)))
+            except ValidationError as e:
+                skipped += 1
+                self.stderr.write(f"{row_no}行目をスキップしました: {e.messages}")
+            if len(batch) >= batch_size:
+                imported += self.flush(batch)
+                batch = []
+                write_checkpoint(checkpoint, last_row)
+                self.report(imported, started)
+        if batch:
+            imported += self.flush(batch)
+        write_checkpoint(checkpoint, last_row)
+        self.report(imported, started)
+        # 最後まで登録できたらチェックポイントは不要
+        checkpoint.unlink()
+        self.stdout.write(self.style.SUCCESS(
+            f"{imported}問を登録しました(スキップ{skipped}行)。"))
+
+    @transaction.atomic
+    def flush(self, batch):
+        for row, question in batch:
+            question.exam_id = self.get_exam_id(row)
+        Question.objects.bulk_create_numbered([question for _, question in batch])
+        return len(batch)
+
+    def get_exam_id(self, row):
+        grade = str(row.get("grade") or "elementary")
+        key = (row_name(row, "category"), grade, row_name(row, "exam"))
+        if key not in self.exam_ids:
+            # 名前は一意ではないので、同名が複数あるときは最初のものを使う
+            category = (Category.objects.filter(name=key[0], grade=grade).first()
+                        or Category.objects.create(name=key[0], grade=grade))
+            exam = (Exam.objects.filter(title=key[2], category=category).first()
+                    or Exam.objects.create(title=key[2], category=category))
+            self.exam_ids[key] = exam.id
+        return self.exam_ids[key]
+
+    def report(self, imported, started):
+        elapsed = time.perf_counter() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(f"{imported}問登録 {elapsed:.1f}秒 ({rate:.0f}行/秒)")
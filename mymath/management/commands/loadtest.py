@@ -0,0 +1,234 @@
+"""大勢の生徒が同時に同じテストを始めたときの負荷を測るコマンド
+
+    python manage.py loadtest --students 200 --questions 10
+    python manage.py loadtest --students 500 --logged-in-ratio 0 --ramp-up 60
+    python manage.py loadtest --students 200 --async
+
+負荷テスト用のテストと生徒を作り、生徒ごとのスレッドが Django のテストクライアントで
+exam → answer → … → result の流れを最後までたどる(WSGIアプリを直接呼ぶのでサーバーは不要)。
+ページごとの件数、エラー数、p50 / p95 / p99 の応答時間と、全体のスループットを表示する。
+--async をつけると、非同期版のページ(async_views.py)を ASGI のテストクライアントで
+asyncio のタスクとして同時に呼び出すので、同期版のページ(スレッド)と比べられる。
+データベースは settings の DATABASES をそのまま使うので、SQLite と PostgreSQL を
+DB_ENGINE などの環境変数を切り替えて比べられる。作ったデータは最後に削除する(--keep で残す)。
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from mymath.models import Category, Exam, Question
+
+
+USERNAME_PREFIX = "loadtest-"
+
+
+def percentile(values, percent):
+    """昇順に並んだ values の percent パーセンタイル(最近傍法)"""
+    if not values:
+        return 0
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
+
+
+class Recorder:
+    """ページごとの応答時間とエラー数をスレッドをまたいで集める"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, ok):
+        with self.lock:
+            self.timings[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+
+def walk_exam(client, exam_id, numbers, record):
+    """1人の生徒として全問に解答して結果を見る"""
+    def call(name, method, url, data=None):
+        started = time.perf_counter()
+        try:
+            response = getattr(client, method)(url, data)
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        record(name, time.perf_counter() - started, ok)
+
+    call("mymath:index", "get", reverse("mymath:index"))
+    for number in numbers:
+        exam_url = reverse("mymath:exam", args=[exam_id, number])
+        answer_url = reverse("mymath:answer", args=[exam_id, number])
+        call("mymath:exam", "get", exam_url)
+        call("mymath:exam", "post", exam_url, {f"question_{number}": random.randint(1, 4)})
+        call("mymath:answer", "get", answer_url)
+        call("mymath:answer", "post", answer_url)
+    call("mymath:result", "get", reverse("mymath:result", args=[exam_id]))
+
+
+async def awalk_exam(client, exam_id, numbers, record):
+    """walk_exam() の非同期版"""
+    async def call(name, method, url, data=None):
+        started = time.perf_counter()
+        try:
+            response = await getattr(client, method)(url, data)
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        record(name, time.perf_counter() - started, ok)
+
+    await call("mymath:index", "get", reverse("mymath:index"))
+    for number in numbers:
+        exam_url = reverse("mymath:exam", args=[exam_id, number])
+        answer_url = reverse("mymath:answer", args=[exam_id, number])
+        await call("mymath:exam", "get", exam_url)
+        await call("mymath:exam", "post", exam_url, {f"question_{number}": random.randint(1, 4)})
+        await call("mymath:answer", "get", answer_url)
+        await call("mymath:answer", "post", answer_url)
+    await call("mymath:result", "get", reverse("mymath:result", args=[exam_id]))
+
+
+class Command(BaseCommand):
+    help = "生徒が同時に受験したときの各ページの応答時間とスループットを測ります。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=100, help="同時に受験する生徒の数")
+        parser.add_argument("--questions", type=int, default=10, help="テストの問題数")
+        parser.add_argument("--logged-in-ratio", type=float, default=0.5,
+                            help="ログインして受験する生徒の割合(0〜1)")
+        parser.add_argument("--ramp-up", type=float, default=0,
+                            help="全員が受験を始めるまでの秒数(0 のときは一斉に始める)")
+        parser.add_argument("--threads", type=int,
+                            help="同時に動かすスレッド数。--async のときは同時に動かすタスク数(省略時は生徒の数)")
+        parser.add_argument("--async", action="store_true", dest="use_async",
+                            help="非同期版のページを ASGI で呼び出す")
+        parser.add_argument("--keep", action="store_true", help="作ったテストと生徒を削除しない")
+
+    def handle(self, *args, **options):
+        students = options["students"]
+        if students < 1 or options["questions"] < 1:
+            raise CommandError("--students と --questions は1以上を指定してください。")
+        if not 0 <= options["logged_in_ratio"] <= 1:
+            raise CommandError("--logged-in-ratio は0〜1で指定してください。")
+
+        exam, users = self.seed(students, options["questions"], options["logged_in_ratio"])
+        self.stdout.write(
+            f"{connection.vendor}{'(非同期)' if options['use_async'] else ''}: "
+            f"生徒{students}人(ログイン{len(users)}人)、{options['questions']}問のテストで測定します。")
+        try:
+            recorders, elapsed = self.run(exam, users, students, options)
+        finally:
+            if not options["keep"]:
+                exam.category.delete()
+                User.objects.filter(id__in=[user.id for user in users]).delete()
+        self.report(recorders, elapsed)
+
+    def seed(self, students, questions, logged_in_ratio):
+        category = Category.objects.create(name="負荷テスト")
+        exam = Exam.objects.create(title="負荷テスト", category=category)
+        Question.objects.bulk_create_numbered([
+            Question(exam=exam, text=f"問題{i}", select_1="1", select_2="2", select_3="3",
+                     select_4="4", answer=random.randint(1, 4))
+            for i in range(1, questions + 1)
+        ])
+        suffix = f"{exam.id}-"
+        User.objects.bulk_create([
+            User(username=f"{USERNAME_PREFIX}{suffix}{i}")
+            for i in range(round(students * logged_in_ratio))
+        ])
+        users = list(User.objects.filter(username__startswith=f"{USERNAME_PREFIX}{suffix}"))
+        return exam, users
+
+    def run(self, exam, users, students, options):
+        recorders = {"anonymous": Recorder(), "logged_in": Recorder()}
+        numbers = list(Question.objects.filter(exam=exam).order_by("number").values_list("number", flat=True))
+        # 生徒は localhost からアクセスしたことにする。
+        # ASGI のテストクライアントは Host が testserver に決まっているので、それも許可する
+        allowed_hosts = [*settings.ALLOWED_HOSTS, "localhost", "testserver"]
+
+        def student(index):
+            if options["ramp_up"]:
+                time.sleep(options["ramp_up"] * index / students)
+            client = Client(HTTP_HOST="localhost")
+            kind = "logged_in" if index < len(users) else "anonymous"
+            try:
+                if kind == "logged_in":
+                    # ログインはセッションの作成だけを測る(パスワードのハッシュ計算は含めない)
+                    started = time.perf_counter()
+                    try:
+                        client.force_login(users[index])
+                    except Exception:
+                        recorders[kind].add("login", time.perf_counter() - started, False)
+                        return
+                    recorders[kind].add("login", time.perf_counter() - started, True)
+                walk_exam(client, exam.id, numbers, recorders[kind].add)
+            finally:
+                # スレッドごとに開いた接続を閉じる
+                connections.close_all()
+
+        async def astudent(index, semaphore):
+            if options["ramp_up"]:
+                await asyncio.sleep(options["ramp_up"] * index / students)
+            async with semaphore:
+                client = AsyncClient()
+                kind = "logged_in" if index < len(users) else "anonymous"
+                if kind == "logged_in":
+                    started = time.perf_counter()
+                    try:
+                        await client.aforce_login(users[index])
+                    except Exception:
+                        recorders[kind].add("login", time.perf_counter() - started, False)
+                        return
+                    recorders[kind].add("login", time.perf_counter() - started, True)
+                await awalk_exam(client, exam.id, numbers, recorders[kind].add)
+
+        async def run_async():
+            semaphore = asyncio.Semaphore(options["threads"] or students)
+            await asyncio.gather(*(astudent(index, semaphore) for index in range(students)))
+
+        # エラーは件数として集計するので、リクエストごとのエラーログは出さない
+        request_logger = logging.getLogger("django.request")
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        started = time.perf_counter()
+        try:
+            if options["use_async"]:
+                with override_settings(ALLOWED_HOSTS=allowed_hosts, ROOT_URLCONF="djangomath.urls_async"):
+                    asyncio.run(run_async())
+            else:
+                with override_settings(ALLOWED_HOSTS=allowed_hosts):
+                    with ThreadPoolExecutor(max_workers=options["threads"] or students) as executor:
+                        list(executor.map(student, range(students)))
+        finally:
+            request_logger.setLevel(level)
+        return recorders, time.perf_counter() - started
+
+    def report(self, recorders, elapsed):
+        total = sum(len(timings) for recorder in recorders.values()
+                    for timings in recorder.timings.values())
+        self.stdout.write(f"{'':10} {'ページ':14} {'件数':>6} {'エラー':>6} "
+                          f"{'p50':>8} {'p95':>8} {'p99':>8}")
+        for kind, recorder in recorders.items():
+            for name in sorted(recorder.timings):
+                timings = sorted(recorder.timings[name])
+                p50, p95, p99 = (percentile(timings, p) * 1000 for p in (50, 95, 99))
+                self.stdout.write(
+                    f"{kind:10} {name:14} {len(timings):>6} {recorder.errors[name]:>6} "
+                    f"{p50:>6.1f}ms {p95:>6.1f}ms {p99:>6.1f}ms")
+        errors = sum(sum(recorder.errors.values()) for recorder in recorders.values())
+        style = self.style.SUCCESS if not errors else self.style.WARNING
+        self.stdout.write(style(
+            f"{total}リクエスト {elapsed:.1f}秒 ({total / elapsed:.0f}リクエスト/秒)、エラー{errors}件"))
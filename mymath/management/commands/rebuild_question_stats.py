@@ -0,0 +1,55 @@
+"""問題ごとの集計(QuestionStats)を解答から作りなおすコマンド
+
+    python manage.py rebuild_question_stats
+
+集計は解答を記録するたびに加算しているが、ずれたときや導入時にはこのコマンドで作りなおす。
+archive_attempts でまとめた古い受験の解答(mymath/archive.py)も数える。
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from mymath.archive import iter_archived
+from mymath.models import QuestionStats, UserQuestionSelect, UserTestResult
+
+
+COUNTS = ["answered", "correct", "select_1_count", "select_2_count", "select_3_count", "select_4_count"]
+
+
+def archived_counts():
+    """アーカイブした解答を {question_id: {集計の列: 数}} にまとめる"""
+    counts = {}
+    attempts = UserTestResult.objects.only(
+        "exam_id", "exam_version_id", "archived_selects", "archived_answered", "archived_correct")
+    for _, question_id, _, select, correct in iter_archived(attempts):
+        row = counts.setdefault(question_id, dict.fromkeys(COUNTS, 0))
+        row["answered"] += 1
+        row["correct"] += int(correct)
+        row[f"select_{select}_count"] += 1
+    return counts
+
+
+class Command(BaseCommand):
+    help = "問題ごとの正答率と選択肢ごとの選択数を作りなおします。"
+
+    def handle(self, *args, **options):
+        rows = UserQuestionSelect.objects.values("question_id").annotate(
+            answered=Count("id"),
+            correct=Count("id", filter=Q(correct=True)),
+            select_1_count=Count("id", filter=Q(select=1)),
+            select_2_count=Count("id", filter=Q(select=2)),
+            select_3_count=Count("id", filter=Q(select=3)),
+            select_4_count=Count("id", filter=Q(select=4)),
+        ).order_by()
+        counts = archived_counts()
+        for row in rows.iterator():
+            question_id = row.pop("question_id")
+            total = counts.setdefault(question_id, dict.fromkeys(COUNTS, 0))
+            for name in COUNTS:
+                total[name] += row[name]
+        with transaction.atomic():
+            QuestionStats.objects.all().delete()
+            created = QuestionStats.objects.bulk_create(
+                (QuestionStats(question_id=question_id, **row) for question_id, row in counts.items()),
+                batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f"{len(created)}問の集計を作りなおしました。"))
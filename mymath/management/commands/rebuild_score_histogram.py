@@ -0,0 +1,37 @@
+"""得点分布(ExamScoreBucket)を受験結果から作りなおすコマンド
+
+    python manage.py rebuild_score_histogram
+
+全問に解答しているのに終了日時がない受験結果があれば、終了日時も記録する。
+得点分布は受験が終わるたびに加算しているが、ずれたときや導入時にはこのコマンドで作りなおす。
+"""
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import BooleanField, Case, Count, F, Value, When
+
+from mymath.models import Exam, ExamScoreBucket, UserTestResult, question_total
+from mymath.ranking import LEADERBOARD_KEY
+
+
+class Command(BaseCommand):
+    help = "テストごとの得点分布を作りなおします。"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            repaired = UserTestResult.objects.alias(question_total=question_total()).filter(
+                finished__isnull=True,
+                answered_count__gte=F("question_total"),
+                answered_count__gt=0,
+            ).update(finished=F("submitted"))
+            rows = UserTestResult.objects.filter(finished__isnull=False).annotate(
+                first_attempt=Case(When(count=1, then=Value(True)), default=Value(False),
+                                   output_field=BooleanField()),
+            ).values("exam_id", "first_attempt", "score").annotate(takers=Count("id")).order_by()
+            ExamScoreBucket.objects.all().delete()
+            created = ExamScoreBucket.objects.bulk_create(
+                (ExamScoreBucket(**row) for row in rows.iterator()), batch_size=1000)
+        cache.delete_many([LEADERBOARD_KEY.format(exam_id=exam_id)
+                           for exam_id in Exam.objects.values_list("id", flat=True)])
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(created)}行の得点分布を作りなおしました(終了日時を{repaired}件補いました)。"))
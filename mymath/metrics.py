@@ -0,0 +1,150 @@
+"""リクエストごとの計測値の集計と Prometheus 形式での出力
+
+MetricsMiddleware(middleware.py)がリクエストごとに以下を記録し、
+スタッフ用の /metrics で Prometheus のテキスト形式で返す。
+
+- URL名ごとの応答時間のヒストグラム
+- SQLのクエリ数とDB時間(querylog.py で計測。非同期ビューの sync_to_async のスレッドも含む)
+- セッションの読み込み数と書き込み数
+- レスポンスのサイズのヒストグラム
+
+集計はスレッドごとの辞書に書き込むだけにして、リクエストの処理中はロックを取らない。
+ロックを取るのはスレッドが初めて記録するときの登録と、/metrics で全スレッド分を合計するときだけ。
+終了したスレッドの集計は、そのときに1つにまとめて取り除く。リクエストごとにスレッドを作るサーバー
+(runserver など)でも、保持する集計は生きているスレッドの数までしか増えない。
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# {名前: (種類, 説明, ヒストグラムの区切り)}
+METRICS = {
+    "mymath_requests_total": ("counter", "リクエスト数", None),
+    "mymath_request_duration_seconds": ("histogram", "応答時間(秒)", LATENCY_BUCKETS),
+    "mymath_response_size_bytes": ("histogram", "レスポンスのサイズ(バイト)", SIZE_BUCKETS),
+    "mymath_db_queries_total": ("counter", "SQLのクエリ数", None),
+    "mymath_db_seconds_total": ("counter", "SQLの実行時間の合計(秒)", None),
+    "mymath_session_reads_total": ("counter", "セッションを読み込んだリクエスト数", None),
+    "mymath_session_writes_total": ("counter", "セッションを書き込んだリクエスト数", None),
+}
+
+
+class _Store:
+    """1スレッド分の集計。書き込むのはそのスレッドだけ"""
+
+    def __init__(self):
+        self.counters = defaultdict(float)  # {(名前, ラベル): 値}
+        self.histograms = {}  # {(名前, ラベル): [区切りごとの件数..., +Infの件数, 合計]}
+
+
+    def merge(self, other):
+        """other の集計を加える"""
+        for key, value in list(other.counters.items()):
+            self.counters[key] += value
+        for key, counts in list(other.histograms.items()):
+            counts = list(counts) # 書き込み中のスレッドがあっても壊れないよう、先にコピーする
+            if key in self.histograms:
+                self.histograms[key] = [a + b for a, b in zip(self.histograms[key], counts)]
+            else:
+                self.histograms[key] = counts
+
+
+_local = threading.local()
+_stores = {}  # {スレッド: _Store}
+_retired = _Store()  # 終了したスレッドの集計の合計
+_stores_lock = threading.Lock()
+
+
+def _retire_dead_threads():
+    """終了したスレッドの集計を _retired にまとめる。_stores_lock を取ってから呼ぶ"""
+    for thread in [thread for thread in _stores if not thread.is_alive()]:
+        _retired.merge(_stores.pop(thread))
+
+
+def _store():
+    store = getattr(_local, "store", None)
+    if store is None:
+        store = _local.store = _Store()
+        with _stores_lock:
+            _retire_dead_threads()
+            _stores[threading.current_thread()] = store
+    return store
+
+
+def inc(name, labels, value=1):
+    """カウンターを増やす。labels は (("view", "mymath:exam"), ...) のタプル"""
+    _store().counters[(name, labels)] += value
+
+
+def observe(name, labels, value):
+    """ヒストグラムに値を1つ記録する"""
+    buckets = METRICS[name][2]
+    histograms = _store().histograms
+    key = (name, labels)
+    counts = histograms.get(key)
+    if counts is None:
+        counts = histograms[key] = [0] * (len(buckets) + 2)
+    counts[bisect_left(buckets, value)] += 1
+    counts[-1] += value
+
+
+def collect():
+    """全スレッドの集計を合計して (counters, histograms) を返す"""
+    total = _Store()
+    with _stores_lock:
+        _retire_dead_threads()
+        total.merge(_retired)
+        stores = list(_stores.values())
+    for store in stores:
+        total.merge(store)
+    return total.counters, total.histograms
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_metrics():
+    """Prometheus のテキスト形式(version 0.0.4)の文字列を返す"""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            continue
+        for (metric, labels), counts in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels((*labels, ('le', bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(counts[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def clear_metrics():
+    """集計をすべて消す(テスト用)"""
+    with _stores_lock:
+        for store in [_retired, *_stores.values()]:
+            store.counters.clear()
+            store.histograms.clear()
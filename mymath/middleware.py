@@ -0,0 +1,175 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from .metrics import inc, observe
+from .profiling import Profile, requested_mode
+from .querylog import observe_queries
+from .routers import request_scope, wrote
+
+
+class QueryTimer:
+    """observe_queries() に渡して、クエリ数と実行時間を数える(querylog.py)"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """URL名ごとの応答時間、SQL、セッション、レスポンスサイズを記録する(metrics.py)
+
+    セッションの書き込みまで数えるため、MIDDLEWARE の先頭(SessionMiddlewareより外側)に置く。
+    非同期ビューのときにスレッドを使わないよう、同期と非同期の両方に対応する。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with observe_queries(timer):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with observe_queries(timer):
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    def record(self, request, response, elapsed, timer):
+        # URL名がないとき(404など)はラベルが増えすぎないよう1つにまとめる
+        match = request.resolver_match
+        view = (match.view_name if match else None) or "unresolved"
+        labels = (("view", view),)
+        inc("mymath_requests_total", (*labels, ("method", request.method),
+                                      ("status", str(response.status_code))))
+        observe("mymath_request_duration_seconds", labels, elapsed)
+        inc("mymath_db_queries_total", labels, timer.count)
+        inc("mymath_db_seconds_total", labels, timer.seconds)
+        if not response.streaming: # ストリーミングはサイズがわからないので記録しない
+            observe("mymath_response_size_bytes", labels, len(response.content))
+        session = getattr(request, "session", None)
+        if session is not None:
+            inc("mymath_session_reads_total", labels, int(session.accessed))
+            inc("mymath_session_writes_total", labels, int(session.modified))
+
+
+class ProfilerMiddleware:
+    """スタッフが指定したリクエストだけプロファイルを取る(profiling.py)
+
+    request.user を使うので AuthenticationMiddleware より後に置く。
+    指定がないリクエストはヘッダーとクエリ文字列を見るだけで通す。
+    非同期ビューのときは cProfile とサンプリングはイベントループのスレッドだけを計測する。
+    SQLの一覧には sync_to_async のスレッドで実行したクエリも入る(querylog.py)。
+    """
+    APPS = ("mymath", "accounts")
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = requested_mode(request)
+        if mode is None or not request.user.is_staff or not self._profiled_app(request):
+            return self.get_response(request)
+
+        profile = Profile(mode)
+        with observe_queries(profile.sql):
+            profile.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profile.stop()
+        saved = profile.save(request, response)
+        response["X-Mymath-Profile"] = saved.id
+        return response
+
+    async def __acall__(self, request):
+        mode = requested_mode(request)
+        if mode is None or not (await request.auser()).is_staff or not self._profiled_app(request):
+            return await self.get_response(request)
+
+        profile = Profile(mode)
+        with observe_queries(profile.sql):
+            profile.start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profile.stop()
+        saved = await sync_to_async(profile.save)(request, response)
+        response["X-Mymath-Profile"] = saved.id
+        return response
+
+    def _profiled_app(self, request):
+        try:
+            return resolve(request.path_info).app_name in self.APPS
+        except Resolver404:
+            return False
+
+
+class ReplicaStickinessMiddleware:
+    """書き込んだあと短い時間、そのブラウザの読み込みをプライマリーに固定する(routers.py)
+
+    POSTなどのリクエストと、セッション以外に書き込んだリクエストのあとに Cookie をつけ、
+    MYMATH_REPLICA_STICKY_SECONDS 秒の間はレプリカから読まない。
+    解答を送った直後の答え合わせや結果のページで、レプリカの遅れで自分の解答が見えなくなるのを防ぐ。
+    登録やログインの直後のユーザーもプライマリーから読むよう、AuthenticationMiddleware より外側に置く。
+    """
+    COOKIE = "mymath_primary"
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with request_scope(primary=self.sticky(request)):
+            response = self.get_response(request)
+            return self.stick(request, response)
+
+    async def __acall__(self, request):
+        with request_scope(primary=self.sticky(request)):
+            response = await self.get_response(request)
+            return self.stick(request, response)
+
+    def sticky(self, request):
+        return request.method not in self.SAFE_METHODS or self.COOKIE in request.COOKIES
+
+    def stick(self, request, response):
+        # Cookie をつけ直すのは書き込んだときだけ(読むだけのページを見続けても固定が延びない)
+        if request.method not in self.SAFE_METHODS or wrote():
+            response.set_cookie(self.COOKIE, "1", max_age=settings.MYMATH_REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_question_count(apps, schema_editor):
+    # 既存のテストの問題数を設定する
+    Exam = apps.get_model("mymath", "Exam")
+    exams = Exam.objects.annotate(num=Count("questions"))
+    for exam in exams:
+        exam.question_count = exam.num
+    Exam.objects.bulk_update(exams, ["question_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0009_alter_question_options_alter_question_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='question_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='問題数'),
+        ),
+        migrations.RunPython(fill_question_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:55
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def fill_next_question_number(apps, schema_editor):
+    # 既存のテストは最大の問題番号の次から採番する
+    Exam = apps.get_model("mymath", "Exam")
+    exams = Exam.objects.annotate(max_number=Max("questions__number"))
+    for exam in exams:
+        exam.next_question_number = (exam.max_number or 0) + 1
+    Exam.objects.bulk_update(exams, ["next_question_number"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0010_exam_question_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='next_question_number',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='次の問題番号'),
+        ),
+        migrations.RunPython(fill_next_question_number, migrations.RunPython.noop),
+    ]
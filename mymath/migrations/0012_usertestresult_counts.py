@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:59
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counts(apps, schema_editor):
+    # 既存の解答から正解数・解答数・点数を計算しなおす
+    UserTestResult = apps.get_model("mymath", "UserTestResult")
+    results = UserTestResult.objects.annotate(
+        num_answered=Count("userquestionselect"),
+        num_correct=Count("userquestionselect", filter=Q(userquestionselect__correct=True)))
+    for result in results:
+        result.answered_count = result.num_answered
+        result.correct_count = result.num_correct
+        result.score = result.num_correct * 10
+    UserTestResult.objects.bulk_update(results, ["answered_count", "correct_count", "score"],
+                                       batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0011_exam_next_question_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usertestresult',
+            name='answered_count',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='解答数'),
+        ),
+        migrations.AddField(
+            model_name='usertestresult',
+            name='correct_count',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='正解数'),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0012_usertestresult_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttemptCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_count', models.IntegerField(default=0, verbose_name='最後の回数')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='usertestresult',
+            index=models.Index(fields=['user', 'exam', '-count'], name='mymath_result_latest_idx'),
+        ),
+        migrations.AddField(
+            model_name='attemptcounter',
+            name='exam',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mymath.exam'),
+        ),
+        migrations.AddField(
+            model_name='attemptcounter',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='attemptcounter',
+            unique_together={('user', 'exam')},
+        ),
+    ]
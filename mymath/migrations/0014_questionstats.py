@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0013_attemptcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionStats',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='mymath.question')),
+                ('answered', models.PositiveIntegerField(default=0, verbose_name='解答数')),
+                ('correct', models.PositiveIntegerField(default=0, verbose_name='正解数')),
+                ('select_1_count', models.PositiveIntegerField(default=0, verbose_name='選択肢1')),
+                ('select_2_count', models.PositiveIntegerField(default=0, verbose_name='選択肢2')),
+                ('select_3_count', models.PositiveIntegerField(default=0, verbose_name='選択肢3')),
+                ('select_4_count', models.PositiveIntegerField(default=0, verbose_name='選択肢4')),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0014_questionstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExamScoreBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_attempt', models.BooleanField(verbose_name='1回目の受験')),
+                ('score', models.IntegerField(verbose_name='点数')),
+                ('takers', models.PositiveIntegerField(default=0, verbose_name='人数')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='usertestresult',
+            name='finished',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='終了日時'),
+        ),
+        migrations.AddIndex(
+            model_name='usertestresult',
+            index=models.Index(fields=['exam', 'count', '-score', 'finished'], name='mymath_result_ranking_idx'),
+        ),
+        migrations.AddField(
+            model_name='examscorebucket',
+            name='exam',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_buckets', to='mymath.exam'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='examscorebucket',
+            unique_together={('exam', 'first_attempt', 'score')},
+        ),
+    ]
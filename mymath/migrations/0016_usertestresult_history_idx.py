@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0015_examscorebucket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usertestresult',
+            index=models.Index(fields=['user', '-submitted', '-id'], name='mymath_result_history_idx'),
+        ),
+    ]
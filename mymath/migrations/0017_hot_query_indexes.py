@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0016_usertestresult_history_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userquestionselect',
+            index=models.Index(fields=['test_result', 'question', 'select', 'correct'], name='mymath_answer_cover_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertestresult',
+            index=models.Index(condition=models.Q(('answered_count', 0)), fields=['submitted'], name='mymath_result_empty_idx'),
+        ),
+    ]
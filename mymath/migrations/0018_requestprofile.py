@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0017_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('view_name', models.CharField(blank=True, max_length=100, verbose_name='URL名')),
+                ('mode', models.CharField(choices=[('cprofile', 'cProfile'), ('sample', 'サンプリング')], max_length=10, verbose_name='方法')),
+                ('status', models.PositiveSmallIntegerField(verbose_name='ステータス')),
+                ('duration_ms', models.FloatField(verbose_name='処理時間(ms)')),
+                ('query_count', models.PositiveIntegerField(verbose_name='クエリ数')),
+                ('query_ms', models.FloatField(verbose_name='DB時間(ms)')),
+                ('directory', models.CharField(max_length=255, verbose_name='保存先')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0018_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usertestresult',
+            name='archived_answered',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='usertestresult',
+            name='archived_correct',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='usertestresult',
+            name='archived_selects',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0019_archived_answers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExamVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='sha256')),
+                ('content', models.JSONField(verbose_name='内容')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='mymath.exam')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='exam',
+            name='published_version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='mymath.examversion', verbose_name='公開中の版'),
+        ),
+        migrations.AddField(
+            model_name='usertestresult',
+            name='exam_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='mymath.examversion', verbose_name='版'),
+        ),
+    ]
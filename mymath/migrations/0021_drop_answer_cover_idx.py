@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0020_exam_versions'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userquestionselect',
+            name='mymath_answer_cover_idx',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+def fill_question_count(apps, schema_editor):
+    # 既存の版の問題数を内容から数える
+    ExamVersion = apps.get_model("mymath", "ExamVersion")
+    versions = list(ExamVersion.objects.all())
+    for version in versions:
+        version.question_count = len(version.content["questions"])
+    ExamVersion.objects.bulk_update(versions, ["question_count"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mymath', '0021_drop_answer_cover_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='examversion',
+            name='question_count',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='問題数'),
+        ),
+        migrations.RunPython(fill_question_count, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,16 @@
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 
+from .answer_buffer import get_answer_buffer
+from .archive import ArchivedAnswer, pack, renumber, unpack, unpack_one
+from .versions import content_digest, exam_content
+
+
+POINTS_PER_QUESTION = 10 # 1問10点で計算する
+ATTEMPT_RETRIES = 5 # 受験回数の割り当てが重なったときにやり直す回数
 
 
 
@@ -23,15 +33,94 @@ class Category(models.Model):
         return f"{self.name}（{self.get_grade_display()}）"
 
 
+class ExamManager(models.Manager):
+    def reserve_question_numbers(self, exam_id, count=1):
+        """exam_idの問題番号をcount個まとめて確保し、rangeで返す
+
+        next_question_number を F() で増やしてから読み直す。
+        UPDATE で行(SQLiteではデータベース)がロックされるので、
+        同時に追加されても同じ番号が割り当てられることはない。
+        """
+        with transaction.atomic():
+            updated = self.filter(id=exam_id).update(
+                next_question_number=F("next_question_number") + count)
+            if not updated:
+                raise Exam.DoesNotExist(f"Exam id={exam_id} が存在しません。")
+            end = self.filter(id=exam_id).values_list("next_question_number", flat=True).get()
+        return range(end - count, end)
+
+
 class Exam(models.Model):
     title = models.CharField(verbose_name="テスト名",max_length=100)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     # 1テストを10個の問題に制限するのはviews.pyで行う
+    question_count = models.PositiveSmallIntegerField(
+        verbose_name="問題数",
+        default=0,
+        editable=False,
+        )
+    # 問題数はQuestionの保存・削除時にsignals.pyで更新する(COUNTを使わないため)
+    next_question_number = models.PositiveIntegerField(
+        verbose_name="次の問題番号",
+        default=1,
+        editable=False,
+        )
+    # 問題番号の採番用。ExamManager.reserve_question_numbers()で確保する
+    published_version = models.ForeignKey(
+        "ExamVersion",
+        verbose_name="公開中の版",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        )
+    # 公開していないときは None で、問題をそのまま出題する(versions.py)
+
+    # F() や update() で更新する列。save() では書き戻さない
+    MANAGED_FIELDS = ("question_count", "next_question_number", "published_version")
+
+    objects = ExamManager()
     
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # 管理サイトの変更や古いインスタンスの save() で、問題数や次の問題番号を
+        # 読み込んだときの値に戻さないよう、更新のときは MANAGED_FIELDS 以外だけを保存する
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MANAGED_FIELDS]
+        super().save(*args, **kwargs)
+
+class QuestionManager(models.Manager):
+    def bulk_create_numbered(self, questions, batch_size=None):
+        """問題番号を連番で割り当てて、まとめて作成する
+
+        examごとに番号をまとめて確保し、1つのトランザクションで bulk_create する。
+        bulk_create はシグナルを送らないので、問題数とキャッシュもここで更新する。
+        """
+        from .signals import invalidate_exam_content
+
+        questions = list(questions)
+        by_exam = {}
+        for question in questions:
+            by_exam.setdefault(question.exam_id, []).append(question)
+        with transaction.atomic():
+            for exam_id, exam_questions in by_exam.items():
+                numbers = Exam.objects.reserve_question_numbers(exam_id, len(exam_questions))
+                for number, question in zip(numbers, exam_questions):
+                    question.number = number
+            created = self.bulk_create(questions, batch_size=batch_size)
+            for exam_id, exam_questions in by_exam.items():
+                Exam.objects.filter(id=exam_id).update(
+                    question_count=F("question_count") + len(exam_questions))
+                invalidate_exam_content(exam_id)
+        return created
+
+
 class Question(models.Model):
     ANSWER_CHOICES = [(1, '1'), (2, '2'), (3, '3'), (4, '4')]
     
@@ -51,6 +140,9 @@ class Question(models.Model):
     #exam_image = models.ImageField(upload_to="questions/exam/", blank=True, null=True)
     #answer_image = models.ImageField(upload_to="questions/answer/", blank=True, null=True)
     #画像導入用
+
+    objects = QuestionManager()
+
     class Meta:
         ordering = ["number"]
         constraints = [models.UniqueConstraint(
@@ -60,15 +152,11 @@ class Question(models.Model):
     # データベースにユニーク制約を作成 ここでは"exam", "number"をユニークなセットにする
     def save(self, *args, **kwargs):
         # number を連番で取得する
+        # 同時に追加されても重ならないようにExamのカウンターから番号を確保する
         if self.pk is None:
-            last = Question.objects.filter(
-                exam=self.exam
-            ).order_by("-number").first()
-            if not last:
-                self.number =1
-            else:
-                self.number = last.number + 1
-            super().save(*args, **kwargs)
+            with transaction.atomic():
+                self.number = Exam.objects.reserve_question_numbers(self.exam_id)[0]
+                super().save(*args, **kwargs)
         else:
             super().save(*args, **kwargs)
     
@@ -77,19 +165,286 @@ class Question(models.Model):
         return f"問{self.number}: {self.text[:30]}"
 
 
+class ExamVersionManager(models.Manager):
+    def publish(self, exam):
+        """examの今の問題を ExamVersion に保存して公開する(versions.py)
+
+        同じ内容の版がすでにあるときは新しく作らずにそれを公開する。公開した版を返す。
+        """
+        from .signals import invalidate_exam_content
+
+        with transaction.atomic():
+            content = exam_content(exam, Question.objects.filter(exam=exam).order_by("number"))
+            version, _ = self.get_or_create(
+                digest=content_digest(content),
+                defaults={"exam": exam, "content": content, "question_count": len(content["questions"])})
+            # update() はシグナルを送らないので、キャッシュはここで無効にする
+            Exam.objects.filter(id=exam.id).update(published_version=version)
+            invalidate_exam_content(exam.id)
+        return version
+
+
+class ExamVersion(models.Model):
+    # 公開したときの試験内容。作ったあとは変更しない
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name="versions")
+    digest = models.CharField(verbose_name="sha256", max_length=64, unique=True)
+    content = models.JSONField(verbose_name="内容")
+    # 版の問題数。受験の終了判定で content を読まずに使う
+    question_count = models.PositiveSmallIntegerField(verbose_name="問題数", default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ExamVersionManager()
+
+    def __str__(self):
+        return f"{self.exam_id} {self.digest[:12]}"
+
+    def question_numbers(self):
+        """{question_id: 問題番号}"""
+        return {question["id"]: question["number"] for question in self.content["questions"]}
+
+
+def question_total():
+    """受験結果の問題数の式。版で受験したものは版の問題数、そうでなければ今の Exam の問題数"""
+    return Coalesce(F("exam_version__question_count"), F("exam__question_count"))
+
+
+class UserTestResultManager(models.Manager):
+    def start_attempt(self, user, exam, exam_version_id=None):
+        """userがexamを受験する新しいUserTestResultを作成する
+
+        exam_version_id には公開中の版を渡す。答え合わせと結果はその版の内容で表示する。
+
+        受験回数は AttemptCounter からロックを取って割り当てるので、
+        2つのタブやダブルクリックで同時に始めても回数が重ならない。
+        それでもユニーク制約に反したときは数回やり直す。
+        """
+        for retry in range(ATTEMPT_RETRIES):
+            try:
+                with transaction.atomic():
+                    count = AttemptCounter.objects.allocate(user, exam)
+                    return self.create(user=user, exam=exam, count=count, exam_version_id=exam_version_id)
+            except IntegrityError:
+                if retry == ATTEMPT_RETRIES - 1:
+                    raise
+
+    def resume_or_start(self, user, exam, first_question, current_id=None, exam_version_id=None):
+        """1問目の解答を送ったときの受験結果を返す
+
+        current_id(セッションの受験中の結果)が同じ版の終了していない受験で、
+        1問目(first_question)のほかにまだ解答していなければ、新しく始めずにそれを使う。
+        二重送信や戻るボタンで1問目を送りなおしても、受験回数が増えず、解答1つの受験結果が残らない。
+        """
+        if current_id is not None:
+            current = self.filter(
+                id=current_id, user=user, exam=exam, exam_version_id=exam_version_id,
+                finished__isnull=True).first()
+            if current is not None and not UserQuestionSelect.objects.filter(
+                    test_result=current).exclude(question_id=first_question.id).exists():
+                return current
+        return self.start_attempt(user, exam, exam_version_id)
+
+    def add_answers(self, test_result_id, answers, stats=True):
+        """新しく記録した解答(UserQuestionSelectのリスト)を正解数・解答数・点数に加算する
+
+        F()で加算するので、同時に解答が送られても数がずれない。
+        stats=False のときは問題ごとの集計に加算しない(呼び出し側でまとめて加算する)。
+        """
+        correct_num = sum(answer.correct for answer in answers)
+        self.filter(id=test_result_id).update(
+            answered_count=F("answered_count") + len(answers),
+            correct_count=F("correct_count") + correct_num,
+            score=F("score") + correct_num * POINTS_PER_QUESTION)
+        if stats:
+            QuestionStats.objects.add_answers(answers)
+        self.finish_if_complete(test_result_id)
+
+    def finish_if_complete(self, test_result_id):
+        """全問に解答していれば終了日時を記録し、得点分布に加える。終了したときは True"""
+        from .ranking import invalidate_leaderboard
+
+        finished = self.alias(question_total=question_total()).filter(
+            id=test_result_id,
+            finished__isnull=True,
+            answered_count__gte=F("question_total"),
+        ).update(finished=timezone.now())
+        if not finished: # 解答が残っている、または終了済み
+            return False
+        result = self.values("exam_id", "count", "score").get(id=test_result_id)
+        first_attempt = result["count"] == 1
+        ExamScoreBucket.objects.add(result["exam_id"], result["score"], first_attempt=first_attempt)
+        if first_attempt: # ランキングは1回目の受験だけ
+            invalidate_leaderboard(result["exam_id"], result["score"])
+        return True
+
+    def archive_answers(self, ids):
+        """ids の受験結果の解答を archived_* にまとめて、UserQuestionSelect の行を削除する(archive.py)
+
+        選択が1〜4でない解答があるものはそのままにする。アーカイブした件数を返す
+        """
+        from .signals import keep_answer_counters
+
+        with transaction.atomic():
+            attempts = list(self.filter(id__in=ids, archived_answered__isnull=True).only("id", "exam_version"))
+            # 版で受験したものは、あとで問題番号を振り直しても変わらないように版の問題番号でまとめる
+            versions = ExamVersion.objects.in_bulk({attempt.exam_version_id for attempt in attempts} - {None})
+            version_numbers = {
+                attempt.id: versions[attempt.exam_version_id].question_numbers()
+                for attempt in attempts if attempt.exam_version_id is not None}
+            answers = {}
+            for test_result_id, question_id, number, select, correct in UserQuestionSelect.objects.filter(
+                    test_result__in=attempts).values_list(
+                    "test_result_id", "question_id", "question__number", "select", "correct"):
+                if test_result_id in version_numbers:
+                    number = version_numbers[test_result_id].get(question_id, number)
+                answers.setdefault(test_result_id, {})[number] = (select, correct)
+            archived = []
+            for attempt in attempts:
+                try:
+                    packed = pack(answers.get(attempt.id, {}))
+                except ValueError:
+                    continue
+                attempt.archived_selects, attempt.archived_answered, attempt.archived_correct = packed
+                archived.append(attempt)
+            self.bulk_update(archived, ["archived_selects", "archived_answered", "archived_correct"])
+            # 解答は archived_* に移したので、削除しても解答数・正解数・点数から引かない(signals.py)
+            with keep_answer_counters():
+                UserQuestionSelect.objects.filter(test_result__in=archived).delete()
+        return len(archived)
+
+    def renumber_archived(self, exam_id, numbers):
+        """問題番号を振り直したときに、exam_id のアーカイブを {古い番号: 新しい番号} にあわせる
+
+        版で受験したものは版の問題番号でまとめてあるので変えない。
+        """
+        attempts = self.filter(
+            exam_id=exam_id, archived_answered__isnull=False, exam_version__isnull=True).only(
+            "id", "archived_selects", "archived_answered", "archived_correct")
+        changed = []
+        for attempt in attempts.iterator(chunk_size=1000):
+            attempt.archived_selects, attempt.archived_answered, attempt.archived_correct = renumber(
+                *attempt.archived, numbers)
+            changed.append(attempt)
+        self.bulk_update(changed, ["archived_selects", "archived_answered", "archived_correct"],
+                         batch_size=1000)
+        return len(changed)
+
 
 class UserTestResult(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     exam = models.ForeignKey(Exam, on_delete=models.CASCADE)
     count = models.IntegerField(verbose_name="回数", default=0)
     score = models.IntegerField(verbose_name="点数", default=0)
+    correct_count = models.PositiveSmallIntegerField(verbose_name="正解数", default=0)
+    answered_count = models.PositiveSmallIntegerField(verbose_name="解答数", default=0)
+    # 点数・正解数・解答数は解答を記録するときに加算する(result()では計算しない)
     submitted = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(verbose_name="終了日時", null=True, blank=True)
+    # 全問に解答したときに記録する
+    exam_version = models.ForeignKey(
+        ExamVersion, verbose_name="版", on_delete=models.SET_NULL, null=True, blank=True)
+    # 受験を始めたときに公開されていた版。公開していなかったときは None
+    # archive_attempts でまとめた解答(archive.py)。まとめていないときは None
+    archived_selects = models.BinaryField(null=True)
+    archived_answered = models.BinaryField(null=True)
+    archived_correct = models.BinaryField(null=True)
+
+    objects = UserTestResultManager()
+
     def __str__(self):
         return f"{self.user.username} - {self.exam.title} ({self.count}回目)"
+
+    @property
+    def is_archived(self):
+        return self.archived_answered is not None
+
+    @property
+    def archived(self):
+        """(selects, answered, correct) のバイト列"""
+        return bytes(self.archived_selects), bytes(self.archived_answered), bytes(self.archived_correct)
+
+    def archived_answer(self, question):
+        """アーカイブした question への解答。解答していないときは None"""
+        value = unpack_one(*self.archived, question.number)
+        return ArchivedAnswer(question, *value) if value else None
+
+    def archived_answers(self, questions):
+        """アーカイブした解答を questions の順に返す(解答していない問題は含めない)"""
+        answers = unpack(*self.archived)
+        return [ArchivedAnswer(question, *answers[question.number])
+                for question in questions if question.number in answers]
+
+    def record_answer(self, question, select):
+        """questionへの解答を記録する。初めての解答のときだけ点数などを加算する
+
+        版で受験しているときに、版の問題がすでに削除されていれば Question.DoesNotExist
+        """
+        if self.is_archived: # アーカイブした受験には記録しない
+            return self.archived_answer(question), False
+        if self.exam_version_id and not Question.objects.filter(id=question.id).exists():
+            # 版の問題は削除されても出題されるが、解答は行がないと記録できない
+            raise Question.DoesNotExist(f"問題 id={question.id} は削除されています。")
+        buffer = get_answer_buffer()
+        if buffer is not None: # 後からまとめて保存する(answer_buffer.py)
+            return buffer.record(self, question, select)
+        with transaction.atomic():
+            # get_or_create() で２重回答を防ぐ
+            answer, created = UserQuestionSelect.objects.get_or_create(
+                test_result=self,
+                question=question,
+                defaults={"select": select, "correct": select == question.answer})
+            if created:
+                UserTestResult.objects.add_answers(self.id, [answer])
+        return answer, created
     
     class Meta:
         ordering = ('-count', '-submitted')
         unique_together = ('user', 'exam', 'count')
+        indexes = [
+            # userがexamを最後に受験した結果を探すためのインデックス
+            models.Index(fields=["user", "exam", "-count"], name="mymath_result_latest_idx"),
+            # ランキング用のインデックス
+            models.Index(fields=["exam", "count", "-score", "finished"], name="mymath_result_ranking_idx"),
+            # マイページの受験履歴(submitted, idの降順)用のインデックス
+            models.Index(fields=["user", "-submitted", "-id"], name="mymath_result_history_idx"),
+            # 解答のない受験結果だけの部分インデックス(compact_attemptsで使う)
+            models.Index(fields=["submitted"], condition=models.Q(answered_count=0),
+                         name="mymath_result_empty_idx"),
+        ]
+
+
+class AttemptCounterManager(models.Manager):
+    def allocate(self, user, exam):
+        """(user, exam)の次の受験回数を割り当てて返す。トランザクションの中で呼び出す"""
+        counters = self.filter(user=user, exam=exam)
+        if connection.features.has_select_for_update:
+            # PostgreSQLでは行ロック(SELECT ... FOR UPDATE)を取ってから増やす
+            counter = counters.select_for_update().first()
+            if counter is not None:
+                counter.last_count += 1
+                counter.save(update_fields=["last_count"])
+                return counter.last_count
+        elif counters.update(last_count=F("last_count") + 1):
+            # SQLiteでは最初にUPDATEを実行して書き込みロックを取る(BEGIN IMMEDIATEと同じ)。
+            # 行がないときも書き込みロックは取られるので、以下の作成も他と重ならない
+            return counters.values_list("last_count", flat=True).get()
+        # 初めての受験。カウンター導入前の受験結果があればその続きから始める
+        last = UserTestResult.objects.filter(user=user, exam=exam).aggregate(
+            Max("count"))["count__max"] or 0
+        # 同時に作成されたときはIntegrityErrorになり、start_attempt()でやり直す
+        self.create(user=user, exam=exam, last_count=last + 1)
+        return last + 1
+
+
+class AttemptCounter(models.Model):
+    # (user, exam)ごとの受験回数のカウンター
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE)
+    last_count = models.IntegerField(verbose_name="最後の回数", default=0)
+
+    objects = AttemptCounterManager()
+
+    class Meta:
+        unique_together = ('user', 'exam')
     
 class UserQuestionSelect(models.Model):
     test_result = models.ForeignKey(UserTestResult, on_delete=models.CASCADE)
@@ -98,4 +453,117 @@ class UserQuestionSelect(models.Model):
     correct = models.BooleanField(verbose_name="")
 
     class Meta:
-        unique_together = ('test_result', 'question')
\ No newline at end of file
+        # 受験結果の解答一覧は unique_together のインデックスで引く。
+        # 一番大きいテーブルなので、先頭の列が同じインデックスは足さない
+        unique_together = ('test_result', 'question')
+
+
+class QuestionStatsManager(models.Manager):
+    def add_answers(self, answers):
+        """解答(UserQuestionSelectのリスト)を問題ごとの集計に加算する"""
+        deltas = {}
+        for answer in answers:
+            delta = deltas.setdefault(answer.question_id, {
+                "answered": 0, "correct": 0,
+                "select_1_count": 0, "select_2_count": 0, "select_3_count": 0, "select_4_count": 0})
+            delta["answered"] += 1
+            delta["correct"] += int(answer.correct)
+            delta[f"select_{answer.select}_count"] += 1
+        for question_id, delta in deltas.items():
+            self._add(question_id, delta)
+
+    def _add(self, question_id, delta):
+        updates = {name: F(name) + value for name, value in delta.items() if value}
+        if self.filter(question_id=question_id).update(**updates):
+            return
+        # 初めての解答のときは行を作成する。同時に作成されたときは加算しなおす
+        try:
+            with transaction.atomic():
+                self.create(question_id=question_id, **delta)
+        except IntegrityError:
+            self.filter(question_id=question_id).update(**updates)
+
+
+class QuestionStats(models.Model):
+    # 問題ごとの正答率と選択肢ごとの選択数。解答を記録するたびに加算する
+    # rebuild_question_stats コマンドで作りなおせる
+    question = models.OneToOneField(
+        Question, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    answered = models.PositiveIntegerField(verbose_name="解答数", default=0)
+    correct = models.PositiveIntegerField(verbose_name="正解数", default=0)
+    select_1_count = models.PositiveIntegerField(verbose_name="選択肢1", default=0)
+    select_2_count = models.PositiveIntegerField(verbose_name="選択肢2", default=0)
+    select_3_count = models.PositiveIntegerField(verbose_name="選択肢3", default=0)
+    select_4_count = models.PositiveIntegerField(verbose_name="選択肢4", default=0)
+
+    objects = QuestionStatsManager()
+
+    def __str__(self):
+        return f"{self.question} ({self.correct_rate}%)"
+
+    @property
+    def correct_rate(self):
+        """正答率(%)。解答がないときは None"""
+        if not self.answered:
+            return None
+        return round(self.correct * 100 / self.answered)
+
+    def select_rates(self):
+        """選択肢1〜4が選ばれた割合(%)のリスト"""
+        counts = [self.select_1_count, self.select_2_count, self.select_3_count, self.select_4_count]
+        if not self.answered:
+            return [0, 0, 0, 0]
+        return [round(count * 100 / self.answered) for count in counts]
+
+
+class ExamScoreBucketManager(models.Manager):
+    def add(self, exam_id, score, first_attempt, takers=1):
+        """exam_idの得点分布のscoreの人数を増やす"""
+        buckets = self.filter(exam_id=exam_id, first_attempt=first_attempt, score=score)
+        if buckets.update(takers=F("takers") + takers):
+            return
+        try:
+            with transaction.atomic():
+                self.create(exam_id=exam_id, first_attempt=first_attempt, score=score, takers=takers)
+        except IntegrityError: # 同時に作成されたとき
+            buckets.update(takers=F("takers") + takers)
+
+
+class ExamScoreBucket(models.Model):
+    # テストごとの得点分布。点数は10点刻みなので、点数ごとに人数を数える
+    # 1回目の受験(first_attempt=True)とそれ以外は分けて数える
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name="score_buckets")
+    first_attempt = models.BooleanField(verbose_name="1回目の受験")
+    score = models.IntegerField(verbose_name="点数")
+    takers = models.PositiveIntegerField(verbose_name="人数", default=0)
+
+    objects = ExamScoreBucketManager()
+
+    class Meta:
+        unique_together = ('exam', 'first_attempt', 'score')
+
+    def __str__(self):
+        return f"{self.exam_id} {self.score}点: {self.takers}人"
+
+
+class RequestProfile(models.Model):
+    # スタッフが取ったリクエストのプロファイル。ファイルは directory に保存する(profiling.py)
+    MODE_CHOICES = [
+        ("cprofile", "cProfile"),
+        ("sample", "サンプリング"),
+    ]
+
+    created = models.DateTimeField(verbose_name="作成日時", auto_now_add=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    view_name = models.CharField(verbose_name="URL名", max_length=100, blank=True)
+    mode = models.CharField(verbose_name="方法", max_length=10, choices=MODE_CHOICES)
+    status = models.PositiveSmallIntegerField(verbose_name="ステータス")
+    duration_ms = models.FloatField(verbose_name="処理時間(ms)")
+    query_count = models.PositiveIntegerField(verbose_name="クエリ数")
+    query_ms = models.FloatField(verbose_name="DB時間(ms)")
+    directory = models.CharField(verbose_name="保存先", max_length=255)
+
+    def __str__(self):
+        return f"{self.method} {self.path} {self.duration_ms:.0f}ms"
@@ -0,0 +1,184 @@
+"""スタッフ用のリクエスト単位のプロファイラー
+
+スタッフがヘッダー X-Mymath-Profile またはクエリパラメーター _profile をつけてアクセスすると、
+そのリクエストだけプロファイルを取って settings.MYMATH_PROFILE_DIR に保存する。
+
+    /exam/1/1/?_profile=1       cProfile(profile.prof。pstats や snakeviz で開く)
+    /exam/1/1/?_profile=sample  1ミリ秒ごとのサンプリング
+
+どちらのときも以下を保存し、管理サイトの RequestProfile に一覧を残す。
+
+- stacks.folded  "関数;関数;... 件数" の形のスタック(flamegraph.pl や speedscope で開ける)
+  cProfile のときは呼び出し元と呼び出し先の組から作るので、実際より短いスタックになる
+- sql.json       リクエスト開始からの時刻つきのSQLの一覧
+
+保存するのは新しいものから settings.MYMATH_PROFILE_KEEP 件で、古いものは削除する。
+"""
+import cProfile
+import json
+import pstats
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import RequestProfile
+
+
+HEADER = "HTTP_X_MYMATH_PROFILE"
+QUERY_PARAM = "_profile"
+SAMPLE_INTERVAL = 0.001 # 秒
+
+
+def requested_mode(request):
+    """指定されているときは "cprofile" か "sample"、ないときは None
+
+    ほとんどのリクエストは最初の判定だけで None を返す。スタッフかどうかは呼び出し側で確かめる。
+    """
+    value = request.META.get(HEADER)
+    if value is None:
+        if QUERY_PARAM not in request.META.get("QUERY_STRING", ""):
+            return None
+        value = request.GET.get(QUERY_PARAM)
+        if value is None:
+            return None
+    return "sample" if value == "sample" else "cprofile"
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """別スレッドから一定間隔で対象スレッドのスタックを読み取って数える"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def folded_from_stats(stats):
+    """cProfile の結果から "呼び出し元;関数 自分の時間(マイクロ秒)" の行を作る"""
+    stacks = Counter()
+    for (filename, line, name), (_, _, tottime, _, callers) in stats.stats.items():
+        func = f"{Path(filename).stem}:{name}"
+        if not callers:
+            stacks[func] += tottime
+            continue
+        # 自分の時間を呼び出し元ごとの呼び出し回数で分ける
+        calls = sum(caller[0] for caller in callers.values()) or 1
+        for (caller_file, _, caller_name), caller in callers.items():
+            stacks[f"{Path(caller_file).stem}:{caller_name};{func}"] += tottime * caller[0] / calls
+    return Counter({stack: round(seconds * 1_000_000) for stack, seconds in stacks.items()
+                    if seconds * 1_000_000 >= 1})
+
+
+class SQLTimeline:
+    """observe_queries() に渡して、SQLを開始時刻つきで記録する(querylog.py)"""
+
+    def __init__(self, started):
+        self.started = started
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                "start_ms": round((started - self.started) * 1000, 3),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "alias": context["connection"].alias,
+                "many": many,
+                "sql": sql,
+            })
+
+
+class Profile:
+    """1リクエスト分のプロファイル。start() と stop() で囲んで save() する"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.sql = SQLTimeline(time.perf_counter())
+        self.profiler = cProfile.Profile() if mode == "cprofile" else None
+        self.sampler = StackSampler(threading.get_ident()) if mode == "sample" else None
+
+    def start(self):
+        self.started = self.sql.started = time.perf_counter()
+        if self.profiler:
+            self.profiler.enable()
+        else:
+            self.sampler.start()
+
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+        else:
+            self.sampler.stop()
+        self.duration = time.perf_counter() - self.started
+
+    def save(self, request, response):
+        """ファイルに書き出して RequestProfile を作る"""
+        base = Path(settings.MYMATH_PROFILE_DIR)
+        directory = base / f"{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        directory.mkdir(parents=True)
+        if self.profiler:
+            self.profiler.dump_stats(directory / "profile.prof")
+            stacks = folded_from_stats(pstats.Stats(self.profiler))
+        else:
+            stacks = self.sampler.stacks
+        (directory / "stacks.folded").write_text(
+            "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()))
+        (directory / "sql.json").write_text(
+            json.dumps(self.sql.queries, ensure_ascii=False, indent=1))
+
+        match = request.resolver_match
+        profile = RequestProfile.objects.create(
+            user=request.user if request.user.is_authenticated else None, # ログアウトしたとき
+            method=request.method,
+            path=request.get_full_path()[:255],
+            view_name=(match.view_name if match else "")[:100],
+            mode=self.mode,
+            status=response.status_code,
+            duration_ms=self.duration * 1000,
+            query_count=len(self.sql.queries),
+            query_ms=sum(query["duration_ms"] for query in self.sql.queries),
+            directory=str(directory),
+        )
+        rotate()
+        return profile
+
+
+def rotate():
+    """新しいものから MYMATH_PROFILE_KEEP 件を残して、古いプロファイルを削除する"""
+    old = list(RequestProfile.objects.order_by("-created", "-id")[settings.MYMATH_PROFILE_KEEP:])
+    for profile in old:
+        shutil.rmtree(profile.directory, ignore_errors=True)
+        profile.delete()
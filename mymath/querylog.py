@@ -0,0 +1,48 @@
+"""リクエストごとのSQLの計測(MetricsMiddleware と ProfilerMiddleware で使う)
+
+connection.execute_wrapper() は呼び出したスレッドの接続にしか付かない。
+非同期ビューでは ORM が sync_to_async のスレッドで別の接続を使うので、
+リクエストのスレッドで付けてもそのクエリは数えられない。
+
+そこで接続を開いたとき(connection_created シグナル、apps.py で登録)に
+すべての接続へ observe_query を1つだけ付けておき、observe_query は ContextVar から
+今のリクエストの計測先を読む。ContextVar は sync_to_async のスレッドにも引き継がれる。
+計測先は execute_wrapper と同じ形の呼び出し可能オブジェクト。
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+
+_observers = ContextVar("mymath_query_observers", default=())
+
+
+def observe_query(execute, sql, params, many, context):
+    """今のリクエストの計測先を execute_wrapper と同じ順に通して実行する"""
+    for observer in reversed(_observers.get()):
+        execute = functools.partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def install(connection, **kwargs):
+    """connection_created の受け手。接続に observe_query を1つだけ付ける
+
+    execute_wrapper() は最後に足したものを取り除くので、先頭に入れて入れ違わないようにする。
+    """
+    if observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, observe_query)
+
+
+@contextmanager
+def observe_queries(observer):
+    """この中(sync_to_async のスレッドも含む)で実行したクエリを observer に通す"""
+    # シグナルを登録する前に開いた接続にも付けておく
+    for conn in connections.all(initialized_only=True):
+        install(conn)
+    token = _observers.set((*_observers.get(), observer))
+    try:
+        yield
+    finally:
+        _observers.reset(token)
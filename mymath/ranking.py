@@ -0,0 +1,65 @@
+"""得点分布(ExamScoreBucket)を使った順位とランキング
+
+順位と上位何%かは、受験結果を全件数えずに得点分布の点数ごとの人数から計算する。
+点数は10点刻みなので、1テストあたり最大で11行しか読まない。
+ランキング(上位K件)はキャッシュし、上位に入る点数で受験が終わったときだけ作りなおす。
+キャッシュを消すのは受験を終えたプロセスなので、複数プロセスでは共有できるキャッシュを使う(checks.py)。
+消しそこねたときのために、キャッシュには期限もつけておく。
+"""
+import math
+
+from django.core.cache import cache
+
+from .models import ExamScoreBucket, UserTestResult
+
+
+LEADERBOARD_SIZE = 10
+LEADERBOARD_KEY = "mymath:leaderboard:{exam_id}"
+LEADERBOARD_TIMEOUT = 300 # 秒。無効にしそこねても、この時間がたてば作りなおす
+
+
+def get_ranking(exam_id, score, first_attempt):
+    """scoreの順位を返す
+
+    first_attempt が True のときは1回目の受験だけ、False のときは全受験の中での順位。
+    {"rank": 順位, "takers": 人数, "top_percent": 上位何%か} を返す。受験者がいないときは None
+    """
+    buckets = ExamScoreBucket.objects.filter(exam_id=exam_id)
+    if first_attempt:
+        buckets = buckets.filter(first_attempt=True)
+    takers = above = 0
+    for bucket_score, bucket_takers in buckets.values_list("score", "takers"):
+        takers += bucket_takers
+        if bucket_score > score:
+            above += bucket_takers
+    if not takers:
+        return None
+    rank = above + 1
+    return {
+        "rank": rank,
+        "takers": takers,
+        "top_percent": max(1, math.ceil(min(rank, takers) * 100 / takers)),
+    }
+
+
+def get_leaderboard(exam_id):
+    """exam_idの1回目の受験の上位LEADERBOARD_SIZE件を返す"""
+    key = LEADERBOARD_KEY.format(exam_id=exam_id)
+    entries = cache.get(key)
+    if entries is None:
+        results = UserTestResult.objects.filter(
+            exam_id=exam_id, count=1, finished__isnull=False,
+        ).order_by("-score", "finished").values_list("user__username", "score")[:LEADERBOARD_SIZE]
+        entries = [{"username": username, "score": score} for username, score in results]
+        cache.set(key, entries, LEADERBOARD_TIMEOUT)
+    return entries
+
+
+def invalidate_leaderboard(exam_id, score=None):
+    """scoreで受験が終わったときに、ランキングが変わるならキャッシュを消す"""
+    key = LEADERBOARD_KEY.format(exam_id=exam_id)
+    entries = cache.get(key)
+    if entries is None:
+        return
+    if score is None or len(entries) < LEADERBOARD_SIZE or score > entries[-1]["score"]:
+        cache.delete(key)
@@ -0,0 +1,80 @@
+"""プライマリーと読み込み専用のレプリカの振り分け
+
+settings で DB_REPLICA_HOST か DB_REPLICA_NAME を指定したときに DATABASE_ROUTERS に入る。
+
+- 書き込みはすべてプライマリー(default)
+- 読み込みは基本的にレプリカ(replica)。トップページ、受験中の問題や正答率、マイページ、管理サイトの一覧など
+- 次のときは読み込みもプライマリーに送る
+    - use_primary() の中(キャッシュを作り直すときなど)
+    - 同じリクエストの中ですでに書き込んだあと
+    - プライマリーでトランザクションの途中のとき
+    - セッション(書き込んだ直後に読むので常にプライマリー)
+
+書き込んだ直後の別のリクエスト(解答 → 答え合わせ → 結果)もプライマリーから読めるように、
+middleware.ReplicaStickinessMiddleware が書き込みのあと短い時間だけ Cookie でプライマリーに固定する。
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+
+_primary = ContextVar("mymath_use_primary", default=False)
+_wrote = ContextVar("mymath_wrote", default=False)
+
+
+@contextmanager
+def use_primary():
+    """この中の読み込みをプライマリーに送る"""
+    token = _primary.set(True)
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+@contextmanager
+def request_scope(primary=False):
+    """1リクエスト分の振り分けの状態を作る(ミドルウェアで使う)
+
+    WSGIでは同じスレッドで次のリクエストを処理するので、終わったら前の状態に戻す。
+    """
+    tokens = _primary.set(primary), _wrote.set(False)
+    try:
+        yield
+    finally:
+        _primary.reset(tokens[0])
+        _wrote.reset(tokens[1])
+
+
+def wrote():
+    """このリクエストでセッション以外に書き込んだか"""
+    return _wrote.get()
+
+
+def _is_session(model):
+    return model._meta.app_label == "sessions"
+
+
+class PrimaryReplicaRouter:
+    primary = "default"
+    replica = "replica"
+
+    def db_for_read(self, model, **hints):
+        if (_primary.get() or _wrote.get() or _is_session(model)
+                or connections[self.primary].in_atomic_block):
+            return self.primary
+        return self.replica
+
+    def db_for_write(self, model, **hints):
+        # 書き込んだあとは、同じリクエストの読み込みもプライマリーに送る
+        if not _is_session(model):
+            _wrote.set(True)
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリーの複製なので、どちらから読んだオブジェクトでも関連づけてよい
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == self.primary
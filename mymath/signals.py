@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_exam_version, bump_index_version
+from .models import (
+    POINTS_PER_QUESTION, Category, Exam, ExamVersion, Question, UserQuestionSelect, UserTestResult,
+)
+from .ranking import invalidate_leaderboard
+
+
+def invalidate_exam_content(exam_id):
+    """exam_idの問題セットとトップページのキャッシュを無効にする"""
+    # すぐにバージョンを進め、コミット後にもう一度進める。
+    # コミット前に別のリクエストが古い内容でスナップショットを作っても、
+    # コミット後の更新で無効になる。
+    bump_exam_version(exam_id)
+    transaction.on_commit(lambda: bump_exam_version(exam_id), robust=True)
+    invalidate_index()
+
+
+def invalidate_index():
+    """トップページのキャッシュを無効にする"""
+    bump_index_version()
+    transaction.on_commit(bump_index_version, robust=True)
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, created, **kwargs):
+    if created:
+        Exam.objects.filter(id=instance.exam_id).update(
+            question_count=F("question_count") + 1)
+    invalidate_exam_content(instance.exam_id)
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    # Examごと削除されたときは該当する行がないので何も更新されない
+    Exam.objects.filter(id=instance.exam_id, question_count__gt=0).update(
+        question_count=F("question_count") - 1)
+    # 削除した問題は解答を記録できないので、公開中の版に含まれていれば公開をやめる
+    version = ExamVersion.objects.filter(
+        exam_id=instance.exam_id, exam__published_version=F("id")).first()
+    if version is not None and instance.id in version.question_numbers():
+        Exam.objects.filter(id=instance.exam_id).update(published_version=None)
+    invalidate_exam_content(instance.exam_id)
+
+
+_keep_answer_counters = ContextVar("mymath_keep_answer_counters", default=False)
+
+
+@contextmanager
+def keep_answer_counters():
+    """この中で削除した解答は、受験結果の解答数・正解数・点数から引かない
+
+    archive_answers() で解答を archived_* に移したあとに行を削除するときに使う。
+    """
+    token = _keep_answer_counters.set(True)
+    try:
+        yield
+    finally:
+        _keep_answer_counters.reset(token)
+
+
+@receiver(post_delete, sender=UserQuestionSelect)
+def answer_deleted(sender, instance, origin=None, **kwargs):
+    """解答を削除したときに、受験結果の解答数・正解数・点数から F() で引く
+
+    解答そのものか問題を削除したときだけ引く。テストやユーザーや受験結果の削除では
+    受験結果も一緒に削除されるので何もしない。
+    問題ごとの集計と得点分布は変えないので、rebuild_question_stats と rebuild_score_histogram で作りなおす。
+    """
+    if _keep_answer_counters.get():
+        return
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model not in (UserQuestionSelect, Question):
+        return
+    correct = int(instance.correct)
+    UserTestResult.objects.filter(id=instance.test_result_id).update(
+        answered_count=F("answered_count") - 1,
+        correct_count=F("correct_count") - correct,
+        score=F("score") - correct * POINTS_PER_QUESTION)
+
+
+@receiver([post_save, post_delete], sender=Exam)
+def invalidate_exam(sender, instance, **kwargs):
+    invalidate_exam_content(instance.id)
+    invalidate_leaderboard(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    invalidate_index()
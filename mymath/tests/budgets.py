@@ -0,0 +1,88 @@
+"""URL名とリクエストの段階ごとのSQLクエリ数と処理時間の上限(予算)
+
+テンプレートの変更などでクエリが増えたとき(N+1 など)にテストで気づけるようにする。
+上限を超えたときは、実行されたクエリを同じ形ごとにまとめて回数つきで表示する。
+
+    class TestXxx(QueryBudgetMixin, TestCase):
+        def test_xxx(self):
+            with self.assertWithinBudget("mymath:result", "GET", logged_in=True):
+                self.client.get(...)
+
+処理時間は環境で大きく変わるので、既定では確かめない。
+環境変数 MYMATH_BUDGET_TIME_FACTOR に倍率を指定したとき(CIなどで 1 や 3)だけ、
+大きめにとった上限にその倍率をかけて確かめる。
+"""
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+@dataclass(frozen=True)
+class Budget:
+    anonymous: int  # 未ログインのときの最大クエリ数
+    logged_in: int  # ログインしているときの最大クエリ数
+    ms: int = 500   # 1リクエストの最大処理時間(ミリ秒)。MYMATH_BUDGET_TIME_FACTOR を指定したときだけ使う
+
+
+# (URL名, 段階) ごとの予算。段階は "GET" と "POST" で、exam の POST は
+# 受験結果と回数カウンターを作る1問目("first POST")と、採点を仕上げる最後の問題("last POST")を分ける。
+# SAVEPOINT なども1クエリとして数える。ログインしているときはセッションとユーザーの読み込みの2クエリが加わる。
+# exam の GET はキャッシュが空のときにスナップショットを作る2クエリを含む。
+# accounts の POST はログインしていないときだけ使うので、logged_in は anonymous と同じにしておく
+BUDGETS = {
+    ("mymath:index", "GET"): Budget(anonymous=1, logged_in=3),
+    ("mymath:exam", "GET"): Budget(anonymous=2, logged_in=4),
+    ("mymath:exam", "first POST"): Budget(anonymous=4, logged_in=23),
+    ("mymath:exam", "POST"): Budget(anonymous=4, logged_in=15),
+    ("mymath:exam", "last POST"): Budget(anonymous=4, logged_in=20),
+    ("mymath:answer", "GET"): Budget(anonymous=2, logged_in=5),
+    ("mymath:answer", "POST"): Budget(anonymous=1, logged_in=4),
+    ("mymath:result", "GET"): Budget(anonymous=3, logged_in=6),
+    ("accounts:login", "GET"): Budget(anonymous=0, logged_in=2),
+    ("accounts:login", "POST"): Budget(anonymous=9, logged_in=9, ms=2000), # パスワードのハッシュ計算があるので長め
+    ("accounts:signup", "GET"): Budget(anonymous=0, logged_in=2),
+    ("accounts:signup", "POST"): Budget(anonymous=3, logged_in=3, ms=2000),
+}
+
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def normalize_sql(sql):
+    """値を ? に置き換えて、同じ形のクエリをまとめられるようにする"""
+    return _literals.sub("?", sql)
+
+
+def format_queries(queries):
+    """クエリを形ごとにまとめて、多い順に "回数 x SQL" の行にする"""
+    counts = Counter(normalize_sql(query["sql"]) for query in queries)
+    return "\n".join(f"  {count:>3} x {sql}" for sql, count in counts.most_common())
+
+
+class QueryBudgetMixin:
+    time_factor = float(os.environ.get("MYMATH_BUDGET_TIME_FACTOR") or 0) # 0 のときは処理時間を確かめない
+
+    @contextmanager
+    def assertWithinBudget(self, url_name, step, *, logged_in):
+        budget = BUDGETS[url_name, step]
+        max_queries = budget.logged_in if logged_in else budget.anonymous
+        who = "ログイン" if logged_in else "未ログイン"
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        queries = context.captured_queries
+        if len(queries) > max_queries:
+            self.fail(
+                f"{url_name} {step}({who})のクエリ数が予算を超えました: "
+                f"{len(queries)} > {max_queries}\n{format_queries(queries)}")
+        if self.time_factor and elapsed_ms > budget.ms * self.time_factor:
+            self.fail(
+                f"{url_name} {step}({who})の処理時間が予算を超えました: "
+                f"{elapsed_ms:.0f}ms > {budget.ms * self.time_factor:.0f}ms")
@@ -0,0 +1,65 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from mymath.anonymous import COOKIE_NAME, new_state, pack_state, unpack_state
+from mymath.models import Category, Exam, Question
+
+
+class TestPackState(TestCase):
+    def test_round_trip(self):
+        state = new_state(3)
+        state["question_select"] = {"1": 2, "2": 1, "4": 4}
+        state["answer_correct"] = {"1": False, "2": True, "4": True}
+        self.assertEqual(pack_state(state), "3:1b2A4D")
+        self.assertEqual(unpack_state("3:1b2A4D"), state)
+
+    def test_size_depends_on_answers(self):
+        # 問題番号が大きくても、解答した問題の分だけの長さになる
+        state = new_state(3)
+        state["question_select"] = {"1000": 3}
+        state["answer_correct"] = {"1000": True}
+        self.assertEqual(pack_state(state), "3:1000C")
+        self.assertEqual(unpack_state("3:1000C"), state)
+
+    def test_broken_value(self):
+        self.assertIsNone(unpack_state("3:1e"))
+        self.assertIsNone(unpack_state("broken"))
+        self.assertIsNone(unpack_state("3:2104:a"))
+
+
+@override_settings(MYMATH_ANONYMOUS_STATE="cookie")
+class TestCookieState(TestCase):
+    """Cookieに受験状況を保存したときもセッションと同じ結果になることのテスト"""
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        for i in range(10):
+            Question.objects.create(
+                exam=self.exam, text="text",
+                select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+                answer=1)
+
+    def test_complete_exam_without_session_writes(self):
+        for number in range(1, 11):
+            data = {f"question_{number}": 2 if number in (5, 6) else 1}
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": number}),
+                                 data=data)
+            self.assertFalse([q for q in queries if "django_session" in q["sql"]])
+            response = self.client.get(reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": number}))
+            self.assertContains(response, "不正解" if number in (5, 6) else "正解")
+            self.client.post(reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": number}))
+        self.assertIn(COOKIE_NAME, self.client.cookies)
+        self.assertNotIn("exam", self.client.session)
+        response = self.client.get(reverse("mymath:result", kwargs={"exam_id": self.exam.id}))
+        self.assertContains(response, "80点")
+        self.assertFalse(response.context["useranswers"][4]["correct"])
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1}),
+                         data={"question_1": 1})
+        self.client.cookies[COOKIE_NAME] = f"{self.exam.id}:1:1"
+        response = self.client.get(reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": 1}))
+        self.assertRedirects(response, reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1}))
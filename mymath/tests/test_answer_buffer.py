@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from mymath.answer_buffer import get_answer_buffer
+from mymath.cache import clear_exam_cache
+from mymath.models import Category, Exam, Question, QuestionStats, UserQuestionSelect, UserTestResult
+
+
+class AnswerBufferMixin:
+    def make_exam(self):
+        cache.clear()
+        clear_exam_cache()
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.questions = [
+            Question.objects.create(exam=self.exam, text=f"問題{i + 1}", select_1="1", select_2="2",
+                                    select_3="3", select_4="4", answer=1)
+            for i in range(3)]
+        self.user = User.objects.create_user(username="testuser", password="pass")
+        self.client.login(username="testuser", password="pass")
+
+    def post(self, number, select):
+        return self.client.post(reverse("mymath:exam", args=[self.exam.id, number]),
+                                {f"question_{number}": select})
+
+
+@override_settings(MYMATH_ANSWER_BUFFER="local", MYMATH_ANSWER_BUFFER_INTERVAL=0,
+                   MYMATH_ANSWER_BUFFER_SIZE=100)
+class TestAnswerBuffer(AnswerBufferMixin, TestCase):
+    def setUp(self):
+        self.make_exam()
+        self.buffer = get_answer_buffer()
+        self.addCleanup(self.buffer.flush)
+
+    def test_post_is_buffered_and_read_back(self):
+        self.post(1, 3)
+        result = UserTestResult.objects.get()
+        self.assertFalse(UserQuestionSelect.objects.exists())
+        self.assertEqual(result.answered_count, 0)
+        # 保存される前でも答え合わせに自分の解答が出る
+        response = self.client.get(reverse("mymath:answer", args=[self.exam.id, 1]))
+        self.assertEqual(response.context["useranswer"].select, 3)
+        self.assertFalse(response.context["useranswer"].correct)
+
+    def test_result_flushes(self):
+        for number, select in enumerate([1, 2, 1], start=1):
+            self.post(number, select)
+        # ほかの受験者の解答は結果のページでは保存しない
+        other = User.objects.create_user(username="other")
+        UserTestResult.objects.start_attempt(other, self.exam).record_answer(self.questions[0], 1)
+        self.assertEqual(len(self.buffer), 4)
+        response = self.client.get(reverse("mymath:result", args=[self.exam.id]))
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(response.context["user_result"].score, 20)
+        self.assertIsNotNone(response.context["ranking"])
+        self.assertEqual(UserQuestionSelect.objects.count(), 3)
+        self.assertEqual(QuestionStats.objects.get(question=self.questions[1]).select_2_count, 1)
+
+    def test_first_answer_wins(self):
+        self.post(1, 1)
+        self.post(2, 2)
+        self.post(2, 1)
+        self.buffer.flush()
+        # 保存したあとに送りなおしても、最初の解答のまま
+        self.post(2, 1)
+        self.buffer.flush()
+        answer = UserQuestionSelect.objects.get(question=self.questions[1])
+        self.assertEqual(answer.select, 2)
+        self.assertEqual(UserTestResult.objects.get().answered_count, 2)
+
+    @override_settings(MYMATH_ANSWER_BUFFER_SIZE=2)
+    def test_flush_at_size(self):
+        buffer = get_answer_buffer()
+        self.addCleanup(buffer.flush)
+        self.post(1, 1)
+        self.assertFalse(UserQuestionSelect.objects.exists())
+        self.post(2, 1)
+        self.assertEqual(UserQuestionSelect.objects.count(), 2)
+        self.assertEqual(UserTestResult.objects.get().score, 20)
+
+    def test_batches_stats(self):
+        users = [User.objects.create_user(username=f"user{i}") for i in range(5)]
+        for user in users:
+            UserTestResult.objects.start_attempt(user, self.exam).record_answer(self.questions[0], 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.buffer.flush(), 5)
+        # 解答は1回の INSERT、問題ごとの集計は5人分をまとめて1回の UPDATE
+        statements = [query["sql"] for query in queries.captured_queries]
+        self.assertEqual(sum(sql.startswith('INSERT INTO "mymath_userquestionselect"') for sql in statements), 1)
+        self.assertEqual(sum(sql.startswith('UPDATE "mymath_questionstats"') for sql in statements), 1)
+        self.assertEqual(QuestionStats.objects.get(question=self.questions[0]).answered, 5)
+
+    def test_failed_flush_keeps_answers(self):
+        self.post(1, 1)
+        with mock.patch("mymath.answer_buffer.write_answers", side_effect=RuntimeError("DB停止")):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush()
+        self.assertEqual(len(self.buffer), 1)
+        self.buffer.flush()
+        self.assertEqual(UserQuestionSelect.objects.count(), 1)
+
+    def test_bad_answer_does_not_block_others(self):
+        self.post(1, 1)
+        result = UserTestResult.objects.get()
+        with self.assertRaises(ValueError):
+            result.record_answer(self.questions[1], 5)
+        # 検証をすり抜けてデータベースのエラーになる解答がまざっても、ほかの解答は保存して不正な解答だけを捨てる
+        bad = UserQuestionSelect(test_result=result, question=self.questions[1], select=None, correct=False)
+        self.buffer._pending[(result.id, self.questions[1].id)] = bad
+        self.post(3, 1)
+        with self.assertLogs("mymath.answer_buffer", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(sorted(UserQuestionSelect.objects.values_list("question__number", flat=True)), [1, 3])
+        response = self.client.get(reverse("mymath:result", args=[self.exam.id]))
+        self.assertEqual(response.context["user_result"].score, 20)
+
+    def test_programming_errors_are_not_hidden(self):
+        self.post(1, 1)
+        with mock.patch("mymath.models.QuestionStats.objects.add_answers", side_effect=KeyError("x")):
+            with self.assertRaises(KeyError):
+                self.buffer.flush()
+        # 1件ずつの保存に回して捨てずに、バッファに戻す
+        self.assertEqual(len(self.buffer), 1)
+
+    @override_settings(ROOT_URLCONF="djangomath.urls_async")
+    async def test_async_views(self):
+        await self.async_client.aforce_login(self.user)
+        for number in (1, 2, 3):
+            await self.async_client.post(reverse("mymath:exam", args=[self.exam.id, number]),
+                                         {f"question_{number}": 1})
+        self.assertFalse(await UserQuestionSelect.objects.aexists())
+        response = await self.async_client.get(reverse("mymath:answer", args=[self.exam.id, 2]))
+        self.assertEqual(response.context["useranswer"].select, 1)
+        response = await self.async_client.get(reverse("mymath:result", args=[self.exam.id]))
+        self.assertEqual(response.context["user_result"].score, 30)
+
+
+@override_settings(MYMATH_ANSWER_BUFFER="local", MYMATH_ANSWER_BUFFER_INTERVAL=50,
+                   MYMATH_ANSWER_BUFFER_SIZE=100)
+class TestAnswerBufferThread(AnswerBufferMixin, TransactionTestCase):
+    def setUp(self):
+        self.make_exam()
+
+    def test_flushes_in_background(self):
+        self.post(1, 1)
+        buffer = get_answer_buffer()
+        # バッファが空になるのはコミットしたあと
+        deadline = time.monotonic() + 5
+        while len(buffer) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(UserQuestionSelect.objects.count(), 1)
+        self.assertEqual(UserTestResult.objects.get().score, 10)
+
+
+SHUTDOWN_SCRIPT = textwrap.dedent("""
+    import django
+    django.setup()
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from mymath.models import Category, Exam, Question, UserQuestionSelect, UserTestResult
+
+    call_command("migrate", verbosity=0)
+    exam = Exam.objects.create(title="テスト", category=Category.objects.create(name="カテゴリー"))
+    question = Question.objects.create(exam=exam, text="1+1=?", select_1="1", select_2="2",
+                                       select_3="3", select_4="4", answer=2)
+    user = User.objects.create_user(username="student")
+    UserTestResult.objects.start_attempt(user, exam).record_answer(question, 2)
+    print(UserQuestionSelect.objects.count())
+""")
+
+
+class TestAnswerBufferShutdown(SimpleTestCase):
+    """正常に終了するときは atexit で残りの解答を保存する"""
+
+    def test_flush_at_exit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Path(tmp) / "db.sqlite3"
+            env = {**os.environ,
+                   "DJANGO_SETTINGS_MODULE": "djangomath.settings",
+                   "DB_ENGINE": "django.db.backends.sqlite3",
+                   "DB_NAME": str(db),
+                   "MYMATH_ANSWER_BUFFER": "local",
+                   "MYMATH_ANSWER_BUFFER_INTERVAL": "60000"} # 終了するまで別スレッドでは保存しない
+            completed = subprocess.run([sys.executable, "-c", SHUTDOWN_SCRIPT], cwd=settings.BASE_DIR,
+                                       env=env, capture_output=True, text=True, timeout=120)
+            self.assertEqual(completed.returncode, 0, completed.stderr)
+            self.assertEqual(completed.stdout.strip(), "0") # 終了する前は保存されていない
+            with sqlite3.connect(db) as conn:
+                count = conn.execute("SELECT COUNT(*) FROM mymath_userquestionselect").fetchone()[0]
+                score = conn.execute("SELECT score FROM mymath_usertestresult").fetchone()[0]
+            self.assertEqual((count, score), (1, 10))
@@ -0,0 +1,69 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from mymath.models import Category, Exam, Question, UserQuestionSelect, UserTestResult
+
+
+class TestExamApi(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        for i in range(10):
+            Question.objects.create(
+                exam=self.exam,
+                text=f"text{i+1}",
+                select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+                answer=1)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+
+    def submit(self, selections):
+        return self.client.post(
+            reverse("mymath:api_exam_submit", kwargs={"exam_id": self.exam.id}),
+            data=json.dumps({"selections": selections}),
+            content_type="application/json")
+
+    def test_get_exam_without_answers(self):
+        response = self.client.get(reverse("mymath:api_exam", kwargs={"exam_id": self.exam.id}))
+        data = response.json()
+        self.assertEqual(data["title"], "テスト1")
+        self.assertEqual(len(data["questions"]), 10)
+        self.assertEqual(data["questions"][0]["selects"][0], "select1")
+        self.assertNotIn("answer", data["questions"][0])
+
+    def test_submit_anonymous(self):
+        # 5問目と6問目だけ不正解
+        selections = {str(i): (2 if i in (5, 6) else 1) for i in range(1, 11)}
+        data = self.submit(selections).json()
+        self.assertEqual(data["score"], 80)
+        self.assertFalse(data["results"][4]["correct"])
+        session = self.client.session
+        self.assertEqual(session["exam"]["question_select"], selections)
+        # 通常のresultページでも同じ結果が表示される
+        response = self.client.get(reverse("mymath:result", kwargs={"exam_id": self.exam.id}))
+        self.assertContains(response, "80点")
+
+    def test_submit_login(self):
+        self.client.login(username="testuser", password="pass")
+        data = self.submit({str(i): 1 for i in range(1, 11)}).json()
+        self.assertEqual(data["score"], 100)
+        user_tr = UserTestResult.objects.get()
+        self.assertEqual(user_tr.score, 100)
+        self.assertEqual(UserQuestionSelect.objects.filter(test_result=user_tr).count(), 10)
+        response = self.client.get(reverse("mymath:result", kwargs={"exam_id": self.exam.id}))
+        self.assertContains(response, "100点")
+
+    def test_submit_invalid(self):
+        self.assertEqual(self.submit({"11": 1}).status_code, 400)
+        self.assertEqual(self.submit({"1": 5}).status_code, 400)
+        for value in (1.0, "1", True):
+            self.assertEqual(self.submit({"1": value}).status_code, 400)
+        self.client.login(username="testuser", password="pass")
+        self.assertEqual(self.submit({"1": 1.0}).status_code, 400)
+        self.assertFalse(UserTestResult.objects.exists())
+        response = self.client.post(
+            reverse("mymath:api_exam_submit", kwargs={"exam_id": self.exam.id}),
+            data="not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,146 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from mymath.archive import pack, renumber, unpack, unpack_one
+from mymath.cache import clear_exam_cache
+from mymath.exports import iter_export
+from mymath.models import Category, Exam, Question, QuestionStats, UserQuestionSelect, UserTestResult
+
+
+class TestPack(SimpleTestCase):
+    def test_round_trip(self):
+        answers = {1: (1, True), 2: (4, False), 3: (2, False), 5: (3, True), 10: (4, True)}
+        packed = pack(answers)
+        self.assertEqual(unpack(*packed), answers)
+        self.assertEqual(unpack_one(*packed, 2), (4, False))
+        self.assertIsNone(unpack_one(*packed, 4))
+        self.assertIsNone(unpack_one(*packed, 11))
+        # 10問で 3 + 2 + 2 バイト
+        self.assertEqual([len(value) for value in packed], [3, 2, 2])
+
+    def test_empty(self):
+        self.assertEqual(pack({}), (b"", b"", b""))
+        self.assertEqual(unpack(b"", b"", b""), {})
+
+    def test_invalid_select(self):
+        with self.assertRaises(ValueError):
+            pack({1: (5, False)})
+
+    def test_renumber_drops_deleted(self):
+        packed = pack({1: (1, True), 2: (2, False), 3: (3, True)})
+        # 問題2を削除して3を2に詰めた
+        self.assertEqual(unpack(*renumber(*packed, {1: 1, 3: 2})), {1: (1, True), 2: (3, True)})
+
+
+class TestArchiveAttempts(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_exam_cache()
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.questions = [
+            Question.objects.create(exam=self.exam, text=f"問題{i + 1}", select_1="1", select_2="2",
+                                    select_3="3", select_4="4", answer=1)
+            for i in range(3)]
+        self.user = User.objects.create_user(username="testuser", password="pass")
+        self.client.login(username="testuser", password="pass")
+        self.old = self.take([1, 3, 1])
+        UserTestResult.objects.filter(id=self.old.id).update(finished=timezone.now() - timedelta(days=40))
+        self.recent = self.take([2, 1, 1])
+
+    def take(self, selects):
+        for number, select in enumerate(selects, start=1):
+            self.client.post(reverse("mymath:exam", args=[self.exam.id, number]),
+                             {f"question_{number}": select})
+        return UserTestResult.objects.get(id=self.client.session["current_usertestresult_id"])
+
+    def archive(self):
+        call_command("archive_attempts", "--older-than-days", "30", "--chunk-size", "1", stdout=StringIO())
+
+    def view_old(self):
+        session = self.client.session
+        session["current_usertestresult_id"] = self.old.id
+        session.save()
+
+    def test_archives_only_old_finished(self):
+        self.archive()
+        self.old.refresh_from_db()
+        self.recent.refresh_from_db()
+        self.assertTrue(self.old.is_archived)
+        self.assertFalse(self.recent.is_archived)
+        self.assertFalse(UserQuestionSelect.objects.filter(test_result=self.old).exists())
+        self.assertEqual(UserQuestionSelect.objects.filter(test_result=self.recent).count(), 3)
+        self.assertEqual((self.old.score, self.old.correct_count, self.old.answered_count), (20, 2, 3))
+
+    def test_result_and_answer_read_archive(self):
+        self.view_old()
+        before = self.client.get(reverse("mymath:result", args=[self.exam.id]))
+        self.archive()
+        after = self.client.get(reverse("mymath:result", args=[self.exam.id]))
+        self.assertEqual(
+            [(answer.question.number, answer.correct) for answer in after.context["useranswers"]],
+            [(answer.question.number, answer.correct) for answer in before.context["useranswers"]])
+        response = self.client.get(reverse("mymath:answer", args=[self.exam.id, 2]))
+        self.assertEqual(response.context["useranswer"].select, 3)
+        self.assertFalse(response.context["useranswer"].correct)
+
+    @override_settings(ROOT_URLCONF="djangomath.urls_async")
+    async def test_async_views_read_archive(self):
+        await self.async_client.aforce_login(self.user)
+        session = await self.async_client.asession()
+        await session.aset("current_usertestresult_id", self.old.id)
+        await session.asave()
+        await sync_to_async(self.archive)()
+        response = await self.async_client.get(reverse("mymath:result", args=[self.exam.id]))
+        self.assertEqual([answer.correct for answer in response.context["useranswers"]], [True, False, True])
+        response = await self.async_client.get(reverse("mymath:answer", args=[self.exam.id, 1]))
+        self.assertEqual(response.context["useranswer"].select, 1)
+
+    def test_archived_attempt_is_not_answered_again(self):
+        self.archive()
+        self.old.refresh_from_db()
+        answer, created = self.old.record_answer(self.questions[0], 2)
+        self.assertFalse(created)
+        self.assertEqual(answer.select, 1)
+        self.assertFalse(UserQuestionSelect.objects.filter(test_result=self.old).exists())
+
+    def test_export_and_rebuild(self):
+        before = [json.loads(line) for line in iter_export("answers", "jsonl")]
+        stats = list(QuestionStats.objects.order_by("question_id").values())
+        self.archive()
+        after = [json.loads(line) for line in iter_export("answers", "jsonl")]
+        key = lambda row: (row["attempt_id"], row["question_number"])
+        self.assertEqual(sorted(after, key=key), sorted(before, key=key))
+        QuestionStats.objects.all().delete()
+        call_command("rebuild_question_stats", stdout=StringIO())
+        self.assertEqual(list(QuestionStats.objects.order_by("question_id").values()), stats)
+
+    def test_invalid_select_is_skipped(self):
+        UserQuestionSelect.objects.filter(test_result=self.old, question=self.questions[0]).update(select=7)
+        out = StringIO()
+        call_command("archive_attempts", stdout=out)
+        self.old.refresh_from_db()
+        self.assertFalse(self.old.is_archived)
+        self.assertIn("1件はそのままにしました", out.getvalue())
+
+    def test_renumber_keeps_archive(self):
+        self.archive()
+        self.questions[0].delete()
+        User.objects.create_superuser(username="admin", password="pass")
+        self.client.login(username="admin", password="pass")
+        self.client.post(reverse("admin:mymath_exam_changelist"),
+                         data={"action": "renumber_questions", "_selected_action": [self.exam.id]})
+        self.old.refresh_from_db()
+        question = Question.objects.get(exam=self.exam, number=1) # 元の問題2
+        self.assertEqual(self.old.archived_answer(question).select, 3)
+        self.assertEqual([(a.question.number, a.select) for a in self.old.archived_answers(
+            Question.objects.filter(exam=self.exam).order_by("number"))], [(1, 3), (2, 1)])
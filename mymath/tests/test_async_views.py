@@ -0,0 +1,116 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+
+from mymath.cache import clear_exam_cache
+from mymath.models import Category, Exam, Question, UserQuestionSelect, UserTestResult
+
+
+@override_settings(ROOT_URLCONF="djangomath.urls_async")
+class TestAsyncViews(TestCase):
+    """非同期版のページ(async_views.py)で受験の流れを最後までたどる"""
+
+    def setUp(self):
+        cache.clear()
+        clear_exam_cache()
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        for i in range(3):
+            Question.objects.create(exam=self.exam, text=f"問題{i + 1}", select_1="1", select_2="2",
+                                    select_3="3", select_4="4", answer=1)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+
+    def test_urls_use_async_views(self):
+        self.assertEqual(resolve(reverse("mymath:exam", args=[self.exam.id, 1])).func.__name__, "aexam")
+
+    async def walk(self, selects):
+        for number, select in enumerate(selects, start=1):
+            exam_url = reverse("mymath:exam", args=[self.exam.id, number])
+            answer_url = reverse("mymath:answer", args=[self.exam.id, number])
+            response = await self.async_client.get(exam_url)
+            self.assertContains(response, f"問題{number}")
+            response = await self.async_client.post(exam_url, {f"question_{number}": select})
+            self.assertRedirects(response, answer_url, fetch_redirect_response=False)
+            response = await self.async_client.get(answer_url)
+            self.assertEqual(response.status_code, 200)
+            # 未ログインのときは辞書、ログイン中は UserQuestionSelect
+            useranswer = response.context["useranswer"]
+            correct = useranswer["correct"] if isinstance(useranswer, dict) else useranswer.correct
+            self.assertEqual(correct, select == 1)
+            response = await self.async_client.post(answer_url)
+            expected = (reverse("mymath:exam", args=[self.exam.id, number + 1])
+                        if number < len(selects) else reverse("mymath:result", args=[self.exam.id]))
+            self.assertRedirects(response, expected, fetch_redirect_response=False)
+        return await self.async_client.get(reverse("mymath:result", args=[self.exam.id]))
+
+    async def test_anonymous_flow(self):
+        response = await self.async_client.get(reverse("mymath:index"))
+        self.assertContains(response, "テスト1")
+        response = await self.walk([1, 2, 1])
+        self.assertEqual(response.context["user_result"]["score"], 20)
+        self.assertEqual(len(response.context["useranswers"]), 3)
+        self.assertFalse(await UserTestResult.objects.aexists())
+
+    async def test_logged_in_flow(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("mymath:index"))
+        self.assertContains(response, "testuser")
+        response = await self.walk([1, 1, 2])
+        self.assertEqual(response.context["user_result"].score, 20)
+        self.assertEqual([a.question.number for a in response.context["useranswers"]], [1, 2, 3])
+        result = await UserTestResult.objects.aget()
+        self.assertEqual((result.count, result.answered_count, result.correct_count), (1, 3, 2))
+        self.assertIsNotNone(result.finished)
+        self.assertEqual(await UserQuestionSelect.objects.acount(), 3)
+        self.assertEqual(response.context["ranking"]["rank"], 1)
+
+    async def test_resubmitting_first_question_reuses_attempt(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse("mymath:exam", args=[self.exam.id, 1])
+        await self.async_client.post(url, {"question_1": 1})
+        await self.async_client.post(url, {"question_1": 2})
+        result = await UserTestResult.objects.aget()
+        self.assertEqual((result.count, result.answered_count, result.score), (1, 1, 10))
+
+    async def test_logged_in_requires_attempt(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("mymath:exam", args=[self.exam.id, 2]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_empty_select_warns(self):
+        url = reverse("mymath:exam", args=[self.exam.id, 1])
+        response = await self.async_client.post(url, {})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        response = await self.async_client.get(url)
+        self.assertContains(response, "番号をえらんでから次へを押してください")
+
+    async def test_invalid_select_warns(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse("mymath:exam", args=[self.exam.id, 1])
+        response = await self.async_client.post(url, {"question_1": "5"})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertFalse(await UserQuestionSelect.objects.aexists())
+
+    async def test_not_found(self):
+        response = await self.async_client.get(reverse("mymath:exam", args=[self.exam.id + 100, 1]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse("mymath:exam", args=[self.exam.id, 9]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_index_conditional_get(self):
+        response = await self.async_client.get(reverse("mymath:index"))
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+        response = await self.async_client.get(reverse("mymath:index"), headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        # ログイン中は条件付きGETにしない
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("mymath:index"), headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+    @override_settings(MYMATH_ANONYMOUS_STATE="cookie")
+    async def test_anonymous_cookie_state(self):
+        response = await self.walk([1, 1, 1])
+        self.assertEqual(response.context["user_result"]["score"], 30)
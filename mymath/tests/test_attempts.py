@@ -0,0 +1,120 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from mymath.models import AttemptCounter, Category, Exam, Question, UserTestResult
+
+
+class TestStartAttempt(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+
+    def test_counts_are_sequential(self):
+        counts = [UserTestResult.objects.start_attempt(self.user, self.exam).count for _ in range(3)]
+        self.assertEqual(counts, [1, 2, 3])
+        self.assertEqual(AttemptCounter.objects.get().last_count, 3)
+
+    def test_continues_from_existing_results(self):
+        # カウンター導入前の受験結果があるときはその続きから
+        UserTestResult.objects.create(user=self.user, exam=self.exam, count=4)
+        self.assertEqual(UserTestResult.objects.start_attempt(self.user, self.exam).count, 5)
+
+
+class TestStartAttemptConcurrent(TransactionTestCase):
+    """同時に受験を始めても回数が重ならないことのテスト
+
+    SQLiteのメモリ上のテスト用DBではスレッドごとの接続が同じDBを使えないのでスキップされる。
+    PostgreSQLか、ファイルのSQLite(DATABASES["default"]["TEST"]["NAME"]を指定)で実行する。
+    SQLiteの test_db_allows_multiple_connections は常に False なので、その機能では判定しない。
+    """
+    THREADS = 50
+
+    def setUp(self):
+        # テスト用DBの名前はテストを始めてから決まるので、クラスのデコレーターではなくここで判定する
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("SQLiteのメモリ上のテスト用DBでは複数の接続を使えない")
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+
+    def test_parallel_starts(self):
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def start():
+            try:
+                barrier.wait()
+                UserTestResult.objects.start_attempt(self.user, self.exam)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=start) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        counts = sorted(UserTestResult.objects.filter(user=self.user).values_list("count", flat=True))
+        self.assertEqual(counts, list(range(1, self.THREADS + 1)))
+
+
+class TestLazyAttempt(TestCase):
+    """受験結果が最初の解答のときに作成されることのテスト"""
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.question = Question.objects.create(
+            exam=self.exam, text="text",
+            select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+            answer=1)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+        self.client.login(username="testuser", password="pass")
+
+    def test_get_does_not_create(self):
+        url = reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1})
+        self.client.get(url)
+        self.client.get(url)
+        self.assertFalse(UserTestResult.objects.exists())
+        self.client.post(url, data={"question_1": 1})
+        self.assertEqual(UserTestResult.objects.get().answered_count, 1)
+
+    def test_resubmitting_first_question_reuses_attempt(self):
+        question2 = Question.objects.create(
+            exam=self.exam, text="text2",
+            select_1="select1", select_2="select2", select_3="select3", select_4="select4", answer=1)
+        url = reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1})
+        # 二重送信や戻るボタンで1問目を送りなおしても、受験結果は1つのまま
+        self.client.post(url, data={"question_1": 1})
+        self.client.post(url, data={"question_1": 2})
+        self.assertEqual(list(UserTestResult.objects.values_list("count", "answered_count", "score")),
+                         [(1, 1, 10)])
+        # 2問目に進んだあとに1問目から始めなおしたときは新しい受験にする
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 2}),
+                         data={f"question_{question2.number}": 1})
+        self.client.post(url, data={"question_1": 1})
+        self.assertEqual(list(UserTestResult.objects.values_list("count", flat=True)), [2, 1])
+
+    def test_compact_attempts(self):
+        old = timezone.now() - timedelta(days=3)
+        empty = [UserTestResult.objects.start_attempt(self.user, self.exam) for _ in range(3)]
+        answered = UserTestResult.objects.start_attempt(self.user, self.exam)
+        answered.record_answer(self.question, 1)
+        recent = UserTestResult.objects.start_attempt(self.user, self.exam)
+        UserTestResult.objects.filter(id__in=[r.id for r in empty + [answered]]).update(submitted=old)
+
+        out = StringIO()
+        call_command("compact_attempts", "--older-than-days", "1", "--chunk-size", "2", stdout=out)
+        self.assertIn("合計3件", out.getvalue())
+        self.assertEqual(set(UserTestResult.objects.values_list("id", flat=True)),
+                         {answered.id, recent.id})
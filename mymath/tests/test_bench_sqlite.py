@@ -0,0 +1,30 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from djangomath.sqlite import production_options
+
+
+class TestSQLiteProductionOptions(SimpleTestCase):
+    def test_options(self):
+        options = production_options(timeout=5, mmap_size=1024, cache_size_kib=2048)
+        self.assertEqual(options["transaction_mode"], "IMMEDIATE")
+        self.assertEqual(options["timeout"], 5)
+        self.assertIn("PRAGMA journal_mode=WAL", options["init_command"])
+        self.assertIn("PRAGMA synchronous=NORMAL", options["init_command"])
+        self.assertIn("PRAGMA mmap_size=1024", options["init_command"])
+        self.assertIn("PRAGMA cache_size=-2048", options["init_command"])
+
+
+class TestBenchSQLiteCommand(SimpleTestCase):
+    def test_compares_profiles(self):
+        out = StringIO()
+        call_command("bench_sqlite", threads=2, readers=1, transactions=5, stdout=out)
+        lines = out.getvalue().splitlines()
+        default = next(line for line in lines if line.startswith("default"))
+        production = next(line for line in lines if line.startswith("production "))
+        # 本番用の設定は接続を開いたときに WAL になっている
+        self.assertIn("delete", default)
+        self.assertIn("wal", production)
+        self.assertIn("production は default の", lines[-1])
@@ -0,0 +1,98 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from mymath.cache import clear_exam_cache
+from mymath.models import Category, Exam, Question
+
+from .budgets import BUDGETS, QueryBudgetMixin, format_queries
+
+
+class TestQueryBudgets(QueryBudgetMixin, TestCase):
+    """受験の流れ全体を通して、各ページのクエリ数(と指定したときは処理時間)が予算内かを確かめる"""
+
+    def setUp(self):
+        cache.clear()
+        clear_exam_cache()
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        for i in range(5):
+            Question.objects.create(
+                exam=self.exam, text=f"問題{i + 1}", select_1="1", select_2="2",
+                select_3="3", select_4="4", answer=(i % 4) + 1)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+
+    def request(self, url_name, logged_in, method="get", data=None, step=None, **kwargs):
+        url = reverse(url_name, kwargs=kwargs)
+        with self.assertWithinBudget(url_name, step or method.upper(), logged_in=logged_in):
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def walk(self, logged_in):
+        # キャッシュが空の状態から、トップページ → 全問解答 → 結果 の順にたどる
+        self.request("mymath:index", logged_in)
+        steps = {1: "first POST", 5: "last POST"}
+        for number in range(1, 6):
+            self.request("mymath:exam", logged_in, exam_id=self.exam.id, number=number)
+            self.request("mymath:exam", logged_in, "post", {f"question_{number}": 2},
+                         step=steps.get(number, "POST"), exam_id=self.exam.id, number=number)
+            self.request("mymath:answer", logged_in, exam_id=self.exam.id, number=number)
+            self.request("mymath:answer", logged_in, "post", exam_id=self.exam.id, number=number)
+        response = self.request("mymath:result", logged_in, exam_id=self.exam.id)
+        self.assertEqual(len(response.context["useranswers"]), 5)
+
+    def test_anonymous_flow(self):
+        self.request("accounts:signup", False)
+        self.request("accounts:login", False)
+        self.walk(logged_in=False)
+
+    def test_logged_in_flow(self):
+        self.request("accounts:signup", False, "post", {
+            "username": "newuser", "password1": "Zx9!long-pass", "password2": "Zx9!long-pass"})
+        self.request("accounts:login", False, "post", {"username": "testuser", "password": "pass"})
+        self.walk(logged_in=True)
+        self.request("accounts:login", True)
+        self.request("accounts:signup", True)
+
+    def test_result_does_not_grow_with_questions(self):
+        # 問題数を増やしても結果ページのクエリ数は変わらない(N+1 にならない)
+        for i in range(5, 30):
+            Question.objects.create(
+                exam=self.exam, text=f"問題{i + 1}", select_1="1", select_2="2",
+                select_3="3", select_4="4", answer=1)
+        self.client.login(username="testuser", password="pass")
+        for number in range(1, 31):
+            self.client.post(reverse("mymath:exam", args=[self.exam.id, number]),
+                             {f"question_{number}": 1})
+        self.request("mymath:result", True, exam_id=self.exam.id)
+
+    def test_failure_lists_repeated_queries(self):
+        with self.assertRaises(AssertionError) as raised:
+            with self.assertWithinBudget("mymath:answer", "GET", logged_in=False):
+                for question in Question.objects.all():
+                    question.exam.title
+        message = str(raised.exception)
+        self.assertIn(f"6 > {BUDGETS['mymath:answer', 'GET'].anonymous}", message)
+        # 同じ形のクエリは値を ? にしてまとめ、回数を表示する
+        self.assertIn('    5 x SELECT "mymath_exam"', message)
+
+    def test_time_budget_is_opt_in(self):
+        # MYMATH_BUDGET_TIME_FACTOR を指定しないときは処理時間で失敗しない
+        with mock.patch.object(self, "time_factor", 0):
+            with self.assertWithinBudget("mymath:index", "GET", logged_in=False):
+                time.sleep(0.01)
+        with mock.patch.object(self, "time_factor", 0.001):
+            with self.assertRaisesMessage(AssertionError, "処理時間が予算を超えました"):
+                with self.assertWithinBudget("mymath:index", "GET", logged_in=False):
+                    time.sleep(0.01)
+
+    def test_format_queries(self):
+        queries = [{"sql": "SELECT * FROM t WHERE id = 1"}, {"sql": "SELECT * FROM t WHERE id = 2"},
+                   {"sql": "SELECT * FROM u WHERE name = 'a'"}]
+        self.assertEqual(format_queries(queries),
+                         "    2 x SELECT * FROM t WHERE id = ?\n    1 x SELECT * FROM u WHERE name = ?")
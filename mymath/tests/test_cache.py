@@ -0,0 +1,75 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from mymath.cache import cache_stats, clear_exam_cache, get_exam_snapshot
+from mymath.checks import check_shared_cache
+from mymath.models import Category, Exam, Question
+
+
+class TestExamSnapshot(TestCase):
+    def setUp(self):
+        clear_exam_cache()
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        for i in range(3):
+            Question.objects.create(
+                exam=self.exam,
+                text=f"text{i+1}",
+                select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+                answer=1)
+
+    def test_snapshot_is_cached(self):
+        snapshot = get_exam_snapshot(self.exam.id)
+        self.assertEqual(snapshot.total, 3)
+        self.assertEqual([q.number for q in snapshot.questions], [1, 2, 3])
+        # 2回目はクエリなしでキャッシュから返る
+        with self.assertNumQueries(0):
+            self.assertIs(get_exam_snapshot(self.exam.id), snapshot)
+        self.assertEqual(cache_stats(), {"hits": 1, "misses": 1})
+
+    def test_not_exist_exam(self):
+        self.assertIsNone(get_exam_snapshot(self.exam.id + 1))
+
+    def test_question_save_invalidates(self):
+        snapshot = get_exam_snapshot(self.exam.id)
+        question = snapshot.question(2)
+        question.text = "changed"
+        question.save()
+        new_snapshot = get_exam_snapshot(self.exam.id)
+        self.assertNotEqual(new_snapshot.version, snapshot.version)
+        self.assertEqual(new_snapshot.question(2).text, "changed")
+
+    def test_question_delete_invalidates(self):
+        get_exam_snapshot(self.exam.id)
+        Question.objects.get(exam=self.exam, number=3).delete()
+        self.assertEqual(get_exam_snapshot(self.exam.id).total, 2)
+
+    def test_exam_save_invalidates(self):
+        get_exam_snapshot(self.exam.id)
+        self.exam.title = "変更後"
+        self.exam.save()
+        self.assertEqual(get_exam_snapshot(self.exam.id).exam.title, "変更後")
+
+    def test_views_share_snapshot(self):
+        # exam, answer, result が同じスナップショットを使う
+        self.client.get(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1}))
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1}),
+                         data={"question_1": 1})
+        self.client.get(reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": 1}))
+        self.assertEqual(cache_stats(), {"hits": 2, "misses": 1})
+
+
+class TestSharedCacheCheck(SimpleTestCase):
+    """複数プロセスで動かすときにプロセスごとのキャッシュをエラーにするシステムチェック"""
+
+    def test_single_worker_allows_locmem(self):
+        with override_settings(MYMATH_WORKERS=1):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_workers_require_shared_cache(self):
+        with override_settings(MYMATH_WORKERS=4):
+            self.assertEqual([e.id for e in check_shared_cache(None)], ["mymath.E001"])
+        shared = {"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache",
+                              "LOCATION": "mymath_cache"}}
+        with override_settings(MYMATH_WORKERS=4, CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
@@ -0,0 +1,73 @@
+import csv
+import json
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from mymath.exports import iter_export
+from mymath.models import Category, Exam, Question, UserQuestionSelect, UserTestResult
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.other_exam = Exam.objects.create(title="テスト2", category=self.category)
+        self.question = Question.objects.create(
+            exam=self.exam, text="text",
+            select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+            answer=1)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+        self.result = UserTestResult.objects.create(user=self.user, exam=self.exam, count=1, score=10)
+        UserTestResult.objects.create(user=self.user, exam=self.other_exam, count=1)
+        UserQuestionSelect.objects.create(
+            test_result=self.result, question=self.question, select=1, correct=True)
+        self.staff = User.objects.create_user(username="staff", password="pass", is_staff=True)
+
+    def test_requires_staff(self):
+        self.client.login(username="testuser", password="pass")
+        response = self.client.get(reverse("mymath:export", kwargs={"kind": "attempts"}))
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_attempts_csv(self):
+        self.client.login(username="staff", password="pass")
+        response = self.client.get(reverse("mymath:export", kwargs={"kind": "attempts"}),
+                                   data={"exam": self.exam.id})
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["username"], "testuser")
+        self.assertEqual(rows[0]["exam_title"], "テスト1")
+        self.assertEqual(rows[0]["score"], "10")
+
+    def test_export_answers_jsonl(self):
+        self.client.login(username="staff", password="pass")
+        response = self.client.get(reverse("mymath:export", kwargs={"kind": "answers"}),
+                                   data={"format": "jsonl", "category": self.category.id})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row["question_number"], 1)
+        self.assertTrue(row["correct"])
+
+    def test_export_queries_do_not_grow(self):
+        # select_relatedで取得するので、行数が増えてもクエリ数は変わらない
+        for i in range(2, 6):
+            UserTestResult.objects.create(user=self.user, exam=self.exam, count=i)
+        with self.assertNumQueries(1):
+            lines = list(iter_export("attempts", "csv"))
+        self.assertEqual(len(lines), 7)
+
+    def test_invalid_filter(self):
+        self.client.login(username="staff", password="pass")
+        response = self.client.get(reverse("mymath:export", kwargs={"kind": "attempts"}),
+                                   data={"since": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("export_attempts", "answers", "--format", "jsonl", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["username"], "testuser")
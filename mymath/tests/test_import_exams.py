@@ -0,0 +1,94 @@
+import csv
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from mymath.models import Category, Exam, Question
+
+
+class TestImportExams(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.rows = []
+        for i in range(5):
+            self.rows.append({
+                "category": "計算", "grade": "junior", "exam": "テスト1",
+                "text": f"問題{i+1}", "select_1": "1", "select_2": "2",
+                "select_3": "3", "select_4": "4", "answer": "2", "answer_text": ""})
+
+    def write_csv(self, rows):
+        path = Path(self.tmpdir.name) / "questions.csv"
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+    def run_command(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command("import_exams", *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_csv(self):
+        path = self.write_csv(self.rows)
+        out, _ = self.run_command(str(path), "--batch-size", "2")
+        self.assertIn("5問を登録しました", out)
+        exam = Exam.objects.get(title="テスト1")
+        self.assertEqual(exam.category.grade, "junior")
+        self.assertEqual(exam.question_count, 5)
+        self.assertEqual(list(exam.questions.values_list("number", flat=True)), [1, 2, 3, 4, 5])
+        self.assertFalse(Path(f"{path}.checkpoint").exists())
+
+    def test_import_jsonl(self):
+        path = Path(self.tmpdir.name) / "questions.jsonl"
+        path.write_text("\n".join(json.dumps(row, ensure_ascii=False) for row in self.rows),
+                        encoding="utf-8")
+        self.run_command(str(path))
+        self.assertEqual(Question.objects.count(), 5)
+
+    def test_jsonl_non_object_rows_are_skipped(self):
+        path = Path(self.tmpdir.name) / "questions.jsonl"
+        lines = [json.dumps(row, ensure_ascii=False) for row in self.rows]
+        lines[1], lines[3] = "[1, 2]", '"x"'
+        path.write_text("\n".join(lines), encoding="utf-8")
+        out, err = self.run_command(str(path))
+        self.assertIn("スキップ2行", out)
+        self.assertIn("2行目", err)
+        self.assertIn("4行目", err)
+        self.assertEqual(Question.objects.count(), 3)
+
+    def test_invalid_rows_are_skipped(self):
+        self.rows[1]["answer"] = "5"
+        self.rows[2]["select_1"] = "x" * 101
+        self.rows[3]["exam"] = ""
+        path = self.write_csv(self.rows)
+        out, err = self.run_command(str(path))
+        self.assertIn("スキップ3行", out)
+        self.assertIn("2行目", err)
+        self.assertEqual(Question.objects.count(), 2)
+
+    def test_jsonl_names_are_converted_and_checked(self):
+        self.rows[0]["category"] = 5
+        self.rows[1]["exam"] = "x" * 101
+        self.rows[2]["category"] = "x" * 51
+        path = Path(self.tmpdir.name) / "questions.jsonl"
+        path.write_text("\n".join(json.dumps(row, ensure_ascii=False) for row in self.rows),
+                        encoding="utf-8")
+        out, err = self.run_command(str(path))
+        self.assertIn("スキップ2行", out)
+        self.assertIn("2行目", err)
+        self.assertIn("3行目", err)
+        self.assertTrue(Exam.objects.filter(title="テスト1", category__name="5").exists())
+
+    def test_resume_from_checkpoint(self):
+        # 3行目までは前回登録済みとして、4行目から登録されることを確認
+        path = self.write_csv(self.rows)
+        Path(f"{path}.checkpoint").write_text(json.dumps({"rows": 3}))
+        self.run_command(str(path), "--resume")
+        self.assertEqual(list(Question.objects.values_list("text", flat=True)), ["問題4", "問題5"])
+        self.assertEqual(Category.objects.count(), 1)
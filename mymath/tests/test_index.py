@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from mymath.models import Category, Exam, Question
+
+
+class TestIndexCache(TestCase):
+    def setUp(self):
+        self.junior = Category.objects.create(name="方程式", grade="junior")
+        self.elementary = Category.objects.create(name="かけ算", grade="elementary")
+        self.exam1 = Exam.objects.create(title="テスト1", category=self.junior)
+        self.exam2 = Exam.objects.create(title="テスト2", category=self.elementary)
+        Question.objects.create(
+            exam=self.exam1, text="text",
+            select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+            answer=1)
+
+    def test_grouped_by_grade_and_category(self):
+        response = self.client.get(reverse("mymath:index"))
+        content = response.content.decode()
+        # 小学生 → 中学生の順に表示される
+        self.assertLess(content.index("小学生"), content.index("中学生"))
+        self.assertLess(content.index("かけ算"), content.index("方程式"))
+        self.assertContains(response, "1問")
+
+    def test_fragment_is_cached(self):
+        self.client.get(reverse("mymath:index"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("mymath:index"))
+        self.assertContains(response, "テスト1")
+
+    def test_invalidated_on_change(self):
+        self.client.get(reverse("mymath:index"))
+        Exam.objects.create(title="テスト3", category=self.junior)
+        self.assertContains(self.client.get(reverse("mymath:index")), "テスト3")
+        self.junior.name = "一次方程式"
+        self.junior.save()
+        self.assertContains(self.client.get(reverse("mymath:index")), "一次方程式")
+
+    def test_conditional_get(self):
+        response = self.client.get(reverse("mymath:index"))
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+        response = self.client.get(reverse("mymath:index"), headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+        # 問題が追加されるとETagが変わる
+        Question.objects.create(
+            exam=self.exam2, text="text",
+            select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+            answer=1)
+        response = self.client.get(reverse("mymath:index"), headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_etag_when_logged_in(self):
+        User.objects.create_user(username="testuser", password="pass")
+        self.client.login(username="testuser", password="pass")
+        response = self.client.get(reverse("mymath:index"))
+        self.assertFalse(response.has_header("ETag"))
@@ -0,0 +1,51 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase
+
+from mymath.management.commands.loadtest import percentile
+from mymath.models import Exam, UserTestResult
+
+
+class TestPercentile(SimpleTestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertEqual(percentile([], 50), 0)
+
+
+class TestLoadtestCommand(TransactionTestCase):
+    # スレッドから別の接続でデータを読むので、コミットされる TransactionTestCase を使う
+    def test_walks_flow_and_cleans_up(self):
+        out = StringIO()
+        call_command("loadtest", students=4, questions=3, threads=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn("生徒4人(ログイン2人)", output)
+        self.assertIn("エラー0件", output)
+        for name in ("mymath:index", "mymath:exam", "mymath:answer", "mymath:result"):
+            self.assertIn(name, output)
+        # 作ったテストと生徒は削除されている
+        self.assertFalse(Exam.objects.exists())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(UserTestResult.objects.exists())
+
+    def test_keep(self):
+        call_command("loadtest", students=2, questions=2, threads=1, keep=True, stdout=StringIO())
+        exam = Exam.objects.get()
+        self.assertEqual(exam.question_count, 2)
+        # ログインした生徒1人分の受験結果が、全問解答済みで残る
+        result = UserTestResult.objects.get()
+        self.assertEqual(result.answered_count, 2)
+        self.assertIsNotNone(result.finished)
+
+    def test_async(self):
+        out = StringIO()
+        call_command("loadtest", students=4, questions=2, use_async=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn("(非同期)", output)
+        self.assertIn("エラー0件", output)
+        self.assertFalse(Exam.objects.exists())
@@ -0,0 +1,100 @@
+import threading
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from mymath import metrics
+from mymath.metrics import clear_metrics, collect, inc, observe, render_metrics
+from mymath.models import Category, Exam, Question
+
+
+class TestMetricsEndpoint(TestCase):
+    def setUp(self):
+        clear_metrics()
+        category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=category)
+        Question.objects.create(exam=self.exam, text="1+1=?", select_1="1", select_2="2",
+                                select_3="3", select_4="4", answer=2)
+        User.objects.create_user(username="staff", password="pass", is_staff=True)
+        User.objects.create_user(username="testuser", password="pass")
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get(reverse("mymath:metrics")).status_code, 302)
+        self.client.login(username="testuser", password="pass")
+        self.assertEqual(self.client.get(reverse("mymath:metrics")).status_code, 302)
+
+    def test_records_views(self):
+        self.client.get(reverse("mymath:exam", args=[self.exam.id, 1]))
+        self.client.post(reverse("mymath:exam", args=[self.exam.id, 1]), {"question_1": 2})
+        self.client.get("/not-found/")
+        self.client.login(username="staff", password="pass")
+        response = self.client.get(reverse("mymath:metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn("# TYPE mymath_request_duration_seconds histogram", body)
+        self.assertIn('mymath_requests_total{view="mymath:exam",method="GET",status="200"} 1', body)
+        self.assertIn('mymath_requests_total{view="mymath:exam",method="POST",status="302"} 1', body)
+        self.assertIn('mymath_request_duration_seconds_count{view="mymath:exam"} 2', body)
+        self.assertIn('mymath_request_duration_seconds_bucket{view="mymath:exam",le="+Inf"} 2', body)
+        self.assertIn('view="unresolved"', body)
+        # 未ログインの解答はセッションに書き込む
+        self.assertIn('mymath_session_writes_total{view="mymath:exam"} 1', body)
+        counters, _ = collect()
+        # 1回目のGETでスナップショットを作るクエリを数えている
+        self.assertGreaterEqual(counters[("mymath_db_queries_total", (("view", "mymath:exam"),))], 2)
+        self.assertGreater(counters[("mymath_db_seconds_total", (("view", "mymath:exam"),))], 0)
+
+
+    @override_settings(ROOT_URLCONF="djangomath.urls_async")
+    async def test_records_async_views(self):
+        # 非同期ビューでは ORM が sync_to_async のスレッドで動くが、そのクエリも数える
+        await self.async_client.alogin(username="testuser", password="pass")
+        await self.async_client.get(reverse("mymath:exam", args=[self.exam.id, 1]))
+        counters, _ = collect()
+        labels = (("view", "mymath:exam"),)
+        self.assertGreaterEqual(counters[("mymath_db_queries_total", labels)], 2) # セッションとユーザー
+        self.assertGreater(counters[("mymath_db_seconds_total", labels)], 0)
+
+
+class TestMetricsAggregation(SimpleTestCase):
+    def setUp(self):
+        clear_metrics()
+
+    def test_threads_are_summed(self):
+        def work():
+            for _ in range(100):
+                inc("mymath_requests_total", (("view", "a"),))
+                observe("mymath_request_duration_seconds", (("view", "a"),), 0.02)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counters, histograms = collect()
+        self.assertEqual(counters[("mymath_requests_total", (("view", "a"),))], 400)
+        counts = histograms[("mymath_request_duration_seconds", (("view", "a"),))]
+        self.assertEqual(counts[2], 400)  # 0.01 < 0.02 <= 0.025
+        self.assertAlmostEqual(counts[-1], 8.0)
+
+    def test_dead_threads_are_merged(self):
+        # リクエストごとにスレッドを作っても、終了したスレッドの集計は残さずにまとめる
+        for _ in range(20):
+            thread = threading.Thread(target=inc, args=("mymath_requests_total", (("view", "a"),)))
+            thread.start()
+            thread.join()
+        counters, _ = collect()
+        self.assertEqual(counters[("mymath_requests_total", (("view", "a"),))], 20)
+        self.assertTrue(all(thread.is_alive() for thread in metrics._stores))
+
+    def test_render_histogram_and_escape(self):
+        observe("mymath_response_size_bytes", (("view", 'a"b'),), 300)
+        observe("mymath_response_size_bytes", (("view", 'a"b'),), 5000)
+        text = render_metrics()
+        self.assertIn('mymath_response_size_bytes_bucket{view="a\\"b",le="256"} 0', text)
+        self.assertIn('mymath_response_size_bytes_bucket{view="a\\"b",le="1024"} 1', text)
+        self.assertIn('mymath_response_size_bytes_bucket{view="a\\"b",le="16384"} 2', text)
+        self.assertIn('mymath_response_size_bytes_sum{view="a\\"b"} 5300', text)
+        self.assertIn('mymath_response_size_bytes_count{view="a\\"b"} 2', text)
@@ -0,0 +1,47 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from mymath.models import Category, Exam, UserTestResult
+
+
+class TestMyPage(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+        other = User.objects.create_user(username="other", password="pass")
+        UserTestResult.objects.create(user=other, exam=self.exam, count=1)
+        self.results = [UserTestResult.objects.create(user=self.user, exam=self.exam, count=i + 1)
+                        for i in range(45)]
+
+    def test_login_required(self):
+        response = self.client.get(reverse("mymath:mypage"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_keyset_pagination(self):
+        self.client.login(username="testuser", password="pass")
+        seen = []
+        url = reverse("mymath:mypage")
+        while url:
+            response = self.client.get(url)
+            self.assertTemplateUsed(response, "mymath/mypage.html")
+            seen.extend(attempt.id for attempt in response.context["attempts"])
+            cursor = response.context["next_cursor"]
+            url = f"{reverse('mymath:mypage')}?cursor={cursor}" if cursor else None
+        # 新しい順に、重複も抜けもなく全件表示される
+        self.assertEqual(seen, [r.id for r in reversed(self.results)])
+        self.assertContains(response, "カテゴリー１")
+
+    def test_query_count_does_not_depend_on_page(self):
+        self.client.login(username="testuser", password="pass")
+        first = self.client.get(reverse("mymath:mypage"))
+        cursor = first.context["next_cursor"]
+        # セッション、ユーザー、受験履歴の3クエリ
+        with self.assertNumQueries(3):
+            self.client.get(reverse("mymath:mypage"), data={"cursor": cursor})
+
+    def test_invalid_cursor(self):
+        self.client.login(username="testuser", password="pass")
+        response = self.client.get(reverse("mymath:mypage"), data={"cursor": "broken"})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,96 @@
+import json
+import pstats
+import re
+import tempfile
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from mymath.models import Category, Exam, Question, RequestProfile
+from mymath.profiling import requested_mode
+
+
+class TestRequestedMode(SimpleTestCase):
+    def test_not_requested_does_not_touch_user(self):
+        # 指定がないときは request.user も読まない(RequestFactory のリクエストには user がない)
+        request = RequestFactory().get("/exam/1/1/?page=2")
+        self.assertIsNone(requested_mode(request))
+
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.profile_dir = Path(tmp.name)
+        settings_override = override_settings(MYMATH_PROFILE_DIR=tmp.name, MYMATH_PROFILE_KEEP=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=category)
+        Question.objects.create(exam=self.exam, text="1+1=?", select_1="1", select_2="2",
+                                select_3="3", select_4="4", answer=2)
+        User.objects.create_user(username="staff", password="pass", is_staff=True)
+        User.objects.create_user(username="testuser", password="pass")
+        self.url = reverse("mymath:index")
+
+    def test_ignored_for_non_staff(self):
+        self.client.get(f"{self.url}?_profile=1")
+        self.client.login(username="testuser", password="pass")
+        response = self.client.get(f"{self.url}?_profile=1")
+        self.assertNotIn("X-Mymath-Profile", response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_cprofile(self):
+        self.client.login(username="staff", password="pass")
+        response = self.client.get(f"{self.url}?_profile=1")
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(id=response["X-Mymath-Profile"])
+        self.assertEqual(profile.mode, "cprofile")
+        self.assertEqual(profile.view_name, "mymath:index")
+        self.assertGreater(profile.query_count, 0)
+        directory = Path(profile.directory)
+        self.assertEqual(directory.parent, self.profile_dir)
+        pstats.Stats(str(directory / "profile.prof")) # pstats で読み込める
+        sql = json.loads((directory / "sql.json").read_text())
+        self.assertEqual(len(sql), profile.query_count)
+        self.assertEqual(set(sql[0]), {"start_ms", "duration_ms", "alias", "many", "sql"})
+        # flamegraph.pl の形式 "関数;関数 数"
+        lines = (directory / "stacks.folded").read_text().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, r"^\S.* \d+$")
+
+    def test_sampling_by_header(self):
+        self.client.login(username="staff", password="pass")
+        response = self.client.get(reverse("mymath:exam", args=[self.exam.id, 1]),
+                                   HTTP_X_MYMATH_PROFILE="sample")
+        profile = RequestProfile.objects.get(id=response["X-Mymath-Profile"])
+        self.assertEqual(profile.mode, "sample")
+        self.assertFalse((Path(profile.directory) / "profile.prof").exists())
+        self.assertTrue((Path(profile.directory) / "stacks.folded").exists())
+
+    def test_only_mymath_and_accounts(self):
+        self.client.login(username="staff", password="pass")
+        response = self.client.get("/admin/?_profile=1")
+        self.assertNotIn("X-Mymath-Profile", response)
+        response = self.client.get(f"{reverse('accounts:login')}?_profile=1")
+        self.assertIn("X-Mymath-Profile", response)
+
+    def test_rotation(self):
+        self.client.login(username="staff", password="pass")
+        for _ in range(4):
+            self.client.get(f"{self.url}?_profile=1")
+        # 新しい2件だけ残し、古いディレクトリは削除する
+        self.assertEqual(RequestProfile.objects.count(), 2)
+        kept = {Path(p.directory) for p in RequestProfile.objects.all()}
+        self.assertEqual(set(self.profile_dir.iterdir()), kept)
+
+    def test_admin_list(self):
+        self.client.login(username="staff", password="pass")
+        self.client.get(f"{self.url}?_profile=1")
+        User.objects.filter(username="staff").update(is_superuser=True)
+        response = self.client.get(reverse("admin:mymath_requestprofile_changelist"))
+        self.assertContains(response, "mymath:index")
@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from mymath.management.commands.compact_attempts import empty_attempts
+from mymath.models import Category, Exam, Question, UserQuestionSelect, UserTestResult
+
+
+class TestQueryPlans(TestCase):
+    """よく使うクエリがテーブル全体を読まずにインデックスを使うことを EXPLAIN で確かめる
+
+    インデックスを消したり、クエリの条件を変えたりしてインデックスが使われなくなったときに失敗する。
+    SQLite は EXPLAIN QUERY PLAN の "SCAN <テーブル>"(インデックスなしの全件走査)、
+    PostgreSQL は enable_seqscan を off にしたうえでの "Seq Scan" を全件走査とみなす。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="カテゴリー１")
+        cls.exam = Exam.objects.create(title="テスト1", category=cls.category)
+        cls.question = Question.objects.create(
+            exam=cls.exam, text="1+1=?", select_1="1", select_2="2", select_3="3", select_4="4", answer=2)
+        cls.user = User.objects.create_user(username="testuser", password="pass")
+        cls.result = UserTestResult.objects.create(user=cls.user, exam=cls.exam, count=1)
+
+    def explain(self, queryset):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, table, index=None):
+        plan = self.explain(queryset)
+        if connection.vendor == "sqlite":
+            # "SCAN mymath_xxx USING COVERING INDEX" はインデックスだけの全件走査なので、これも失敗にする
+            scans = [line for line in plan.splitlines() if f"SCAN {table}" in line]
+            self.assertEqual(scans, [], f"{table} を全件走査しています:\n{plan}")
+            self.assertIn(f"SEARCH {table}", plan, plan)
+        elif connection.vendor == "postgresql":
+            self.assertNotIn(f"Seq Scan on {table}", plan, plan)
+        else:
+            self.skipTest(f"{connection.vendor} の実行計画は確認していません。")
+        if index is not None:
+            self.assertIn(index, plan, plan)
+        return plan
+
+    def test_latest_attempt(self):
+        # exam(): ユーザーとテストごとの最新の受験
+        queryset = UserTestResult.objects.filter(user=self.user, exam=self.exam).order_by("-count")[:1]
+        plan = self.assertUsesIndex(queryset, "mymath_usertestresult")
+        self.assertNotIn("TEMP B-TREE", plan) # インデックスの順に読むので並べ替えない
+
+    def test_question_by_number(self):
+        queryset = Question.objects.filter(exam=self.exam, number=1)
+        self.assertUsesIndex(queryset, "mymath_question")
+
+    def test_questions_of_exam(self):
+        # スナップショットの作成: テストの問題を番号順に
+        queryset = Question.objects.filter(exam=self.exam).order_by("number")
+        plan = self.assertUsesIndex(queryset, "mymath_question")
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_answers_of_attempt(self):
+        # result(): 受験結果の解答一覧は (test_result, question) の一意インデックスで引く
+        queryset = UserQuestionSelect.objects.filter(test_result=self.result).values_list(
+            "question_id", "select", "correct")
+        self.assertUsesIndex(queryset, "mymath_userquestionselect")
+
+    def test_exams_of_category(self):
+        queryset = Exam.objects.filter(category=self.category)
+        self.assertUsesIndex(queryset, "mymath_exam")
+
+    def test_history(self):
+        # mypage: ユーザーの受験履歴を新しい順に
+        queryset = UserTestResult.objects.filter(user=self.user).order_by("-submitted", "-id")[:20]
+        plan = self.assertUsesIndex(queryset, "mymath_usertestresult", "mymath_result_history_idx")
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_leaderboard(self):
+        queryset = UserTestResult.objects.filter(
+            exam=self.exam, count=1, finished__isnull=False).order_by("-score", "finished")[:10]
+        self.assertUsesIndex(queryset, "mymath_usertestresult", "mymath_result_ranking_idx")
+
+    def test_empty_attempts(self):
+        # compact_attempts: 解答のない古い受験結果は部分インデックスから探す
+        queryset = empty_attempts(timezone.now() - timedelta(days=1))
+        self.assertUsesIndex(queryset, "mymath_usertestresult", "mymath_result_empty_idx")
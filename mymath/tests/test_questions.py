@@ -0,0 +1,152 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from mymath.models import Category, Exam, Question, UserTestResult
+
+
+class TestQuestionNumber(TestCase):
+    """問題番号が飛んでいるときの挙動のテスト"""
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        for i in range(3):
+            Question.objects.create(
+                exam=self.exam,
+                text=f"text{i+1}",
+                select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+                answer=1)
+
+    def test_question_count(self):
+        self.exam.refresh_from_db()
+        self.assertEqual(self.exam.question_count, 3)
+        Question.objects.get(exam=self.exam, number=2).delete()
+        self.exam.refresh_from_db()
+        self.assertEqual(self.exam.question_count, 2)
+
+    def test_exam_with_gap(self):
+        Question.objects.get(exam=self.exam, number=2).delete()
+        response = self.client.get(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 3}))
+        self.assertContains(response, "text3")
+        response = self.client.get(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 2}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_answer_redirects_to_next_existing_number(self):
+        Question.objects.get(exam=self.exam, number=2).delete()
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1}),
+                         data={"question_1": 1})
+        response = self.client.post(reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": 1}))
+        self.assertRedirects(response, reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 3}))
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 3}),
+                         data={"question_3": 1})
+        response = self.client.get(reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": 3}))
+        self.assertTrue(response.context["is_last"])
+        response = self.client.post(reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": 3}))
+        self.assertRedirects(response, reverse("mymath:result", kwargs={"exam_id": self.exam.id}))
+
+    def test_admin_renumber_questions(self):
+        Question.objects.get(exam=self.exam, number=2).delete()
+        User.objects.create_superuser(username="admin", password="pass")
+        self.client.login(username="admin", password="pass")
+        self.client.post(reverse("admin:mymath_exam_changelist"),
+                         data={"action": "renumber_questions", "_selected_action": [self.exam.id]})
+        numbers = list(Question.objects.filter(exam=self.exam).values_list("number", flat=True))
+        self.assertEqual(numbers, [1, 2])
+        self.client.logout()
+        response = self.client.get(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 2}))
+        self.assertContains(response, "text3")
+
+
+    def test_admin_renumbers_in_two_phases(self):
+        Question.objects.get(exam=self.exam, number=1).delete()
+        User.objects.create_superuser(username="admin", password="pass")
+        self.client.login(username="admin", password="pass")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse("admin:mymath_exam_changelist"),
+                             data={"action": "renumber_questions", "_selected_action": [self.exam.id]})
+        # いったん今の最大の番号より大きい番号に移してから振り直すので、途中で番号が重ならない
+        updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "mymath_question"')]
+        self.assertEqual(len(updates), 2)
+        self.assertIn("THEN 5", updates[0])
+        numbers = list(Question.objects.filter(exam=self.exam).values_list("number", flat=True))
+        self.assertEqual(numbers, [1, 2])
+
+    def test_exam_starts_at_first_question(self):
+        # 1問目が削除されて番号を振り直していなくても、2問目から受験を始められる
+        Question.objects.get(exam=self.exam, number=1).delete()
+        url = reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1})
+        second = reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 2})
+        self.assertRedirects(self.client.get(url), second)
+        response = self.client.post(second, data={"question_2": 1})
+        self.assertRedirects(response, reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": 2}))
+        User.objects.create_user(username="testuser", password="pass")
+        self.client.login(username="testuser", password="pass")
+        self.assertContains(self.client.get(second), "text2")
+        self.client.post(second, data={"question_2": 1})
+        self.assertEqual(UserTestResult.objects.get().answered_count, 1)
+
+class TestQuestionNumbering(TestCase):
+    """問題番号の採番のテスト"""
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+
+    def make_question(self, text="text"):
+        return Question(
+            exam=self.exam,
+            text=text,
+            select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+            answer=1)
+
+    def test_save_uses_counter(self):
+        self.make_question().save()
+        self.make_question().save()
+        # 削除しても番号は再利用しない
+        Question.objects.get(exam=self.exam, number=2).delete()
+        question = self.make_question()
+        question.save()
+        self.assertEqual(question.number, 3)
+
+    def test_reserve_question_numbers(self):
+        self.assertEqual(list(Exam.objects.reserve_question_numbers(self.exam.id, 3)), [1, 2, 3])
+        self.assertEqual(list(Exam.objects.reserve_question_numbers(self.exam.id)), [4])
+
+    def test_bulk_create_numbered(self):
+        self.make_question().save()
+        other = Exam.objects.create(title="テスト2", category=self.category)
+        questions = [self.make_question(f"text{i}") for i in range(3)]
+        questions.append(Question(exam=other, text="other", select_1="1", select_2="2",
+                                  select_3="3", select_4="4", answer=2))
+        with self.assertNumQueries(13):
+            Question.objects.bulk_create_numbered(questions)
+        self.assertEqual([q.number for q in questions], [2, 3, 4, 1])
+        self.exam.refresh_from_db()
+        self.assertEqual(self.exam.question_count, 4)
+        self.assertEqual(self.exam.next_question_number, 5)
+        self.assertEqual(Question.objects.filter(exam=other).get().number, 1)
+
+    def test_stale_exam_save_keeps_counters(self):
+        stale = Exam.objects.get(id=self.exam.id)
+        self.make_question().save()
+        self.make_question().save()
+        stale.title = "テスト1(改)"
+        stale.save()
+        self.exam.refresh_from_db()
+        self.assertEqual(self.exam.title, "テスト1(改)")
+        self.assertEqual((self.exam.question_count, self.exam.next_question_number), (2, 3))
+        question = self.make_question()
+        question.save()
+        self.assertEqual(question.number, 3)
+
+    def test_admin_change_keeps_counters(self):
+        self.make_question().save()
+        User.objects.create_superuser(username="admin", password="pass")
+        self.client.login(username="admin", password="pass")
+        response = self.client.post(reverse("admin:mymath_exam_change", args=[self.exam.id]),
+                                    {"title": "変更", "category": self.category.id})
+        self.assertEqual(response.status_code, 302)
+        self.exam.refresh_from_db()
+        self.assertEqual((self.exam.title, self.exam.question_count, self.exam.next_question_number),
+                         ("変更", 1, 2))
@@ -0,0 +1,85 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from mymath.models import Category, Exam, ExamScoreBucket, Question, UserTestResult
+from mymath.ranking import LEADERBOARD_TIMEOUT, get_leaderboard, get_ranking
+
+
+class TestRanking(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.questions = []
+        for i in range(2):
+            self.questions.append(Question.objects.create(
+                exam=self.exam, text="text",
+                select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+                answer=1))
+        self.exam.refresh_from_db()
+
+    def take_exam(self, username, selects):
+        user, _ = User.objects.get_or_create(username=username)
+        result = UserTestResult.objects.start_attempt(user, self.exam)
+        for question, select in zip(self.questions, selects):
+            result.record_answer(question, select)
+        result.refresh_from_db()
+        return result
+
+    def test_histogram_updated_when_finished(self):
+        result = self.take_exam("user1", [1])
+        self.assertIsNone(result.finished)
+        self.assertFalse(ExamScoreBucket.objects.exists())
+        result.record_answer(self.questions[1], 1)
+        result.refresh_from_db()
+        self.assertIsNotNone(result.finished)
+        bucket = ExamScoreBucket.objects.get()
+        self.assertEqual((bucket.score, bucket.takers, bucket.first_attempt), (20, 1, True))
+
+    def test_get_ranking(self):
+        self.take_exam("user1", [1, 1]) # 20点
+        self.take_exam("user2", [1, 2]) # 10点
+        self.take_exam("user3", [1, 2]) # 10点
+        self.take_exam("user4", [2, 2]) # 0点
+        self.take_exam("user1", [2, 2]) # 2回目
+        self.assertEqual(get_ranking(self.exam.id, 20, first_attempt=True),
+                         {"rank": 1, "takers": 4, "top_percent": 25})
+        self.assertEqual(get_ranking(self.exam.id, 10, first_attempt=True)["rank"], 2)
+        self.assertEqual(get_ranking(self.exam.id, 0, first_attempt=False),
+                         {"rank": 4, "takers": 5, "top_percent": 80})
+
+    def test_leaderboard_is_invalidated(self):
+        self.take_exam("user1", [1, 2])
+        self.assertEqual(get_leaderboard(self.exam.id), [{"username": "user1", "score": 10}])
+        self.take_exam("user2", [1, 1])
+        self.assertEqual([e["username"] for e in get_leaderboard(self.exam.id)], ["user2", "user1"])
+
+    def test_leaderboard_expires(self):
+        # 別のプロセスで無効にしそこねても、期限がくれば作りなおす
+        cache.clear()
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            get_leaderboard(self.exam.id)
+        self.assertEqual(cache_set.call_args.args[2], LEADERBOARD_TIMEOUT)
+
+    def test_rebuild(self):
+        self.take_exam("user1", [1, 1])
+        self.take_exam("user2", [1, 1])
+        ExamScoreBucket.objects.update(takers=99)
+        call_command("rebuild_score_histogram", stdout=StringIO())
+        self.assertEqual(ExamScoreBucket.objects.get().takers, 2)
+
+    def test_result_page(self):
+        self.take_exam("user1", [1, 1])
+        User.objects.create_user(username="testuser", password="pass")
+        self.client.login(username="testuser", password="pass")
+        for number in (1, 2):
+            self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": number}),
+                             data={f"question_{number}": 2})
+        response = self.client.get(reverse("mymath:result", kwargs={"exam_id": self.exam.id}))
+        self.assertContains(response, "1回目の受験者2人の中で上位100%（2位）です")
+        self.assertContains(response, "user1 20点")
@@ -0,0 +1,186 @@
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.utils import load_backend
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from mymath.cache import clear_exam_cache
+from mymath.middleware import ReplicaStickinessMiddleware
+from mymath.models import Category, Exam, Question
+from mymath.routers import PrimaryReplicaRouter, request_scope, use_primary
+
+
+COOKIE = ReplicaStickinessMiddleware.COOKIE
+REPLICA_MIDDLEWARE = list(settings.MIDDLEWARE)
+REPLICA_MIDDLEWARE.insert(REPLICA_MIDDLEWARE.index("django.contrib.sessions.middleware.SessionMiddleware"),
+                          "mymath.middleware.ReplicaStickinessMiddleware")
+
+
+class TestRouter(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.enterContext(request_scope())
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Exam), "replica")
+        self.assertEqual(self.router.db_for_write(Category), "default")
+
+    def test_use_primary(self):
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Exam), "default")
+        self.assertEqual(self.router.db_for_read(Exam), "replica")
+
+    def test_reads_after_write_go_to_primary(self):
+        self.router.db_for_write(Question)
+        self.assertEqual(self.router.db_for_read(Exam), "default")
+
+    def test_sessions_always_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Session), "default")
+        self.router.db_for_write(Session)
+        self.assertEqual(self.router.db_for_read(Exam), "replica")
+
+    def test_migrate_only_primary(self):
+        self.assertTrue(self.router.allow_migrate("default", "mymath"))
+        self.assertFalse(self.router.allow_migrate("replica", "mymath"))
+
+
+class TestStickinessMiddleware(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.enterContext(request_scope())
+
+    def run_view(self, request, write=None):
+        seen = []
+
+        def view(request):
+            if write is not None:
+                self.router.db_for_write(write)
+            seen.append(self.router.db_for_read(Exam))
+            return HttpResponse()
+
+        response = ReplicaStickinessMiddleware(view)(request)
+        return seen[0], response
+
+    def test_get_reads_replica(self):
+        db, response = self.run_view(self.factory.get("/"))
+        self.assertEqual(db, "replica")
+        self.assertNotIn(COOKIE, response.cookies)
+
+    def test_post_pins_primary(self):
+        db, response = self.run_view(self.factory.post("/"))
+        self.assertEqual(db, "default")
+        self.assertEqual(response.cookies[COOKIE]["max-age"], settings.MYMATH_REPLICA_STICKY_SECONDS)
+        # リクエストが終わったら元に戻る
+        self.assertEqual(self.router.db_for_read(Exam), "replica")
+
+    def test_cookie_pins_primary_without_extending(self):
+        request = self.factory.get("/")
+        request.COOKIES[COOKIE] = "1"
+        db, response = self.run_view(request)
+        self.assertEqual(db, "default")
+        self.assertNotIn(COOKIE, response.cookies)
+
+    def test_write_in_get_sets_cookie(self):
+        db, response = self.run_view(self.factory.get("/"), write=Question)
+        self.assertEqual(db, "default")
+        self.assertIn(COOKIE, response.cookies)
+
+    def test_session_write_does_not_set_cookie(self):
+        db, response = self.run_view(self.factory.get("/"), write=Session)
+        self.assertEqual(db, "replica")
+        self.assertNotIn(COOKIE, response.cookies)
+
+
+@override_settings(DATABASE_ROUTERS=["mymath.routers.PrimaryReplicaRouter"], MIDDLEWARE=REPLICA_MIDDLEWARE)
+class TestReplicaRouting(TransactionTestCase):
+    """テスト用のDBにもう1つ接続を開いてレプリカの代わりにし、どちらの接続で読んだかを確かめる"""
+
+    def setUp(self):
+        cache.clear()
+        clear_exam_cache()
+        category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=category)
+        for i in range(2):
+            Question.objects.create(exam=self.exam, text=f"問題{i + 1}", select_1="1", select_2="2",
+                                    select_3="3", select_4="4", answer=1)
+        self.user = User.objects.create_user(username="testuser", password="pass", is_staff=True,
+                                             is_superuser=True)
+
+        # settings の DATABASES に加えずに登録するので、テストのDB接続の制限を受けない
+        settings_dict = dict(connections["default"].settings_dict)
+        connections["replica"] = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(settings_dict, "replica")
+        self.addCleanup(self.close_replica)
+        # setUp で書き込んだので、振り分けの状態を作り直す
+        self.enterContext(request_scope())
+        self.queries = []
+        stack = self.enterContext(ExitStack())
+        for alias in ("default", "replica"):
+            stack.enter_context(connections[alias].execute_wrapper(self.record))
+
+    def close_replica(self):
+        connections["replica"].close()
+        del connections["replica"]
+
+    def record(self, execute, sql, params, many, context):
+        self.queries.append((context["connection"].alias, sql))
+        return execute(sql, params, many, context)
+
+    def aliases(self, table):
+        """table を読んだ接続"""
+        return {alias for alias, sql in self.queries
+                if sql.lstrip().upper().startswith("SELECT") and f'"{table}"' in sql}
+
+    def get(self, url):
+        self.queries.clear()
+        return self.client.get(url)
+
+    def test_logged_in_flow(self):
+        self.client.force_login(self.user)
+        self.client.cookies.pop(COOKIE, None)
+        response = self.get(reverse("mymath:index"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.aliases("auth_user"), {"replica"})
+        self.assertEqual(self.aliases("django_session"), {"default"})
+
+        for number in (1, 2):
+            response = self.client.post(reverse("mymath:exam", args=[self.exam.id, number]),
+                                        {f"question_{number}": 1})
+            self.assertIn(COOKIE, response.cookies)
+            # 書き込んだ直後の答え合わせはプライマリーから読む
+            self.get(reverse("mymath:answer", args=[self.exam.id, number]))
+            self.assertEqual(self.aliases("mymath_userquestionselect"), {"default"})
+            self.client.post(reverse("mymath:answer", args=[self.exam.id, number]))
+        response = self.get(reverse("mymath:result", args=[self.exam.id]))
+        self.assertEqual(response.context["user_result"].score, 20)
+        self.assertEqual(self.aliases("mymath_usertestresult"), {"default"})
+
+        # 固定の時間が過ぎたら(Cookie が消えたら)レプリカから読む
+        self.client.cookies.pop(COOKIE)
+        self.get(reverse("mymath:answer", args=[self.exam.id, 2]))
+        self.assertEqual(self.aliases("mymath_userquestionselect"), {"replica"})
+        response = self.get(reverse("mymath:mypage"))
+        self.assertEqual(len(response.context["attempts"]), 1)
+        self.assertEqual(self.aliases("mymath_usertestresult"), {"replica"})
+        self.get(reverse("admin:mymath_exam_changelist"))
+        self.assertEqual(self.aliases("mymath_exam"), {"replica"})
+
+    def test_cache_fill_reads_primary(self):
+        self.get(reverse("mymath:exam", args=[self.exam.id, 1]))
+        self.assertEqual(self.aliases("mymath_question"), {"default"})
+        self.get(reverse("mymath:index"))
+        self.assertEqual(self.aliases("mymath_exam"), {"default"})
+
+    def test_reads_in_transaction_use_primary(self):
+        Exam.objects.get(id=self.exam.id)
+        self.assertEqual(self.aliases("mymath_exam"), {"replica"})
+        self.queries.clear()
+        with transaction.atomic():
+            Exam.objects.get(id=self.exam.id)
+        self.assertEqual(self.aliases("mymath_exam"), {"default"})
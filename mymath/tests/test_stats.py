@@ -0,0 +1,53 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from mymath.models import Category, Exam, Question, QuestionStats, UserTestResult
+
+
+class TestQuestionStats(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.question = Question.objects.create(
+            exam=self.exam, text="text",
+            select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+            answer=1)
+        self.users = [User.objects.create_user(username=f"user{i}", password="pass") for i in range(4)]
+
+    def answer_all(self, selects):
+        for user, select in zip(self.users, selects):
+            UserTestResult.objects.start_attempt(user, self.exam).record_answer(self.question, select)
+
+    def test_incremental(self):
+        self.answer_all([1, 1, 3, 1])
+        stats = QuestionStats.objects.get(question=self.question)
+        self.assertEqual(stats.answered, 4)
+        self.assertEqual(stats.correct, 3)
+        self.assertEqual(stats.correct_rate, 75)
+        self.assertEqual(stats.select_rates(), [75, 0, 25, 0])
+
+    def test_rebuild(self):
+        self.answer_all([1, 2, 2, 4])
+        QuestionStats.objects.all().delete()
+        call_command("rebuild_question_stats", stdout=StringIO())
+        stats = QuestionStats.objects.get(question=self.question)
+        self.assertEqual((stats.answered, stats.correct, stats.select_2_count), (4, 1, 2))
+
+    def test_answer_page_shows_rate(self):
+        self.answer_all([1, 2])
+        self.client.login(username="user2", password="pass")
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1}),
+                         data={"question_1": 1})
+        response = self.client.get(reverse("mymath:answer", kwargs={"exam_id": self.exam.id, "number": 1}))
+        self.assertContains(response, "67%の生徒が正解しています")
+
+    def test_admin_list(self):
+        self.answer_all([1, 2])
+        User.objects.create_superuser(username="admin", password="pass")
+        self.client.login(username="admin", password="pass")
+        response = self.client.get(reverse("admin:mymath_question_changelist"))
+        self.assertContains(response, "50%")
@@ -0,0 +1,230 @@
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from mymath.cache import clear_exam_cache, get_version_snapshot
+from mymath.models import Category, Exam, ExamVersion, Question, UserTestResult
+
+
+class TestExamVersions(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_exam_cache()
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        self.questions = [
+            Question.objects.create(exam=self.exam, text=f"問題{i + 1}", select_1="1", select_2="2",
+                                    select_3="3", select_4="4", answer=1)
+            for i in range(3)]
+        self.user = User.objects.create_user(username="testuser", password="pass")
+        self.client.login(username="testuser", password="pass")
+
+    def post(self, number, select):
+        return self.client.post(reverse("mymath:exam", args=[self.exam.id, number]),
+                                {f"question_{number}": select})
+
+    def edit(self, question, **fields):
+        for name, value in fields.items():
+            setattr(question, name, value)
+        question.save()
+
+    def test_publish_is_content_addressed(self):
+        version = ExamVersion.objects.publish(self.exam)
+        self.assertEqual(len(version.digest), 64)
+        self.assertEqual([q["number"] for q in version.content["questions"]], [1, 2, 3])
+        # 内容が同じなら同じ版
+        self.assertEqual(ExamVersion.objects.publish(self.exam), version)
+        self.edit(self.questions[0], text="変更")
+        new_version = ExamVersion.objects.publish(self.exam)
+        self.assertNotEqual(new_version.digest, version.digest)
+        self.exam.refresh_from_db()
+        self.assertEqual(self.exam.published_version, new_version)
+
+    def test_attempt_keeps_its_version(self):
+        version = ExamVersion.objects.publish(self.exam)
+        self.post(1, 1)
+        self.assertEqual(UserTestResult.objects.get().exam_version, version)
+        # 受験中に問題2の内容と正解を変える
+        self.edit(self.questions[1], text="変更した問題", answer=3)
+        ExamVersion.objects.publish(self.exam)
+        response = self.client.get(reverse("mymath:exam", args=[self.exam.id, 2]))
+        self.assertContains(response, "問題2")
+        self.post(2, 1)
+        response = self.client.get(reverse("mymath:answer", args=[self.exam.id, 2]))
+        self.assertEqual(response.context["question"].answer, 1)
+        self.assertTrue(response.context["useranswer"].correct)
+        self.post(3, 1)
+        response = self.client.get(reverse("mymath:result", args=[self.exam.id]))
+        self.assertEqual(response.context["user_result"].score, 30)
+        self.assertEqual([a.question.text for a in response.context["useranswers"]], ["問題1", "問題2", "問題3"])
+        # 新しく始めた受験は公開しなおした版で出題する
+        self.post(1, 1)
+        response = self.client.get(reverse("mymath:exam", args=[self.exam.id, 2]))
+        self.assertContains(response, "変更した問題")
+
+    def test_unpublished_exam_uses_current_questions(self):
+        self.post(1, 1)
+        self.assertIsNone(UserTestResult.objects.get().exam_version)
+        self.edit(self.questions[1], text="変更した問題")
+        response = self.client.get(reverse("mymath:exam", args=[self.exam.id, 2]))
+        self.assertContains(response, "変更した問題")
+
+    def test_version_snapshot_is_kept(self):
+        version = ExamVersion.objects.publish(self.exam)
+        snapshot = get_version_snapshot(version.id)
+        self.assertEqual(snapshot.question(2).text, "問題2")
+        self.edit(self.questions[1], text="変更")
+        # 版の内容は変わらないので、問題を変更してもクエリなしで同じものを返す
+        with self.assertNumQueries(0):
+            self.assertIs(get_version_snapshot(version.id), snapshot)
+
+    def test_deleting_question_unpublishes(self):
+        ExamVersion.objects.publish(self.exam)
+        self.questions[2].delete()
+        self.exam.refresh_from_db()
+        self.assertIsNone(self.exam.published_version)
+
+    def test_deleted_question_is_not_recorded(self):
+        ExamVersion.objects.publish(self.exam)
+        self.post(1, 1)
+        # 受験中に問題2を削除しても、版で受験しているので問題2は出題される
+        self.questions[1].delete()
+        self.assertContains(self.client.get(reverse("mymath:exam", args=[self.exam.id, 2])), "問題2")
+        # 解答は記録できないので404にして、行のない問題への解答を作らない
+        self.assertEqual(self.post(2, 1).status_code, 404)
+        self.assertEqual(UserTestResult.objects.get().answered_count, 1)
+        self.assertEqual(self.post(3, 1).status_code, 302)
+
+    def test_attempt_finishes_with_version_question_count(self):
+        ExamVersion.objects.publish(self.exam)
+        # 公開したあとに問題を追加しても、版の3問に答えれば終了する
+        Question.objects.create(exam=self.exam, text="問題4", select_1="1", select_2="2",
+                                select_3="3", select_4="4", answer=1)
+        self.post(1, 1)
+        self.post(2, 1)
+        response = self.client.get(reverse("mymath:mypage"))
+        self.assertContains(response, "2/3問解答")
+        self.post(3, 1)
+        attempt = UserTestResult.objects.get()
+        self.assertIsNotNone(attempt.finished)
+        # 終了日時がないときは rebuild_score_histogram で版の問題数にあわせて補う
+        UserTestResult.objects.update(finished=None)
+        call_command("rebuild_score_histogram", stdout=StringIO())
+        attempt.refresh_from_db()
+        self.assertIsNotNone(attempt.finished)
+
+    def test_api_submit_skips_deleted_questions(self):
+        snapshot = get_version_snapshot(ExamVersion.objects.publish(self.exam).id)
+        self.questions[1].delete()
+        # 別のプロセスではまだ削除前の版のスナップショットを使っていることがある。
+        # 削除した問題の解答は保存せず、採点にも含めない
+        with mock.patch("mymath.api.get_attempt_snapshot_or_404", return_value=snapshot):
+            response = self.client.post(reverse("mymath:api_exam_submit", args=[self.exam.id]),
+                                        data={"selections": {"1": 1, "2": 1, "3": 1}},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["number"] for r in response.json()["results"]], [1, 3])
+        attempt = UserTestResult.objects.get()
+        self.assertEqual((attempt.answered_count, attempt.score), (2, 20))
+
+    def test_admin_publish(self):
+        User.objects.create_superuser(username="admin", password="pass")
+        self.client.login(username="admin", password="pass")
+        self.client.post(reverse("admin:mymath_exam_changelist"),
+                         data={"action": "publish", "_selected_action": [self.exam.id]})
+        self.exam.refresh_from_db()
+        self.assertEqual(self.exam.published_version.exam, self.exam)
+
+    def test_archive_uses_version_numbers(self):
+        ExamVersion.objects.publish(self.exam)
+        for number in (1, 2, 3):
+            self.post(number, number)
+        attempt = UserTestResult.objects.get()
+        # 問題1を削除して番号を振り直しても、版で受験した結果は版の番号のまま
+        self.questions[0].delete()
+        UserTestResult.objects.archive_answers([attempt.id])
+        User.objects.create_superuser(username="admin", password="pass")
+        self.client.login(username="admin", password="pass")
+        self.client.post(reverse("admin:mymath_exam_changelist"),
+                         data={"action": "renumber_questions", "_selected_action": [self.exam.id]})
+        attempt.refresh_from_db()
+        questions = get_version_snapshot(attempt.exam_version_id).questions
+        self.assertEqual([(a.question.number, a.select) for a in attempt.archived_answers(questions)],
+                         [(2, 2), (3, 3)])
+        call_command("rebuild_question_stats", stdout=StringIO())
+        self.assertEqual(self.questions[2].stats.select_3_count, 1)
+
+    @override_settings(ROOT_URLCONF="djangomath.urls_async")
+    async def test_async_views(self):
+        await self.async_client.aforce_login(self.user)
+        await sync_to_async(ExamVersion.objects.publish)(self.exam)
+        await self.async_client.post(reverse("mymath:exam", args=[self.exam.id, 1]), {"question_1": 1})
+        await sync_to_async(self.edit)(self.questions[0], text="変更した問題", answer=2)
+        await sync_to_async(ExamVersion.objects.publish)(self.exam)
+        response = await self.async_client.get(reverse("mymath:answer", args=[self.exam.id, 1]))
+        self.assertEqual(response.context["question"].text, "問題1")
+        self.assertTrue(response.context["useranswer"].correct)
+        response = await self.async_client.get(reverse("mymath:result", args=[self.exam.id]))
+        self.assertEqual([a.question.text for a in response.context["useranswers"]], ["問題1"])
+
+
+class TestVersionApi(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_exam_cache()
+        self.exam = Exam.objects.create(title="テスト1", category=Category.objects.create(name="カテゴリー１"))
+        for i in range(2):
+            Question.objects.create(exam=self.exam, text=f"問題{i + 1}", select_1="1", select_2="2",
+                                    select_3="3", select_4="4", answer=2, answer_text=f"解説{i + 1}")
+
+    def test_exam_detail_has_version(self):
+        url = reverse("mymath:api_exam", args=[self.exam.id])
+        self.assertIsNone(self.client.get(url).json()["version"])
+        version = ExamVersion.objects.publish(self.exam)
+        self.assertEqual(self.client.get(url).json()["version"], version.digest)
+
+    def test_version_is_immutable(self):
+        version = ExamVersion.objects.publish(self.exam)
+        response = self.client.get(reverse("mymath:api_version", args=[version.digest]))
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response["ETag"], f'"{version.digest}"')
+        data = response.json()
+        self.assertEqual([q["text"] for q in data["questions"]], ["問題1", "問題2"])
+        self.assertNotIn("answer", data["questions"][0])
+        response = self.client.get(reverse("mymath:api_version", args=[version.digest]),
+                                   headers={"if-none-match": f'"{version.digest}"'})
+        self.assertEqual(response.status_code, 304)
+
+    def test_version_answers_after_finishing(self):
+        version = ExamVersion.objects.publish(self.exam)
+        url = reverse("mymath:api_version_answers", args=[version.digest])
+        # 未ログインでも、受験を終えていないユーザーでも正解は見られない
+        self.assertEqual(self.client.get(url).status_code, 403)
+        user = User.objects.create_user(username="student", password="pass")
+        self.client.login(username="student", password="pass")
+        attempt = UserTestResult.objects.start_attempt(user, self.exam, version.id)
+        attempt.record_answer(Question.objects.get(exam=self.exam, number=1), 2)
+        response = self.client.get(url, headers={"if-none-match": f'"{version.digest}"'})
+        self.assertEqual(response.status_code, 403)
+        attempt.record_answer(Question.objects.get(exam=self.exam, number=2), 2)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "private, max-age=31536000, immutable")
+        self.assertEqual(response.json()["answers"][1], {"number": 2, "answer": 2, "answer_text": "解説2"})
+
+    def test_version_answers_for_staff(self):
+        version = ExamVersion.objects.publish(self.exam)
+        User.objects.create_user(username="staff", password="pass", is_staff=True)
+        self.client.login(username="staff", password="pass")
+        response = self.client.get(reverse("mymath:api_version_answers", args=[version.digest]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_version(self):
+        response = self.client.get(reverse("mymath:api_version", args=["0" * 64]))
+        self.assertEqual(response.status_code, 404)
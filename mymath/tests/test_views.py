@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
 
@@ -144,6 +146,19 @@ class TestExamLogin(TestCase):
         self.assertRedirects(response, reverse("mymath:exam",
                                             kwargs={"exam_id": self.exam.id, "number":1}))
 
+    def test_post_invalid_select(self):
+        # 1〜4以外や数字でない値は記録せずに同じ問題に戻す
+        self.client.login(username="testuser", password="pass")
+        url = reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1})
+        for value in ("5", "0", "abc"):
+            response = self.client.post(url, data={"question_1": value})
+            self.assertRedirects(response, url)
+        self.assertFalse(UserQuestionSelect.objects.exists())
+        self.client.logout()
+        response = self.client.post(url, data={"question_1": "5"})
+        self.assertRedirects(response, url)
+        self.assertNotIn("exam", self.client.session)
+
 
 class TestExamResultLogin(TestCase):
     """ログイン中のリザルトまでのテスト"""
@@ -397,4 +412,53 @@ class TestResultExamAnonymous(TestCase):
                 self.assertEqual(response3.context["useranswers"][0]["question"]["number"], 1)
         
 
-               
\ No newline at end of file
+               
+
+class TestScoreCount(TestCase):
+    """解答の記録時に点数が加算されることのテスト"""
+    def setUp(self):
+        self.category = Category.objects.create(name="カテゴリー１")
+        self.exam = Exam.objects.create(title="テスト1", category=self.category)
+        for i in range(2):
+            Question.objects.create(
+                exam=self.exam,
+                text="text",
+                select_1="select1", select_2="select2", select_3="select3", select_4="select4",
+                answer=1)
+        self.user = User.objects.create_user(username="testuser", password="pass")
+        self.client.login(username="testuser", password="pass")
+
+    def test_counts_updated_once(self):
+        url = reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1})
+        self.client.post(url, data={"question_1": 1})
+        # 同じ問題に2回目の解答を送っても加算されない
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 2}),
+                         data={"question_2": 1})
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 2}),
+                         data={"question_2": 2})
+        user_tr = UserTestResult.objects.get()
+        self.assertEqual(user_tr.answered_count, 2)
+        self.assertEqual(user_tr.correct_count, 2)
+        self.assertEqual(user_tr.score, 20)
+
+    def test_result_does_not_write(self):
+        self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": 1}),
+                         data={"question_1": 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("mymath:result", kwargs={"exam_id": self.exam.id}))
+        self.assertContains(response, "10点")
+        writes = [q["sql"] for q in queries if q["sql"].startswith(("UPDATE \"mymath", "INSERT"))]
+        self.assertEqual(writes, [])
+
+    def test_deleting_answers_subtracts(self):
+        for number, select in ((1, 1), (2, 2)):
+            self.client.post(reverse("mymath:exam", kwargs={"exam_id": self.exam.id, "number": number}),
+                             data={f"question_{number}": select})
+        # 管理サイトなどで解答を削除すると、その分を引く
+        UserQuestionSelect.objects.get(select=2).delete()
+        user_tr = UserTestResult.objects.get()
+        self.assertEqual((user_tr.answered_count, user_tr.correct_count, user_tr.score), (1, 1, 10))
+        # 問題の削除で解答が削除されたときも引く
+        Question.objects.get(number=1).delete()
+        user_tr.refresh_from_db()
+        self.assertEqual((user_tr.answered_count, user_tr.correct_count, user_tr.score), (0, 0, 0))
@@ -1,12 +1,31 @@
+from django.conf import settings
 from django.urls import path, include
 
-from . import views
+from . import api, async_views, views
 
 app_name = "mymath"
 
-urlpatterns = [
-    path("", views.index, name="index"),
-    path("exam/<int:exam_id>/<int:number>/", views.exam, name="exam"),    
-    path("exam/<int:exam_id>/<int:number>/answer/", views.answer, name="answer"),
-    path("exam/<int:exam_id>/result/", views.result, name="result"),
-]
\ No newline at end of file
+
+def build_urlpatterns(use_async=False):
+    # MYMATH_ASYNC_VIEWS が True のときは受験の流れのページだけ非同期版(async_views.py)を使う
+    if use_async:
+        index, exam, answer, result = (
+            async_views.aindex, async_views.aexam, async_views.aanswer, async_views.aresult)
+    else:
+        index, exam, answer, result = views.index, views.exam, views.answer, views.result
+    return [
+        path("", index, name="index"),
+        path("exam/<int:exam_id>/<int:number>/", exam, name="exam"),    
+        path("exam/<int:exam_id>/<int:number>/answer/", answer, name="answer"),
+        path("exam/<int:exam_id>/result/", result, name="result"),
+        path("mypage/", views.mypage, name="mypage"),
+        path("export/<str:kind>/", views.export, name="export"),
+        path("api/exam/<int:exam_id>/", api.exam_detail, name="api_exam"),
+        path("api/exam/<int:exam_id>/submit/", api.exam_submit, name="api_exam_submit"),
+        path("api/version/<slug:digest>/", api.version_detail, name="api_version"),
+        path("api/version/<slug:digest>/answers/", api.version_answers, name="api_version_answers"),
+        path("metrics", views.metrics, name="metrics"),
+    ]
+
+
+urlpatterns = build_urlpatterns(settings.MYMATH_ASYNC_VIEWS)
@@ -0,0 +1,51 @@
+"""公開した試験内容(ExamVersion)の形式
+
+管理サイトで Exam を「公開」すると、そのときの Exam と Question を次の形の JSON にして
+ExamVersion に保存する。保存した内容は変更しない。
+
+    {"exam": {"id": 1, "title": "...", "category_id": 1},
+     "questions": [{"id": 3, "number": 1, "text": "...", "select_1": "...", ...,
+                    "answer": 2, "answer_text": "..."}, ...]}
+
+digest は内容の sha256 で、同じ内容を公開しなおしたときは同じ ExamVersion を使う。
+受験結果(UserTestResult.exam_version)は受験を始めたときの版を記録するので、
+公開したあとに問題を編集しても、受験中の問題や答え合わせの内容は変わらない。
+内容が変わらないので、版ごとのスナップショットは無効にせずにプロセス内に持ち続け(cache.py)、
+API(api.py)では digest のURLで期限の長いキャッシュヘッダーをつけて返す。
+"""
+import hashlib
+import json
+
+
+QUESTION_FIELDS = ("id", "number", "text", "select_1", "select_2", "select_3", "select_4",
+                   "answer", "answer_text")
+
+
+def exam_content(exam, questions):
+    """exam と問題番号順の questions を ExamVersion.content の形の辞書にする"""
+    return {
+        "exam": {"id": exam.id, "title": exam.title, "category_id": exam.category_id},
+        "questions": [{name: getattr(question, name) for name in QUESTION_FIELDS}
+                      for question in questions],
+    }
+
+
+def content_digest(content):
+    """内容の sha256(16進数)。キーの順や空白で変わらないように並べてから計算する"""
+    data = json.dumps(content, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def answers_for(answers, questions):
+    """解答(UserQuestionSelect)を questions の順に並べ、answer.question を questions の問題にする
+
+    版で受験した結果を、版の問題番号と内容で表示するときに使う。
+    """
+    by_question = {answer.question_id: answer for answer in answers}
+    ordered = []
+    for question in questions:
+        answer = by_question.get(question.id)
+        if answer is not None:
+            answer.question = question
+            ordered.append(answer)
+    return ordered
@@ -1,105 +1,133 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import Http404
+from django.db.models import Case, Q, Value, When
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.views.decorators.http import condition
 
-from .models import Exam, Question, UserQuestionSelect, UserTestResult
+from .anonymous import load_exam_state, new_state, save_exam_state
+from .answer_buffer import buffered_answer, flush_answers
+from .cache import get_attempt_snapshot_or_404, get_index_version
+from .exports import EXPORTS, iter_export
+from .forms import ExportFilterForm
+from .metrics import render_metrics
+from .models import (
+    POINTS_PER_QUESTION, Category, Exam, Question, QuestionStats, UserQuestionSelect, UserTestResult,
+    question_total,
+)
+from .ranking import get_leaderboard, get_ranking
+from .routers import use_primary
+from .versions import answers_for
 
 
+def _index_etag(request):
+    # 未ログインのときは誰が見ても同じページなので、ETagで304を返せるようにする。
+    # ログイン中やメッセージがあるときはページが変わるので条件付きGETにしない
+    if request.user.is_authenticated or len(messages.get_messages(request)):
+        return None
+    version, _ = get_index_version()
+    return f'"index-{version}"'
+
+
+def _index_last_modified(request):
+    if request.user.is_authenticated or len(messages.get_messages(request)):
+        return None
+    _, last_modified = get_index_version()
+    return last_modified
+
+
+@condition(etag_func=_index_etag, last_modified_func=_index_last_modified)
 def index(request):
-    exams = Exam.objects.all()
-    
-    return render(request, "mymath/index.html",
-                 {"exams": exams})
+    # 学年区分 → カテゴリーの順にまとめて表示する。
+    # クエリはテンプレートの断片キャッシュがないときだけ実行される
+    grade_order = Case(
+        *[When(category__grade=grade, then=Value(i))
+          for i, (grade, _) in enumerate(Category.GRADE_CHOICES)],
+        default=Value(len(Category.GRADE_CHOICES)))
+    exams = Exam.objects.select_related("category").order_by(
+        grade_order, "category__name", "category_id", "id")
+    index_version, _ = get_index_version()
+    # 断片キャッシュを作るときはプライマリーから読む(cache.py)
+    with use_primary():
+        return render(request, "mymath/index.html",
+                     {"exams": exams,
+                      "index_version": index_version})
+
+def parse_select(value):
+    """POSTされた選択を1〜4のintにする。未選択や範囲外、数字でないときは None"""
+    try:
+        select = int(value)
+    except (TypeError, ValueError):
+        return None
+    return select if 1 <= select <= 4 else None
+
 
 def exam(request, exam_id, number=1):
     # /exam/<exam_id>/1~ exam/<exam_id>/10までのexamをできるようにする。
     # /exam/<exam_id>/<number>となるようにurls.pyも指定する
-    exam = get_object_or_404(Exam, id=exam_id)
-    questions = Question.objects.filter(exam=exam).order_by("number")
-    total = len(questions) # 問題数を取得
-    if not (1 <= number <= total):
+    usertestresult = None
+    # 受験は最初の問題から始める。1問目が削除されていても、トップページの1問目へのリンクから始められるようにする
+    snapshot = get_attempt_snapshot_or_404(exam_id)
+    if number == 1 and snapshot.question(1) is None and snapshot.first_number is not None:
+        return redirect("mymath:exam", exam_id=exam_id, number=snapshot.first_number)
+    if request.user.is_authenticated and number != snapshot.first_number:
+        usertestresult = get_object_or_404(UserTestResult, id=request.session.get("current_usertestresult_id"))
+        # 受験中は受験を始めたときの版、それ以外は公開中の版で出題する(versions.py)
+        snapshot = get_attempt_snapshot_or_404(exam_id, usertestresult)
+    exam = snapshot.exam
+    question = snapshot.question(number) # 問題番号から直接取得する
+    if question is None:
         raise Http404("問題番号が正しくありません。")
-    question = questions[number-1] # number=1 としているので先頭のインデックを0にする
     
         
     # 最初に未ログインユーザーの処理を行う
-    # request.session["exam"] = {"exam_id":1,
-    #                            "question_select": {1:1, 2:1, ... ,10:2},
-    #                            "answer_correct": {1:True, 2:False, ... , 10, True}}
-    # このような形で保存                          
+    # 受験状況は {"exam_id":1,
+    #            "question_select": {1:1, 2:1, ... ,10:2},
+    #            "answer_correct": {1:True, 2:False, ... , 10, True}}
+    # このような形でセッション(またはCookie)に保存する。詳しくは anonymous.py
     if not request.user.is_authenticated:
-        if number == 1:
-            # 一問目のときにセッション作成
-            session_exam = request.session.setdefault(
-                "exam", {
-                    "exam_id": exam_id,
-                    "question_select": {},
-                    "answer_correct": {},
-                        })
         if request.method == "POST":
-            user_select_str = request.POST.get(f"question_{question.number}")
-            if not user_select_str:
+            user_select = parse_select(request.POST.get(f"question_{question.number}"))
+            if user_select is None:
                 messages.warning(request, "番号をえらんでから次へを押してください")
                 return redirect("mymath:exam", exam_id=exam_id, number=number)
-            user_select = int(user_select_str)
-            session_exam = request.session.get("exam")
-            session_exam["question_select"][str(number)] = user_select
-            if user_select == question.answer:
-                session_exam["answer_correct"][str(number)] = True
-            else:
-                session_exam["answer_correct"][str(number)] = False
-            # DjangoのセッションはJSONでシリアライズ化されて保存されるので、
-            # キーのnumber が 1 のとき "1"として保存される。
-            # 値を取り出すときはstr(number)としなければKeyErrorが発生する。
-            # ここでは保存するときも一応str(number)として保存
-            
-            request.session["exam"] = session_exam
-            # print(session_exam)
-            # print(number)
-            # print(session_exam["question_select"])
-            # print(session_exam["answer_correct"])
-            return redirect("mymath:answer", exam_id=exam_id, number=number)
+            exam_state = load_exam_state(request)
+            if number == snapshot.first_number or not exam_state or exam_state["exam_id"] != exam_id:
+                # 一問目の解答のときに受験状況を作成する
+                exam_state = new_state(exam_id)
+            # キーは保存するときも取り出すときもstr(number)とする
+            exam_state["question_select"][str(number)] = user_select
+            exam_state["answer_correct"][str(number)] = user_select == question.answer
+            response = redirect("mymath:answer", exam_id=exam_id, number=number)
+            return save_exam_state(request, response, exam_state)
     
 
     else:  # ログインユーザーの処理
-        if number == 1: # numberが1のときつまり第一問目のときはUserTestResultオブジェクトを作成する
-            last_result = UserTestResult.objects.filter(
-                user=request.user,
-                exam=exam,).order_by('-count').first() # userがexamを最後に行ったデータをさがし、あったとき、なかった時の処理を書く
-            if last_result:
-                next_count = last_result.count + 1
-            else:
-                next_count = 1
-            usertestresult = UserTestResult.objects.create(
-                    user=request.user,
-                    exam=exam,
-                    count=next_count)
-            request.session["current_usertestresult_id"] = usertestresult.id # セッションに保存
-        else:
-            usertestresult = get_object_or_404(UserTestResult, id=request.session.get("current_usertestresult_id"))
-                
+        # UserTestResultは第一問目の解答を送ったときに作成する。
+        # GETやリロード、戻るボタンでは作成しないので、解答のない受験結果が増えない
+        # 2問目からの受験結果は最初に取得してある
         if request.method == "POST": # POSTの処理
-            user_select_str = request.POST.get(f"question_{question.number}")
-            # ここでint(request.POST.get(f"question_{question.number}"))とすると
-            # 選択しないでpostするとint(NoneType)でTypeErrorが起きるので、まずはstrで取得して
-            # 未選択時の処理をおこなう
-            if not user_select_str:
+            # 未選択のときや1〜4以外の値が送られたときは、記録せずに同じ問題に戻す
+            # (範囲外の選択は集計の列がないので、記録すると集計でエラーになる)
+            user_select = parse_select(request.POST.get(f"question_{question.number}"))
+            if user_select is None:
                 messages.warning(request, "番号をえらんでから次へを押してください")
                 return redirect("mymath:exam", exam_id=exam_id, number=number)
-            user_select = int(user_select_str)
             # ユーザーの解答を取得する
-            if user_select == question.answer:
-                correct = True
-            else:
-                correct = False
-            # 正解の判定
-            # UserQuestionSelectオブジェクトを作成し、解答を記録する
-            UserQuestionSelect.objects.get_or_create(
-                test_result=usertestresult,
-                question=question,
-                defaults={'select': user_select, 'correct': correct}
-                )
+            if number == snapshot.first_number: # 第一問目のときはUserTestResultオブジェクトを作成する
+                # 1問目の送りなおしでは、まだ先に進んでいない受験結果をそのまま使う
+                usertestresult = UserTestResult.objects.resume_or_start(
+                    request.user, exam, question, request.session.get("current_usertestresult_id"),
+                    snapshot.exam_version_id)
+                request.session["current_usertestresult_id"] = usertestresult.id # セッションに保存
+            # UserQuestionSelectオブジェクトを作成し、解答を記録する。正解の判定と点数の加算もここで行う
+            try:
+                usertestresult.record_answer(question, user_select)
+            except Question.DoesNotExist: # 受験中に削除された問題
+                raise Http404("問題が見つかりません。")
             # UserQuestionSelectは問題ごとに作成されるが、get_or_create() で２重回答防止になる
             return redirect("mymath:answer", exam_id=exam_id, number=number)
         
@@ -108,70 +136,79 @@ def exam(request, exam_id, number=1):
                    "exam": exam})
 
 def answer(request, exam_id, number):
-    exam = get_object_or_404(Exam, id=exam_id)
-    questions = Question.objects.filter(exam=exam) #examの問題をリストとしてquestionsとして取得
-    total = len(questions)
-    if not (1 <= number <= total): # exam()のときと同様に処理する
+    user_result = None
+    if request.user.is_authenticated:
+        user_result = get_object_or_404(UserTestResult, id=request.session.get("current_usertestresult_id"))
+    # 問題と正解は受験を始めたときの版のものを表示する
+    snapshot = get_attempt_snapshot_or_404(exam_id, user_result)
+    total = snapshot.exam.question_count # 問題数はExamに保存してある値を使う
+    question = snapshot.question(number) # exam()のときと同様に処理する
+    if question is None:
         raise Http404("問題番号がただしくありません。")
-    question = questions[number - 1] # number=1 なのでnumber-1としてインデックスで問題を取得
+    next_number = snapshot.next_number(number) # 最後の問題のときはNone
     # 未ログインユーザーの処理を先に行う
     if not request.user.is_authenticated:
-        session_exam = request.session.get("exam")
-        qs = session_exam.get("question_select", {})
-        ac = session_exam.get("answer_correct", {})
+        exam_state = load_exam_state(request)
         
-        if (not session_exam 
-            or str(number) not in qs
-            or str(number) not in ac
+        if (not exam_state
+            or exam_state["exam_id"] != exam_id
+            or str(number) not in exam_state["question_select"]
+            or str(number) not in exam_state["answer_correct"]
             ):
             return redirect("mymath:exam", exam_id=exam_id, number=number)
         useranswer = {
-            "select": session_exam["question_select"][str(number)],
-            "correct": session_exam["answer_correct"][str(number)],
+            "select": exam_state["question_select"][str(number)],
+            "correct": exam_state["answer_correct"][str(number)],
         }
         # DjangoのセッションはJSONとしてシリアライズ化され、キーは文字列として保存される
         # 値を取り出すときはstr(number)としなければKeyErrorが発生する。
         
         if request.method == "POST":
-            if number < total:
-                # number = number + 1 として次の試験にリダイレクト。number==total (len(questions))でresultにリダイレト
-                return redirect("mymath:exam", exam_id=exam_id, number= number + 1)
-            if number == total:
-                return redirect("mymath:result", exam_id=exam_id)
+            if next_number is not None:
+                # 次の問題にリダイレクト。最後の問題のときはresultにリダイレト
+                return redirect("mymath:exam", exam_id=exam_id, number=next_number)
+            return redirect("mymath:result", exam_id=exam_id)
         
 
     else: # ログインユーザーの処理
-        result_id = request.session.get("current_usertestresult_id")
-        user_result = get_object_or_404(UserTestResult, id=result_id)
-        useranswer = get_object_or_404(
-            UserQuestionSelect,
-            test_result=user_result,
-            question=question)
+        if user_result.is_archived: # 古い受験の解答は UserTestResult にまとめてある(archive.py)
+            useranswer = user_result.archived_answer(question)
+            if useranswer is None:
+                raise Http404("解答が見つかりません。")
+        else:
+            # 解答をバッファにためているときは、保存される前の解答を先に読む(answer_buffer.py)
+            useranswer = buffered_answer(user_result.id, question.id) or get_object_or_404(
+                UserQuestionSelect,
+                test_result=user_result,
+                question=question)
         if request.method == "POST":
-            if number < total:
-                # number = number + 1 として次の試験にリダイレクト。number==totalでresultにリダイレト
-                return redirect("mymath:exam", exam_id=exam_id, number= number + 1)
-            if number == total:
-                return redirect("mymath:result", exam_id=exam_id)
+            if next_number is not None:
+                # 次の問題にリダイレクト。最後の問題のときはresultにリダイレト
+                return redirect("mymath:exam", exam_id=exam_id, number=next_number)
+            return redirect("mymath:result", exam_id=exam_id)
         
+    stats = QuestionStats.objects.filter(question_id=question.id).first() # 正答率は集計済みの値を読むだけ
     return render(request, "mymath/answer.html",
             {"question": question,
             "useranswer": useranswer,
-            "total": total})
+            "total": total,
+            "is_last": next_number is None,
+            "stats": stats})
 
 
 def result(request, exam_id):
-    exam = Exam.objects.get(id=exam_id)
-    questions = Question.objects.filter(exam=exam) #examの問題をリストとしてquestionsとして取得
+    snapshot = get_attempt_snapshot_or_404(exam_id)
+    exam = snapshot.exam
+    questions = snapshot.questions # examの問題を番号順のタプルとして取得
     # 未ログインユーザーの処理
     if not request.user.is_authenticated:
-        session_exam = request.session["exam"]
-        if not session_exam:
+        exam_state = load_exam_state(request)
+        if not exam_state or exam_state["exam_id"] != exam_id:
             return redirect("mymath:exam", exam_id=exam_id, number=1)
         correct_num = 0
-        for _, correct in session_exam["answer_correct"].items():
+        for _, correct in exam_state["answer_correct"].items():
             correct_num += int(correct)
-        score = correct_num * 10
+        score = correct_num * POINTS_PER_QUESTION
         # user_result をテンプレートにあわせて作成する。user_result.exam.idなども対応できるようにネストで作成する。
         user_result = {
             "count": "*",
@@ -185,28 +222,119 @@ def result(request, exam_id):
         useranswers = []
         for question in questions:
             key = str(question.number)
-            if key in session_exam["answer_correct"]:
+            if key in exam_state["answer_correct"]:
                 useranswers.append({
-                    "correct": session_exam["answer_correct"][key],
+                    "correct": exam_state["answer_correct"][key],
                     "question": {"number": question.number}
                 })
+        # 全問に解答していれば、1回目の受験者の中での順位を表示する(未ログインの結果は分布に加えない)
+        ranking = None
+        if len(useranswers) == len(questions):
+            ranking = get_ranking(exam_id, score, first_attempt=True)
                 
         return render(request, "mymath/result.html",
                 {"user_result": user_result,
-                 "useranswers":useranswers})
+                 "useranswers":useranswers,
+                 "ranking": ranking,
+                 "first_attempt": True,
+                 "leaderboard": get_leaderboard(exam_id)})
 
     else: # ログインユーザー用の処理
-        user_result = get_object_or_404(UserTestResult, id=request.session.get("current_usertestresult_id"))
+        result_id = request.session.get("current_usertestresult_id")
+        # 点数と順位を読むので、バッファにためているこの受験の解答を先に保存する
+        flush_answers(result_id)
+        user_result = get_object_or_404(UserTestResult.objects.select_related("exam"), id=result_id)
             
-        useranswers = UserQuestionSelect.objects.filter(
-            test_result=user_result,)
-        correct_num = 0
-        for useranswer in useranswers:
-            correct_num += int(useranswer.correct) # 正解数
-        score = correct_num * 10 # 得点
-        user_result.score = score
-        user_result.save()
+        questions = get_attempt_snapshot_or_404(exam_id, user_result).questions # 受験を始めたときの版
+        # テンプレートで useranswer.question.number を読むので、問題も1つのクエリでまとめて取得する
+        # アーカイブした受験は UserTestResult にまとめてある解答を使う
+        if user_result.is_archived:
+            useranswers = user_result.archived_answers(questions)
+        elif user_result.exam_version_id:
+            # 版で受験したものは、問題番号と内容も版のものを表示する
+            useranswers = answers_for(UserQuestionSelect.objects.filter(test_result=user_result), questions)
+        else:
+            useranswers = UserQuestionSelect.objects.filter(
+                test_result=user_result,).select_related("question").order_by("question__number")
+        # 点数は解答を記録するときに加算済みなので、ここでは読むだけ
+        # 順位は得点分布から計算する。1回目の受験は1回目の受験者の中で、2回目以降は全受験の中で比べる
+        first_attempt = user_result.count == 1
+        ranking = None
+        if user_result.finished:
+            ranking = get_ranking(exam_id, user_result.score, first_attempt=first_attempt)
         return render(request, "mymath/result.html",
                 {"user_result": user_result,
-                 "useranswers":useranswers})
+                 "useranswers":useranswers,
+                 "ranking": ranking,
+                 "first_attempt": first_attempt,
+                 "leaderboard": get_leaderboard(exam_id)})
+
+
+HISTORY_PAGE_SIZE = 20
+
+
+def _encode_cursor(user_result):
+    # 次のページの先頭を (submitted, id) で表す
+    value = f"{user_result.submitted.isoformat()}|{user_result.id}"
+    return urlsafe_base64_encode(value.encode())
+
+
+def _decode_cursor(cursor):
+    try:
+        submitted, result_id = urlsafe_base64_decode(cursor).decode().split("|")
+        submitted = parse_datetime(submitted)
+        result_id = int(result_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if submitted is None:
+        return None
+    return submitted, result_id
+
+
+@login_required
+def mypage(request):
+    # 受験履歴は OFFSET を使わず、(submitted, id) のキーセットでページを送る。
+    # 何ページ目でもインデックスをたどるだけなので、履歴が増えても遅くならない
+    attempts = UserTestResult.objects.filter(user=request.user).select_related(
+        "exam__category").annotate(question_total=question_total()).order_by("-submitted", "-id")
+    cursor = request.GET.get("cursor")
+    if cursor:
+        decoded = _decode_cursor(cursor)
+        if decoded is None:
+            return HttpResponseBadRequest("cursorが正しくありません。")
+        submitted, result_id = decoded
+        attempts = attempts.filter(
+            Q(submitted__lt=submitted) | Q(submitted=submitted, id__lt=result_id))
+    # 1件多く取得して、次のページがあるか判定する
+    page = list(attempts[:HISTORY_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(page) > HISTORY_PAGE_SIZE:
+        page = page[:HISTORY_PAGE_SIZE]
+        next_cursor = _encode_cursor(page[-1])
+    return render(request, "mymath/mypage.html",
+                  {"attempts": page,
+                   "next_cursor": next_cursor})
+
+
+@staff_member_required
+def export(request, kind):
+    # /export/attempts/?format=csv&exam=1&since=2025-01-01 のように条件を指定してダウンロードする
+    if kind not in EXPORTS:
+        raise Http404("エクスポートの種類が正しくありません。")
+    form = ExportFilterForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+    filters = dict(form.cleaned_data)
+    fmt = filters.pop("format")
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(
+        iter_export(kind, fmt, **filters),
+        content_type=f"{content_type}; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
 
+@staff_member_required
+def metrics(request):
+    # Prometheus から取得する計測値(MetricsMiddleware が記録したもの)
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")